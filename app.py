@@ -10,11 +10,10 @@ import atexit
 from datetime import datetime
 from pathlib import Path
 import time
-from multiprocessing import Process, Queue as mpQueue
 from queue import Queue as tQueue
 import threading
-from selenium.webdriver.common.by import By
 import html
+import uuid
 
 # Add src directory to path
 sys.path.append("src")
@@ -31,8 +30,12 @@ def cleanup_temp_dir():
         except:
             pass  # Ignore cleanup errors
 
-from agent.workflow import Summary
-from crawl.crawling import bns_crawler
+# Only the latest chapter summaries are kept in the session, the full record is in the summary files
+MAX_STREAMING_SUMMARIES = 50
+
+# agent.workflow (llama-index, google-genai) and crawl.crawling (selenium, webdriver-manager)
+# are imported inside the functions that start a crawl or a summary. Streamlit re-runs this
+# script on every interaction, so nothing heavy should be imported at module level.
 
 # Page config
 st.set_page_config(
@@ -159,6 +162,8 @@ def init_session_state():
         st.session_state.temp_dir = tempfile.mkdtemp(prefix="story_crawler_")
     if 'streaming_summaries' not in st.session_state:
         st.session_state.streaming_summaries = []
+    if 'summary_count' not in st.session_state:
+        st.session_state.summary_count = 0
     if 'story_to_summarize' not in st.session_state:
         st.session_state.story_to_summarize = None
     if 'summary_thread' not in st.session_state:
@@ -167,6 +172,12 @@ def init_session_state():
         st.session_state.summary_queue = None
     if 'final_summary' not in st.session_state:
         st.session_state.final_summary = None
+    if 'session_id' not in st.session_state:
+        st.session_state.session_id = uuid.uuid4().hex
+    if 'story_files' not in st.session_state:
+        st.session_state.story_files = None
+    if 'partial_summary' not in st.session_state:
+        st.session_state.partial_summary = None
 
 
 def load_crawl_history():
@@ -189,6 +200,13 @@ def save_crawl_history(history):
     except Exception as e:
         st.error(f"Error saving history: {e}")
 
+def release_story():
+    """Drop this session's reference on the cached story it was summarizing"""
+    url = st.session_state.get('story_in_use')
+    if url:
+        get_story_cache().release(url, st.session_state.session_id)
+        st.session_state.story_in_use = None
+
 def add_chat_message(message_type, content, timestamp=None):
     """Add message to chat history"""
     if timestamp is None:
@@ -227,46 +245,105 @@ def create_safe_folder_name(story_name):
         safe_name = f"story_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
     return safe_name
 
-def crawler_process(url, username, password, temp_dir, n_chapters, queue):
-    """This function runs in a separate process to avoid blocking the Streamlit UI."""
-    from crawl.crawling import bns_crawler
+@st.cache_resource
+def get_browser_pool():
+    """Warm Chrome drivers and saved login sessions shared by every crawl of this server"""
+    from crawl.browser_pool import BrowserPool
+    pool = BrowserPool(size=int(os.getenv("BROWSER_POOL_SIZE", "2")), headless=True)
+    atexit.register(pool.close)
+    return pool
+
+@st.cache_resource
+def get_story_cache():
+    """Crawled chapters shared by every session on this host"""
+    from crawl.story_cache import StoryCache
+    max_gb = float(os.getenv("STORY_CACHE_MAX_GB", "2"))
+    return StoryCache(max_bytes=int(max_gb * 1024 ** 3))
+
+@st.cache_resource
+def get_job_scheduler():
+    """Background jobs that were parked when a daily quota ran out, resumed after the reset"""
+    from agent.jobs import JobScheduler
+    from dotenv import load_dotenv
+    load_dotenv()
+    scheduler = JobScheduler(os.getenv("JOBS_DIR", "jobs"))
+    scheduler.start()
+    return scheduler
+
+def crawler_process(pool, cache, url, username, password, temp_dir, n_chapters, queue, start_chapter=1, holder=None):
+    """
+    Crawls the chapters of start_chapter..start_chapter+n_chapters-1 that are not in the story
+    cache yet, on a driver leased from the browser pool, in a thread so the driver stays warm.
+    The cached story is referenced for `holder` as it is looked up.
+    """
+    end_chapter = start_chapter + n_chapters - 1
     try:
-        crawler = bns_crawler(url, temp_dir, n_chapters=n_chapters, headless=True)
-        actual_story_name = crawler.extract_content(username, password)
-        if actual_story_name:
-            queue.put({"status": "success", "result": actual_story_name})
-        else:
-            queue.put({"status": "error", "result": "Failed to extract story name."})
+        missing = cache.missing(url, start_chapter, end_chapter)
+        if missing:
+            with pool.lease(url, username, password, temp_dir, start_chapter=missing[0], end_chapter=missing[-1]) as crawler:
+                actual_story_name = crawler.extract_content(username, password)
+                total_chapters = crawler.total_chapters
+            if not actual_story_name:
+                queue.put({"status": "error", "result": "Failed to extract story name."})
+                return
+            cache.ingest(url, actual_story_name, os.path.join(temp_dir, actual_story_name), total=total_chapters)
+        hit = cache.lookup(url, start_chapter, end_chapter, partial=True, holder=holder)
+        if hit is None:
+            queue.put({"status": "error", "result": "No chapters could be crawled."})
+            return
+        name, story_files = hit
+        queue.put({"status": "success", "result": name, "files": story_files, "cached": not missing})
     except Exception as e:
         queue.put({"status": "error", "result": str(e)})
-    finally:
-        try:
-            if 'crawler' in locals() and hasattr(crawler, 'driver'):
-                crawler.driver.quit()
-        except:
-            pass
 
-async def generate_summary_async(queue, safe_folder_name, temp_dir, start_chapter, max_chapters, gather_chapters,
+async def generate_summary_async(queue, safe_folder_name, story_files, start_chapter, max_chapters, gather_chapters,
                                big_summary_interval, quota_per_minute, summary_time_per_chapter,
-                               short_summaries=None, long_summaries=None, characters="", api_key=None):
+                               short_summaries=None, long_summaries=None, characters="", api_key=None, keep_ratio=1.0,
+                               dedup=False, importance=False, budget=False):
     """Asynchronously generates summaries and puts them in a queue."""
     try:
         # Set environment variable as backup
         if api_key:
             os.environ['GOOGLE_API_KEY'] = api_key
-        story_files = []
-        for item in os.listdir(temp_dir):
-            item_path = os.path.join(temp_dir, item)
-            if os.path.isdir(item_path):
-                txt_files = [f for f in os.listdir(item_path) if f.endswith('.txt')]
-                if txt_files:
-                    story_files = [os.path.join(item_path, f) for f in sorted(txt_files)]
-                    break
         if not story_files:
-            raise Exception("No story files found in temporary directory")
-        from agent.workflow import BookSummary, ProgressSummaryEvent
+            raise Exception("No story files to summarize")
+        from agent.workflow import BookSummary, ProgressSummaryEvent, SummaryDeltaEvent, QuotaExhausted
+        from agent.jobs import default_api_key, quota_key
+        from agent.dedup import dedup_chapters, format_report
+        from agent.importance import importance_batches, format_report as format_importance_report
+        from agent.budget import OutputBudget
+        from agent.compress import ExtractiveCompressor
+        story_files = story_files[start_chapter:]
+        chapter_spans = None
+        if dedup:
+            # Reposted chapters and author announcements are skipped before batching
+            story_files, dedup_report = dedup_chapters(story_files)
+            print(format_report(dedup_report))
+            chapter_spans = dedup_report["spans"]
+        batches = None
+        if importance:
+            # Filler chapters are merged into larger batches, so they cost fewer calls
+            batches, importance_report = importance_batches(story_files[:max_chapters], gather_chapters, big_summary_interval, characters)
+            print(format_importance_report(importance_report))
+        if summary_time_per_chapter is None:
+            from agent.planner import RunPlanner
+            plan = RunPlanner(story_files, quota_per_minute=quota_per_minute).plan(
+                gather_chapters, big_summary_interval, max_chapters, batches)
+            timeout = plan["timeout"]
+        else:
+            timeout = (len(batches) if batches else max_chapters // gather_chapters) * summary_time_per_chapter
+        llm = None
+        fake_latency = os.getenv("AUTOSUMMARY_FAKE_LLM")
+        if fake_latency:
+            # Load tests (scripts/load_test.py): offline replies and no per-minute quota to wait on
+            from agent.fake_llm import FakeLLM
+            llm, quota_per_minute = FakeLLM(float(fake_latency)), 10**6
+        scheduler = get_job_scheduler()
+        # Without a key of its own the run uses the scheduler's first pool key (as
+        # BookSummary resolves it), so it is charged to that key's quota bucket
+        run_key = api_key or default_api_key()
         w = BookSummary(
-            story_files[start_chapter:],
+            story_files,
             big_summary_interval=big_summary_interval,
             max_chapters=max_chapters,
             gather_chapters=gather_chapters,
@@ -275,12 +352,22 @@ async def generate_summary_async(queue, safe_folder_name, temp_dir, start_chapte
             initial_long_summaries=long_summaries or [],
             initial_characters=characters,
             api_key=api_key,
-            timeout=max_chapters // gather_chapters * summary_time_per_chapter
+            llm=llm,
+            stream=True,
+            chapter_spans=chapter_spans,
+            batches=batches,
+            compressor=ExtractiveCompressor(keep_ratio) if keep_ratio < 1 else None,
+            budget=OutputBudget() if budget else None,
+            quota_store=scheduler.quota_store,
+            quota_key=quota_key(run_key, scheduler.model),
+            timeout=timeout,
         )
         current_chapter = 0
         handler = w.run()
         async for ev in handler.stream_events():
-            if isinstance(ev, ProgressSummaryEvent):
+            if isinstance(ev, SummaryDeltaEvent):
+                queue.put({"status": "partial", "kind": ev.kind, "text": ev.text})
+            elif isinstance(ev, ProgressSummaryEvent):
                 current_chapter += 1
                 chapter_summary = {
                     "chapter": current_chapter,
@@ -288,7 +375,16 @@ async def generate_summary_async(queue, safe_folder_name, temp_dir, start_chapte
                     "timestamp": datetime.now().strftime("%H:%M:%S")
                 }
                 queue.put(chapter_summary)
-        result = await handler
+        try:
+            result = await handler
+        except QuotaExhausted as e:
+            # The daily quota of this key is used up: hand the rest to the job scheduler
+            settings = {"gather_chapters": gather_chapters, "big_summary_interval": big_summary_interval,
+                        "quota_per_minute": quota_per_minute, "chapter_spans": chapter_spans, "batches": batches,
+                        "budget": budget, "keep_ratio": keep_ratio, "stream": True}
+            job_id = scheduler.submit(story_files, safe_folder_name, settings, w.checkpoint(), api_key=api_key, reset_at=e.reset_at)
+            queue.put({"status": "parked", "job_id": job_id, "reset_at": e.reset_at})
+            return
         queue.put({"status": "done", "summary": str(result).strip()})
     except Exception as e:
         queue.put({"status": "error", "message": str(e)})
@@ -298,12 +394,14 @@ def run_summary_in_thread(queue, *args):
     asyncio.run(generate_summary_async(queue, *args))
 
 def main():
+    """Renders the page. Returns True when the summary is still running and the page should poll again."""
     init_session_state()
     st.title("📚 Story Summary AI")
     st.markdown("*Automated story crawling and AI-powered summarization*")
     with st.sidebar:
         if st.button("📝 New Summary Session", use_container_width=True):
             # Clear all session state to start fresh
+            release_story()
             for key in list(st.session_state.keys()):
                 if key != 'temp_dir': # Keep the temp dir
                     del st.session_state[key]
@@ -314,6 +412,8 @@ def main():
             google_api_key = st.text_input("Google Gemini API Key", type="password", help="Enter your Google Gemini API key")
             if google_api_key:
                 st.session_state.google_api_key = google_api_key
+                # Jobs parked with this key before a restart can run again
+                get_job_scheduler().provide_key(google_api_key)
         with st.expander("🌐 Website Credentials", expanded=True):
             username = st.text_input("Enter your Username", help="Bach Ngoc Sach login username", placeholder='Bach Ngoc Sach login username')
             password = st.text_input("Enter your Password", type="password", help="Bach Ngoc Sach login password", placeholder='Bach Ngoc Sach login password')
@@ -331,6 +431,25 @@ def main():
                         st.rerun()
         else:
             st.info("No stories found. Start by crawling a new story!")
+        jobs = get_job_scheduler().jobs()
+        if jobs:
+            st.divider()
+            st.header("⏳ Background Jobs")
+            for job in reversed(jobs):
+                status = job["status"]
+                if status == "parked" and job["reset_at"]:
+                    status += f" until {datetime.fromtimestamp(job['reset_at']):%Y-%m-%d %H:%M}"
+                if job.get("key_missing"):
+                    status += ", needs its API key"
+                with st.expander(f"{job['name']} ({status})", expanded=False):
+                    st.write(f"**Job:** {job['id']}")
+                    if job["error"]:
+                        st.write(f"**Error:** {job['error']}")
+                    if job.get("key_missing"):
+                        st.write("**Waiting:** the API key this job was submitted with is gone after a restart. Enter it again under API Configuration to resume the job.")
+                    if job["result"] and st.button("Show summary", key=f"job_{job['id']}"):
+                        st.session_state.final_summary = job["result"]
+                        st.rerun()
         if st.button("🗑️ Clear Chat"):
             st.session_state.chat_history = []
             st.rerun()
@@ -361,12 +480,21 @@ def main():
             col_a, col_b = st.columns(2)
             with col_a:
                 n_chapters = st.number_input("Chapters to Crawl and Summarize", min_value=1, value=100)
+                start_chapter = st.number_input("Start from Chapter", min_value=1, value=1)
             with col_b:
                 gather_chapters = st.number_input("Gather n Chapters and summary 1 time", min_value=1, value=10)
+                keep_ratio = st.slider("Chapter text kept", min_value=0.2, max_value=1.0, value=1.0, step=0.1,
+                                       help="Below 1, each chapter is cut to its most central sentences before it is sent, so more chapters fit per call")
+                dedup = st.checkbox("Skip reposts and announcements", value=False,
+                                    help="Near-duplicate chapters and short pages titled as author notices are not summarized")
+                importance = st.checkbox("Merge filler chapters", value=False,
+                                         help="Chapters scored as filler count half towards a batch, so they take fewer calls")
+                budget = st.checkbox("Cap summary length", value=False,
+                                     help="Each stage gets an output-length target, and summaries far over it are cut to their highest-ranked sentences")
             big_summary_interval = gather_chapters*5 
             max_chapters = n_chapters
             quota_per_minute = 15
-            summary_time_per_chapter = 60
+            summary_time_per_chapter = None  # workflow timeout comes from the planner
             crawl_and_summarize = st.form_submit_button("🚀 Crawl & Summarize", type="primary")
 
         st.divider()
@@ -374,19 +502,25 @@ def main():
         streaming_placeholder = st.empty()
         
         # UI rendering logic for summaries
-        if st.session_state.streaming_summaries:
+        partial = st.session_state.partial_summary if st.session_state.operation_status == "summarizing" else None
+        if partial and partial["text"]:
+            with streaming_placeholder.container():
+                label = "Final Summary" if partial["kind"] == "final" else f"Chapter {st.session_state.summary_count + 1} Summary"
+                st.info(f"✍️ {label} (streaming)...")
+                display_summary_box(partial["text"])
+        elif st.session_state.streaming_summaries:
             with streaming_placeholder.container():
                 if st.session_state.operation_status == "summarizing":
                     st.info("🔄 Processing chapters...")
                 else:
-                    st.success(f"✅ Completed! Processed {len(st.session_state.streaming_summaries)} chapters")
+                    st.success(f"✅ Completed! Processed {st.session_state.summary_count} chapters")
                 
                 latest_summary = st.session_state.streaming_summaries[-1]
                 st.subheader(f"Chapter {latest_summary['chapter']} Summary:")
                 display_summary_box(latest_summary['summary'])
                 
                 if len(st.session_state.streaming_summaries) > 1:
-                    with st.expander(f"📚 View All {len(st.session_state.streaming_summaries)} Processed Chapters"):
+                    with st.expander(f"📚 View Last {len(st.session_state.streaming_summaries)} of {st.session_state.summary_count} Processed Chapters"):
                         for chap in st.session_state.streaming_summaries:
                             st.subheader(f"Chapter {chap['chapter']} ({chap['timestamp']}):")
                             display_summary_box(chap['summary'])
@@ -400,21 +534,28 @@ def main():
             else:
                 add_chat_message("user", f"🚀 Starting new crawl and summary for: {story_url}")
                 st.session_state.streaming_summaries = []
+                st.session_state.partial_summary = None
+                st.session_state.summary_count = 0
                 st.session_state.final_summary = None
                 st.session_state.operation_status = "crawling"
                 st.rerun()
 
         if st.session_state.operation_status == "crawling":
             add_chat_message("system", "🕷️ Crawling in progress...")
-            queue = mpQueue()
-            p = Process(target=crawler_process, args=(story_url, username, password, st.session_state.temp_dir, n_chapters, queue))
-            p.start()
-            p.join()
+            queue = tQueue()
+            t = threading.Thread(target=crawler_process, args=(get_browser_pool(), get_story_cache(), story_url, username, password, st.session_state.temp_dir, n_chapters, queue, start_chapter, st.session_state.session_id))
+            t.start()
+            t.join()
             if not queue.empty():
                 result = queue.get()
                 if result["status"] == "success":
-                    add_chat_message("system", f"✅ Crawling successful: {result['result']}")
+                    if result["cached"]:
+                        add_chat_message("system", f"⚡ Using cached chapters: {result['result']}")
+                    else:
+                        add_chat_message("system", f"✅ Crawling successful: {result['result']}")
                     st.session_state.story_to_summarize = result['result']
+                    st.session_state.story_files = result['files']
+                    st.session_state.story_in_use = story_url
                     st.session_state.operation_status = "summarizing"
                 else:
                     add_chat_message("error", f"❌ Crawling failed: {result['result']}")
@@ -427,10 +568,13 @@ def main():
                 st.session_state.summary_queue = tQueue()
                 safe_folder_name = create_safe_folder_name(st.session_state.story_to_summarize)
                 api_key = st.session_state.get('google_api_key', None)
-                args = (st.session_state.summary_queue, safe_folder_name, st.session_state.temp_dir, 0, max_chapters, gather_chapters,
-                        big_summary_interval, quota_per_minute, summary_time_per_chapter, None, None, "", api_key)
+                args = (st.session_state.summary_queue, safe_folder_name, st.session_state.story_files, 0, max_chapters, gather_chapters,
+                        big_summary_interval, quota_per_minute, summary_time_per_chapter, None, None, "", api_key, keep_ratio, dedup, importance, budget)
                 st.session_state.summary_thread = threading.Thread(target=run_summary_in_thread, args=args, daemon=True)
                 st.session_state.summary_thread.start()
+                # The chapter files must outlive this browser session if the run does
+                get_story_cache().acquire(st.session_state.story_in_use, st.session_state.session_id,
+                                          alive=st.session_state.summary_thread.is_alive)
 
             # Check the queue for updates from the summary thread
             while not st.session_state.summary_queue.empty():
@@ -441,21 +585,36 @@ def main():
                     st.session_state.operation_status = "ready"
                     st.session_state.summary_thread = None
                     st.session_state.story_to_summarize = None
+                    release_story()
                     st.rerun()
                 elif isinstance(item, dict) and item.get("status") == "error":
                      add_chat_message("error", f"❌ Summarization failed: {item['message']}")
                      st.session_state.operation_status = "ready"
                      st.session_state.summary_thread = None
+                     release_story()
                      st.rerun()
+                elif isinstance(item, dict) and item.get("status") == "parked":
+                    reset = datetime.fromtimestamp(item["reset_at"]).strftime("%Y-%m-%d %H:%M")
+                    add_chat_message("system", f"⏸️ Daily API quota used up. The summary continues as background job {item['job_id']} after {reset}.")
+                    st.session_state.operation_status = "ready"
+                    st.session_state.summary_thread = None
+                    st.session_state.story_to_summarize = None
+                    release_story()
+                    st.rerun()
+                elif isinstance(item, dict) and item.get("status") == "partial":
+                    st.session_state.partial_summary = item
                 else:
+                    st.session_state.partial_summary = None
                     st.session_state.streaming_summaries.append(item)
+                    st.session_state.summary_count += 1
+                    del st.session_state.streaming_summaries[:-MAX_STREAMING_SUMMARIES]
             
             if st.session_state.summary_thread and st.session_state.summary_thread.is_alive():
-                time.sleep(2)
-                st.rerun()
+                return True
             else: # Thread might have finished, do one last check and clean up
                 st.session_state.operation_status = "ready"
                 st.session_state.summary_thread = None
+                release_story()
                 st.rerun()
 
     st.divider()
@@ -469,4 +628,11 @@ def main():
         display_chat_history()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    from profiling import span
+    with span("ui.render"):
+        poll = main()
+    if poll:
+        # Idle wait for the summary thread, kept out of the render time
+        with span("ui.poll"):
+            time.sleep(2)
+        st.rerun()
\ No newline at end of file
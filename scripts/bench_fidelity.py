@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+Cost versus fidelity of the summarization settings.
+
+Runs BookSummary over a fixed corpus for every combination of --gather, --interval
+(in batches per roll-up) and --modes, and reports per configuration:
+- LLM calls, input and output tokens (estimated) and wall time
+- character recall: share of the reference characters named in the final character
+  list or the final summary
+- overlap: unigram and bigram F1 of the final summary against a reference summary
+  (--reference-summary, or else the output of the first configuration, which should
+  be the densest one)
+At the end the cheapest configuration (fewest calls, then least input) that meets
+--min-recall and --min-overlap is named.
+
+The default corpus is a synthetic story with a main cast in every chapter and minor
+characters in a few, and its reference characters are the ones in at least three
+chapters. --story-dir uses real chapters instead, with --reference-characters (one
+"name: ..." per line). Responses come from the offline FakeLLM, or from a cassette:
+--record CASSETTE sends unseen prompts to Gemini and stores them, --replay CASSETTE
+reruns a recorded sweep with no API calls.
+
+Usage:
+    uv run python scripts/bench_fidelity.py
+    uv run python scripts/bench_fidelity.py --gather 5 10 20 --interval 5 10 --modes chained compress importance
+    uv run python scripts/bench_fidelity.py --story-dir "story/<name>" --max-chapters 200 --record fidelity.jsonl
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import time
+import unicodedata
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, "src", "agent"))
+
+SYLLABLES = ["Lý", "Hạo", "Trần", "Phàm", "Lâm", "Vân", "Tô", "Minh", "Hàn", "Lập", "Diệp", "Phong", "Mộ", "Dung", "Thanh", "Tuyết"]
+WORDS = "hắn đi qua núi rừng gặp yêu thú rồi tu luyện công pháp trong động phủ suốt ba ngày đêm không nghỉ".split()
+MODES = ("chained", "bounded", "lookahead", "budget", "compress", "importance")
+WORD_RE = re.compile(r"\w+")
+
+def write_story(story_dir: str, n_chapters: int, seed: int = 0):
+    """Chapters with a main cast of 4 and minor characters who each appear in a short arc; returns each name's chapter count"""
+    rng = random.Random(seed)
+    names = [f"{a} {b}" for a in SYLLABLES for b in SYLLABLES if a != b]
+    rng.shuffle(names)
+    main, minor = names[:4], names[4:]
+    arcs = {}
+    for name in minor[:max(1, n_chapters // 3)]:
+        start = rng.randrange(n_chapters)
+        arcs[name] = range(start, min(n_chapters, start + rng.randint(1, 6)))
+    appearances = Counter()
+    for i in range(n_chapters):
+        cast = main[:2 + i % 3] + [name for name, arc in arcs.items() if i in arc]
+        appearances.update(cast)
+        sentences = []
+        for _ in range(60):
+            words = rng.choices(WORDS, k=rng.randint(8, 16))
+            if rng.random() < 0.5:
+                words.insert(rng.randint(1, len(words)), rng.choice(cast))
+            sentence = " ".join(words)
+            sentences.append(sentence[0].upper() + sentence[1:] + ".")
+        with open(os.path.join(story_dir, f"{i + 1:05d}_chuong.txt"), "w", encoding="utf-8") as f:
+            f.write(f"Chương {i + 1}\n\n" + "\n".join(sentences) + "\n")
+    return appearances
+
+def tokens(text: str):
+    return WORD_RE.findall(unicodedata.normalize("NFC", text).lower())
+
+def ngram_f1(candidate: str, reference: str, n: int) -> float:
+    def grams(words):
+        return Counter(tuple(words[i:i + n]) for i in range(len(words) - n + 1))
+    cand, ref = grams(tokens(candidate)), grams(tokens(reference))
+    common = sum((cand & ref).values())
+    if not common:
+        return 0.0
+    precision, recall = common / sum(cand.values()), common / sum(ref.values())
+    return 2 * precision * recall / (precision + recall)
+
+def character_recall(reference: list, characters: str, summary: str) -> float:
+    if not reference:
+        return None
+    haystack = unicodedata.normalize("NFC", characters + "\n" + summary).lower()
+    return sum(1 for name in reference if unicodedata.normalize("NFC", name).lower() in haystack) / len(reference)
+
+def make_llm(args):
+    from fake_llm import FakeLLM, ReplayLLM
+    if args.replay:
+        return ReplayLLM(args.replay)
+    if args.record:
+        from dotenv import load_dotenv
+        from llama_index.llms.google_genai import GoogleGenAI
+        from prompt import SYSTEM_PROMPT
+        load_dotenv()
+        return ReplayLLM(args.record, inner=GoogleGenAI(model=args.model, system_prompt=SYSTEM_PROMPT))
+    return FakeLLM(args.llm_latency)
+
+async def run_config(story_paths, gather: int, per_rollup: int, mode: str, args) -> dict:
+    from workflow import BookSummary
+    from planner import estimate_tokens
+    llm = make_llm(args)
+    extra = {}
+    spill_dir = None
+    if mode == "bounded":
+        spill_dir = tempfile.mkdtemp(prefix="bench_spill_")
+        extra = {"bounded_memory": True, "spill_dir": spill_dir}
+    elif mode == "lookahead":
+        extra = {"lookahead": 2}
+    elif mode == "budget":
+        from budget import OutputBudget
+        extra = {"budget": OutputBudget()}
+    elif mode == "compress":
+        from compress import ExtractiveCompressor
+        extra = {"compressor": ExtractiveCompressor(args.keep_ratio)}
+    elif mode == "importance":
+        from importance import importance_batches
+        extra = {"batches": importance_batches(story_paths, gather, gather * per_rollup)[0]}
+    w = BookSummary(
+        story_paths,
+        gather_chapters=gather,
+        max_chapters=len(story_paths),
+        big_summary_interval=gather * per_rollup,
+        # Only a recording run talks to the API and has to respect its quotas
+        quota_per_minute=args.quota_per_minute if args.record else 10**9,
+        daily_quota=1500 if args.record else 10**9,
+        llm=llm,
+        timeout=None,
+        **extra,
+    )
+    start = time.perf_counter()
+    with open(os.devnull, "w") as devnull:
+        real_stdout, sys.stdout = sys.stdout, devnull
+        try:
+            result = str(await w.run()).strip()
+        finally:
+            sys.stdout = real_stdout
+    seconds = time.perf_counter() - start
+    if spill_dir:
+        shutil.rmtree(spill_dir, ignore_errors=True)
+    return {
+        "gather": gather,
+        "interval": gather * per_rollup,
+        "mode": mode,
+        "calls": llm.calls,
+        "input_tokens": estimate_tokens(llm.input_chars),
+        "output_tokens": estimate_tokens(llm.output_chars),
+        "seconds": seconds,
+        "characters": (w.resume_state or {}).get("characters", ""),
+        "summary": result,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Calls, tokens and time versus summary fidelity across settings")
+    parser.add_argument("--gather", type=int, nargs="+", default=[5, 10, 20])
+    parser.add_argument("--interval", type=int, nargs="+", default=[5, 10], help="batches per roll-up")
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=["chained", "compress", "importance"])
+    parser.add_argument("--chapters", type=int, default=200, help="length of the synthetic story")
+    parser.add_argument("--story-dir", help="real chapters instead of the synthetic story")
+    parser.add_argument("--max-chapters", type=int, default=200)
+    parser.add_argument("--reference-characters", help="file with the reference character list")
+    parser.add_argument("--reference-summary", help="file with the reference summary")
+    parser.add_argument("--keep-ratio", type=float, default=0.4, help="for the compress mode")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="FakeLLM seconds per call")
+    parser.add_argument("--record", metavar="CASSETTE", help="call Gemini for unrecorded prompts and store them")
+    parser.add_argument("--replay", metavar="CASSETTE", help="only use recorded responses")
+    parser.add_argument("--model", default="models/gemini-2.0-flash")
+    parser.add_argument("--quota-per-minute", type=int, default=15, help="when recording")
+    parser.add_argument("--min-recall", type=float, default=0.8)
+    parser.add_argument("--min-overlap", type=float, default=0.3, help="bigram F1")
+    parser.add_argument("--out", help="write the results as JSON")
+    args = parser.parse_args()
+
+    story_dir = args.story_dir
+    reference_characters = []
+    if story_dir is None:
+        story_dir = tempfile.mkdtemp(prefix="bench_fidelity_")
+        appearances = write_story(story_dir, args.chapters)
+        reference_characters = [name for name, count in appearances.items() if count >= 3]
+    if args.reference_characters:
+        from characters import character_names
+        with open(args.reference_characters, "r", encoding="utf-8") as f:
+            reference_characters = character_names(f.read())
+    reference_summary = None
+    if args.reference_summary:
+        with open(args.reference_summary, "r", encoding="utf-8") as f:
+            reference_summary = f.read()
+
+    story_paths = sorted(os.path.join(story_dir, f) for f in os.listdir(story_dir) if f.endswith(".txt"))[:args.max_chapters]
+    results = []
+    try:
+        print(f"{'gather':>6} {'interval':>8} {'mode':<10} {'calls':>6} {'in tok':>9} {'out tok':>8} {'seconds':>8} {'recall':>7} {'uni F1':>7} {'bi F1':>7}")
+        for gather, per_rollup, mode in itertools.product(args.gather, args.interval, args.modes):
+            r = asyncio.run(run_config(story_paths, gather, per_rollup, mode, args))
+            if reference_summary is None:
+                reference_summary = r["summary"]
+            r["recall"] = character_recall(reference_characters, r["characters"], r["summary"])
+            r["unigram_f1"] = ngram_f1(r["summary"], reference_summary, 1)
+            r["bigram_f1"] = ngram_f1(r["summary"], reference_summary, 2)
+            results.append(r)
+            recall = f"{r['recall']:>7.2f}" if r["recall"] is not None else f"{'-':>7}"
+            print(f"{gather:>6} {r['interval']:>8} {mode:<10} {r['calls']:>6} {r['input_tokens']:>9} {r['output_tokens']:>8} "
+                  f"{r['seconds']:>8.2f} {recall} {r['unigram_f1']:>7.2f} {r['bigram_f1']:>7.2f}")
+    finally:
+        if args.story_dir is None:
+            shutil.rmtree(story_dir, ignore_errors=True)
+
+    passing = [r for r in results if (r["recall"] is None or r["recall"] >= args.min_recall) and r["bigram_f1"] >= args.min_overlap]
+    if passing:
+        best = min(passing, key=lambda r: (r["calls"], r["input_tokens"]))
+        print(f"Cheapest configuration with recall >= {args.min_recall} and bigram F1 >= {args.min_overlap}: "
+              f"gather {best['gather']}, interval {best['interval']}, {best['mode']} ({best['calls']} calls, {best['input_tokens']} input tokens)")
+    else:
+        print(f"No configuration has recall >= {args.min_recall} and bigram F1 >= {args.min_overlap}")
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump([{k: v for k, v in r.items() if k != "summary"} for r in results], f, ensure_ascii=False, indent=2)
+
+if __name__ == "__main__":
+    main()
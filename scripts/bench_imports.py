@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Import-time budget for the UI and CLI entry points.
+
+Each target is imported in a fresh interpreter several times and the median wall
+time is compared with its budget. The check also fails if a target pulls in a
+dependency that should only load once a crawl or summary starts.
+
+Usage:
+    uv run python scripts/bench_imports.py
+    uv run python scripts/bench_imports.py --repeat 7 --scale 1.5
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# target -> (import statement, budget in seconds, modules that must not be loaded)
+TARGETS = {
+    "streamlit": ("import streamlit", None, []),
+    "app": ("import app", 1.0, ["selenium", "webdriver_manager", "llama_index", "google.genai"]),
+    "workflow": ("import workflow", 2.5, ["google.genai", "llama_index.llms.google_genai", "llama_index.utils"]),
+    "crawling": ("import crawling", 0.8, ["webdriver_manager"]),
+}
+
+PROBE = """
+import json, sys, time
+sys.path[:0] = {paths!r}
+start = time.perf_counter()
+{statement}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"seconds": elapsed, "modules": sorted(sys.modules)}}))
+"""
+
+def measure(statement: str, repeat: int):
+    paths = [ROOT, os.path.join(ROOT, "src"), os.path.join(ROOT, "src", "agent"), os.path.join(ROOT, "src", "crawl")]
+    timings = []
+    modules = []
+    for _ in range(repeat):
+        out = subprocess.run(
+            [sys.executable, "-c", PROBE.format(paths=paths, statement=statement)],
+            cwd=ROOT, capture_output=True, text=True, check=True,
+        )
+        result = json.loads(out.stdout.strip().splitlines()[-1])
+        timings.append(result["seconds"])
+        modules = result["modules"]
+    return statistics.median(timings), modules
+
+def main():
+    parser = argparse.ArgumentParser(description="Import-time regression check")
+    parser.add_argument("--repeat", type=int, default=5, help="fresh interpreters per target")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiply every budget, for slow machines")
+    args = parser.parse_args()
+
+    failed = False
+    print(f"{'target':<10} {'median':>8} {'budget':>8}  status")
+    for name, (statement, budget, forbidden) in TARGETS.items():
+        try:
+            seconds, modules = measure(statement, args.repeat)
+        except subprocess.CalledProcessError as e:
+            print(f"{name:<10} {'-':>8} {'-':>8}  ERROR {e.stderr.strip().splitlines()[-1]}")
+            failed = True
+            continue
+        loaded = [m for m in forbidden if m in modules]
+        status = "ok"
+        if budget is not None and seconds > budget * args.scale:
+            status = "OVER BUDGET"
+        if loaded:
+            status = f"EAGER IMPORT {', '.join(loaded)}"
+        failed = failed or status != "ok"
+        budget_str = f"{budget * args.scale:.2f}s" if budget is not None else "-"
+        print(f"{name:<10} {seconds:>7.2f}s {budget_str:>8}  {status}")
+
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Memory benchmark for long stories.
+
+Runs BookSummary with the offline FakeLLM over synthetic stories of increasing
+length, each run in a fresh process, and reports peak RSS for the default and the
+bounded-memory mode. Replies are --summary-chars long (4000 by default, about a real
+batch summary; roll-ups are twice that), so the roll-ups the default mode keeps in
+RAM and resends with every batch add up over a long story.
+
+"loop peak" is the highest RSS seen while batches are summarized, "peak" includes the
+final rewrite, which holds every roll-up in one prompt in both modes. The check fails
+if the bounded-mode loop peak grows by more than --max-growth between the shortest
+and the longest story, or if its growth is not below --max-ratio times the default
+mode's.
+
+Usage:
+    uv run python scripts/bench_memory.py
+    uv run python scripts/bench_memory.py --chapters 100 1000 10000 --max-growth 0.1 --max-ratio 0.5
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, "src", "agent"))
+
+SYLLABLES = ["Lý", "Hạo", "Trần", "Phàm", "Lâm", "Vân", "Tô", "Minh", "Hàn", "Lập", "Diệp", "Phong", "Mộ", "Dung", "Thanh", "Tuyết"]
+WORDS = "hắn đi qua núi rừng gặp yêu thú rồi tu luyện công pháp trong động phủ suốt ba ngày đêm không nghỉ".split()
+
+def write_story(story_dir: str, n_chapters: int, seed: int = 0):
+    rng = random.Random(seed)
+    names = [f"{a} {b}" for a in SYLLABLES for b in SYLLABLES if a != b][:150]
+    for i in range(n_chapters):
+        sentences = []
+        for _ in range(60):
+            words = rng.choices(WORDS, k=rng.randint(8, 16))
+            if rng.random() < 0.3:
+                words.insert(rng.randint(1, len(words)), rng.choice(names))
+            sentences.append(" ".join(words).capitalize() + ".")
+        with open(os.path.join(story_dir, f"{i + 1:05d}_chuong.txt"), "w", encoding="utf-8") as f:
+            f.write(f"Chương {i + 1}\n\n" + "\n".join(sentences) + "\n")
+
+def current_rss_kb() -> int:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+async def run_child(story_dir: str, n_chapters: int, bounded: bool, gather: int, interval: int, summary_chars: int = 400):
+    from workflow import BookSummary, ProgressSummaryEvent
+    from fake_llm import FakeLLM
+
+    story_paths = sorted(os.path.join(story_dir, f) for f in os.listdir(story_dir))[:n_chapters]
+    spill_dir = tempfile.mkdtemp(prefix="bench_spill_")
+    w = BookSummary(
+        story_paths,
+        gather_chapters=gather,
+        max_chapters=n_chapters,
+        big_summary_interval=interval,
+        quota_per_minute=10**9,
+        llm=FakeLLM(summary_chars=summary_chars),
+        bounded_memory=bounded,
+        spill_dir=spill_dir,
+        timeout=None,
+    )
+    start = time.perf_counter()
+    handler = w.run()
+    events = 0
+    loop_peak_kb = current_rss_kb()
+    async for ev in handler.stream_events():
+        if isinstance(ev, ProgressSummaryEvent):
+            events += 1
+            loop_peak_kb = max(loop_peak_kb, current_rss_kb())
+    await handler
+    elapsed = time.perf_counter() - start
+    shutil.rmtree(spill_dir, ignore_errors=True)
+    return {
+        "chapters": n_chapters,
+        "bounded": bounded,
+        "events": events,
+        "seconds": elapsed,
+        "loop_peak_mb": loop_peak_kb / 1024,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "end_rss_mb": current_rss_kb() / 1024,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Peak RSS versus story length")
+    parser.add_argument("--chapters", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--gather", type=int, default=10)
+    parser.add_argument("--interval", type=int, default=50)
+    parser.add_argument("--summary-chars", type=int, default=4000, help="length of the fake batch summaries")
+    parser.add_argument("--max-growth", type=float, default=0.1, help="allowed relative loop peak growth in bounded mode")
+    parser.add_argument("--max-ratio", type=float, default=0.5, help="allowed bounded / default loop peak growth")
+    parser.add_argument("--child", nargs=3, metavar=("STORY_DIR", "N", "BOUNDED"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        story_dir, n, bounded = args.child
+        with open(os.devnull, "w") as devnull:
+            real_stdout, sys.stdout = sys.stdout, devnull
+            try:
+                result = asyncio.run(run_child(story_dir, int(n), bounded == "1", args.gather, args.interval, args.summary_chars))
+            finally:
+                sys.stdout = real_stdout
+        print(json.dumps(result))
+        return
+
+    story_dir = tempfile.mkdtemp(prefix="bench_story_")
+    try:
+        write_story(story_dir, max(args.chapters))
+        results = []
+        print(f"{'chapters':>8} {'mode':>8} {'loop peak MB':>13} {'peak MB':>9} {'end MB':>8} {'seconds':>8}")
+        for bounded in (False, True):
+            for n in args.chapters:
+                out = subprocess.run(
+                    [sys.executable, os.path.abspath(__file__), "--gather", str(args.gather), "--interval", str(args.interval),
+                     "--summary-chars", str(args.summary_chars), "--child", story_dir, str(n), "1" if bounded else "0"],
+                    capture_output=True, text=True, check=True,
+                )
+                result = json.loads(out.stdout.strip().splitlines()[-1])
+                results.append(result)
+                mode = "bounded" if bounded else "default"
+                print(f"{n:>8} {mode:>8} {result['loop_peak_mb']:>13.1f} {result['peak_rss_mb']:>9.1f} {result['end_rss_mb']:>8.1f} {result['seconds']:>8.1f}")
+    finally:
+        shutil.rmtree(story_dir, ignore_errors=True)
+
+    def growth(bounded: bool):
+        runs = [r for r in results if r["bounded"] == bounded]
+        return runs[-1]["loop_peak_mb"] - runs[0]["loop_peak_mb"], runs[-1]["loop_peak_mb"] / runs[0]["loop_peak_mb"] - 1
+
+    default_mb, _ = growth(False)
+    bounded_mb, bounded_rel = growth(True)
+    print(f"Loop peak growth {args.chapters[0]} -> {args.chapters[-1]} chapters: "
+          f"default {default_mb:+.1f} MB, bounded {bounded_mb:+.1f} MB ({bounded_rel:+.1%})")
+    checks = [
+        (f"bounded loop peak grows at most {args.max_growth:.0%}", bounded_rel <= args.max_growth),
+        (f"bounded growth below {args.max_ratio:.0%} of default", bounded_mb <= args.max_ratio * max(default_mb, 0.0)),
+    ]
+    for label, ok in checks:
+        print(f"{'ok  ' if ok else 'FAIL'} {label}")
+    sys.exit(0 if all(ok for _, ok in checks) else 1)
+
+if __name__ == "__main__":
+    main()
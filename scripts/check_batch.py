@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Offline check of batch mode with LocalBatchServer.
+
+Runs BatchSummary over a synthetic story with the offline FakeLLM behind a
+LocalBatchServer, and checks that:
+- every batch request comes back through the Gemini JSONL format with the answer the
+  LLM gives for its prompt
+- only the roll-ups and the final rewrite are requested interactively
+- keys the job fails on are requested interactively, with the same final summary
+- a run restarted after submitting polls the saved job instead of submitting again
+It prints the runs and exits with 1 if any check fails.
+
+Usage:
+    uv run python scripts/check_batch.py
+    uv run python scripts/check_batch.py --chapters 120 --gather 5 --interval 4
+"""
+
+import argparse
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, "src", "agent"))
+
+from check_prefix_cache import write_story
+
+def summary(story_paths, backend, llm, work_dir: str, gather: int, interval: int):
+    from batch import BatchSummary
+    return BatchSummary(
+        story_paths,
+        backend,
+        llm=llm,
+        gather_chapters=gather,
+        big_summary_interval=gather * interval,
+        work_dir=work_dir,
+        quota_per_minute=10**6,
+        poll_interval=0.02,
+    )
+
+async def quiet(coro):
+    with open(os.devnull, "w") as devnull:
+        real_stdout, sys.stdout = sys.stdout, devnull
+        try:
+            return await coro
+        finally:
+            sys.stdout = real_stdout
+
+async def restarted(story_paths, work_dir: str, gather: int, interval: int):
+    """Stop a run while its job is queued, then start it again on the same backend"""
+    from batch import LocalBatchServer
+    from fake_llm import FakeLLM
+    backend = LocalBatchServer(FakeLLM(), queue_delay=0.3)
+    first = asyncio.ensure_future(summary(story_paths, backend, FakeLLM(), work_dir, gather, interval).run())
+    while not backend.jobs:
+        await asyncio.sleep(0.01)
+    await asyncio.sleep(0.05)  # let the job id be saved
+    first.cancel()
+    try:
+        await first
+    except asyncio.CancelledError:
+        pass
+    final = await summary(story_paths, backend, FakeLLM(), work_dir, gather, interval).run()
+    return final, len(backend.jobs)
+
+def main():
+    parser = argparse.ArgumentParser(description="Check BatchSummary round trips through LocalBatchServer")
+    parser.add_argument("--chapters", type=int, default=60)
+    parser.add_argument("--gather", type=int, default=3)
+    parser.add_argument("--interval", type=int, default=4, help="batches per roll-up")
+    args = parser.parse_args()
+
+    from batch import LocalBatchServer, response_text
+    from fake_llm import FakeLLM
+
+    work = tempfile.mkdtemp(prefix="check_batch_")
+    try:
+        story_dir = os.path.join(work, "story")
+        os.makedirs(story_dir)
+        write_story(story_dir, args.chapters)
+        story_paths = sorted(os.path.join(story_dir, f) for f in os.listdir(story_dir))
+
+        backend = LocalBatchServer(FakeLLM())
+        llm = FakeLLM()
+        run = summary(story_paths, backend, llm, os.path.join(work, "jobs"), args.gather, args.interval)
+        batches = run.batches()
+        final = asyncio.run(quiet(run.run()))
+        results = backend.results(next(iter(backend.jobs)))
+        reference = FakeLLM()
+        answers_match = all(response_text(results.get(b["key"], {})) == reference.reply(b["prompt"]) for b in batches)
+        rollups = sum(1 for i in range(0, len(batches), args.interval) if len(batches) - i >= args.interval)
+
+        failed_keys = [batches[0]["key"], batches[-1]["key"]]
+        failing = summary(story_paths, LocalBatchServer(FakeLLM(), fail_keys=failed_keys), FakeLLM(),
+                          os.path.join(work, "jobs_failing"), args.gather, args.interval)
+        failing_final = asyncio.run(quiet(failing.run()))
+
+        restarted_final, jobs = asyncio.run(quiet(restarted(story_paths, os.path.join(work, "jobs_restart"), args.gather, args.interval)))
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+    print(f"job:        {len(batches)} batches, {run.stats}")
+    print(f"failures:   {len(failed_keys)} failed keys, {failing.stats}")
+    print(f"restarted:  {jobs} job(s) submitted")
+    checks = [
+        ("every batch answered through the job", len(results) == len(batches) and run.stats["batch_failed"] == 0),
+        ("job answers match the LLM's answer to each prompt", answers_match),
+        ("only roll-ups and the final rewrite are interactive", run.stats["interactive_calls"] == rollups + 1),
+        ("failed keys requested interactively", failing.stats["batch_failed"] == len(failed_keys)
+            and failing.stats["interactive_calls"] == rollups + 1 + len(failed_keys)),
+        ("final summary unchanged by failed keys", failing_final == final),
+        ("restarted run polls the saved job", jobs == 1 and restarted_final == final),
+        ("final summary not empty", bool(final.strip())),
+    ]
+    for label, ok in checks:
+        print(f"{'ok  ' if ok else 'FAIL'} {label}")
+    sys.exit(0 if all(ok for _, ok in checks) else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+Offline check of the LLM call wrapper in trackapi.py: error classification, retries,
+deadlines, hedged requests, per-stage latency, stream deadlines and the circuit breaker.
+
+Every case drives TrackApi._rate_limited_llm_call with a scripted fake call, with no
+API key and no network, and prints ok or FAIL; the exit code is 1 if any case fails.
+
+Usage:
+    uv run python scripts/check_llm_limits.py
+"""
+
+import asyncio
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, "src", "agent"))
+
+OVERSIZE_MESSAGE = ("400 INVALID_ARGUMENT. {'error': {'code': 400, 'message': 'The input token count (1500000) "
+                    "exceeds the maximum number of tokens allowed (1048576).', 'status': 'INVALID_ARGUMENT'}}")
+
+class ScriptedCall:
+    """Fake client whose achat plays one step per call: an exception to raise, or (delay, result)"""
+    def __init__(self, *steps):
+        self.steps = list(steps)
+        self.calls = 0
+
+    async def achat(self, *args, **kwargs):
+        step = self.steps[min(self.calls, len(self.steps) - 1)]
+        self.calls += 1
+        if isinstance(step, BaseException):
+            raise step
+        delay, result = step
+        await asyncio.sleep(delay)
+        return result
+
+def limiter(**kwargs):
+    from trackapi import TrackApi
+    kwargs.setdefault("quota_per_minute", 10**6)
+    kwargs.setdefault("daily_quota", 10**9)
+    return TrackApi(**kwargs)
+
+def prime(api, stage: str, seconds: float, n: int = 10):
+    for _ in range(n):
+        api._latency(stage).record(seconds)
+
+async def check_oversize_not_retried():
+    from parsing import is_oversize_error
+    api = limiter()
+    call = ScriptedCall(Exception(OVERSIZE_MESSAGE))
+    try:
+        await api._rate_limited_llm_call(call.achat)
+    except Exception as e:
+        assert call.calls == 1, f"oversize error was retried ({call.calls} calls)"
+        assert is_oversize_error(e), f"original error lost: {e}"
+        assert api.consecutive_failures == 0, "oversize error counted as a service failure"
+        return
+    raise AssertionError("oversize error was swallowed")
+
+async def check_server_error_retried_and_reraised():
+    api = limiter()
+    error = Exception("503 UNAVAILABLE. The model is overloaded.")
+    call = ScriptedCall(error)
+    try:
+        await api._rate_limited_llm_call(call.achat)
+    except Exception as e:
+        assert call.calls == 2, f"expected 2 attempts, got {call.calls}"
+        assert e is error, f"expected the last caught error, got {e!r}"
+        return
+    raise AssertionError("server error was swallowed")
+
+async def check_transient_then_success():
+    api = limiter()
+    call = ScriptedCall(ConnectionResetError("reset by peer"), (0, "ok"))
+    result = await api._rate_limited_llm_call(call.achat)
+    assert result == "ok" and call.calls == 2, f"expected a retry after a connection error ({call.calls} calls)"
+
+async def check_deadline():
+    api = limiter(default_deadline=0.2, hedge=False)
+    call = ScriptedCall((5, "late"))
+    start = time.monotonic()
+    try:
+        await api._rate_limited_llm_call(call.achat)
+    except asyncio.TimeoutError:
+        elapsed = time.monotonic() - start
+        assert elapsed < 1.0, f"deadline not enforced ({elapsed:.2f}s)"
+        assert api.latencies["default"].timeouts == 2
+        return
+    raise AssertionError("slow call did not time out")
+
+async def check_hedge():
+    api = limiter()
+    prime(api, "short", 0.05)
+    # The first request hangs, the duplicate sent after p95 answers quickly
+    call = ScriptedCall((5, "slow"), (0.01, "fast"))
+    result = await api._rate_limited_llm_call(call.achat, stage="short")
+    latency = api.latencies["short"]
+    assert result == "fast", f"hedged request lost: {result}"
+    assert latency.hedges == 1 and latency.hedge_wins == 1, latency.stats()
+
+async def check_blocking_not_hedged():
+    api = limiter()
+    prime(api, "short", 0.05)
+    calls = []
+
+    def blocking(*args, **kwargs):
+        # A thread cannot be cancelled, a duplicate would be a second paid request
+        calls.append(1)
+        time.sleep(0.3)
+        return "slow"
+
+    result = await api._rate_limited_llm_call(blocking, stage="short")
+    assert result == "slow" and len(calls) == 1, f"blocking client was hedged ({len(calls)} calls)"
+    assert api.latencies["short"].hedges == 0
+
+def streaming_call(api, stage: str, gaps):
+    """A call that reads a fake stream through timed_stream; a gap of None stalls it"""
+    async def chunks():
+        for gap in gaps:
+            await asyncio.sleep(5 if gap is None else gap)
+            yield "x"
+
+    async def call(*args, **kwargs):
+        return "".join([chunk async for chunk in api.timed_stream(chunks(), stage)])
+
+    return call
+
+async def check_stream_deadlines():
+    api = limiter(default_deadline=0.2, min_deadline=0.01)
+    # Longer than the default deadline in total, but never stalled: not cut
+    result = await api._rate_limited_llm_call(streaming_call(api, "rewrite", [0.05] * 10), stage="rewrite", stream=True)
+    assert result == "x" * 10, f"progressing stream was cut: {result!r}"
+    # Stalls after the first chunk: cut by the chunk deadline, on both attempts
+    start = time.monotonic()
+    try:
+        await api._rate_limited_llm_call(streaming_call(api, "rewrite", [0.05, None]), stage="rewrite", stream=True)
+    except asyncio.TimeoutError:
+        elapsed = time.monotonic() - start
+        assert elapsed < 1.5, f"stalled stream not cut ({elapsed:.2f}s)"
+        assert api.latencies["rewrite.chunk"].timeouts == 2, api.latency_stats()
+        return
+    raise AssertionError("stalled stream did not time out")
+
+async def check_per_stage_latency():
+    api = limiter()
+    prime(api, "short", 0.05)
+    # A roll-up several times slower than the batch calls is neither hedged nor timed out
+    call = ScriptedCall((0.3, "rollup"))
+    result = await api._rate_limited_llm_call(call.achat, stage="big")
+    assert result == "rollup" and call.calls == 1, f"roll-up was duplicated ({call.calls} calls)"
+    assert "big" in api.latency_stats()["stages"]
+
+async def check_breaker():
+    from trackapi import CircuitOpenError
+    api = limiter(breaker_threshold=2, breaker_cooldown=60)
+    call = ScriptedCall(Exception("500 INTERNAL. An internal error has occurred."))
+    try:
+        await api._rate_limited_llm_call(call.achat)
+    except Exception:
+        pass
+    try:
+        await api._rate_limited_llm_call(call.achat)
+    except CircuitOpenError:
+        assert call.calls == 2, f"calls went through an open breaker ({call.calls} calls)"
+        return
+    raise AssertionError("breaker did not open")
+
+async def check_classification():
+    from trackapi import is_quota_error, is_transient_error
+    assert not is_transient_error(Exception(OVERSIZE_MESSAGE))
+    assert not is_quota_error(Exception(OVERSIZE_MESSAGE))
+    assert is_quota_error(Exception("429 RESOURCE_EXHAUSTED. Quota exceeded."))
+    assert is_transient_error(Exception("504 DEADLINE_EXCEEDED. Deadline expired."))
+    assert is_transient_error(TimeoutError())
+    assert not is_transient_error(ValueError("connection string is invalid"))
+
+CHECKS = [
+    check_classification,
+    check_oversize_not_retried,
+    check_server_error_retried_and_reraised,
+    check_transient_then_success,
+    check_deadline,
+    check_hedge,
+    check_blocking_not_hedged,
+    check_stream_deadlines,
+    check_per_stage_latency,
+    check_breaker,
+]
+
+def main():
+    failed = 0
+    for check in CHECKS:
+        with open(os.devnull, "w") as devnull:
+            real_stdout, sys.stdout = sys.stdout, devnull
+            try:
+                asyncio.run(check())
+                error = None
+            except AssertionError as e:
+                error = e
+            finally:
+                sys.stdout = real_stdout
+        print(f"{'ok  ' if error is None else 'FAIL'} {check.__name__}" + (f": {error}" if error else ""))
+        failed += error is not None
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Offline check of prompt prefix reuse with LocalPrefixCache.
+
+Runs BookSummary twice over a synthetic story with the offline FakeLLM, once sending
+full prompts and once with a LocalPrefixCache. In the cached run the fake LLM resolves
+each `cached_content` handle back to its prefix, so the check can verify that:
+- every call rebuilds exactly the prompt the uncached run sent, and the final
+  summary is the same
+- the prefix is never resent in the tail of a cached call
+- a prefix is registered once per distinct main summary and reused by the calls after it
+- fewer characters are sent in total
+It prints both runs and exits with 1 if any check fails.
+
+Usage:
+    uv run python scripts/check_prefix_cache.py
+    uv run python scripts/check_prefix_cache.py --chapters 200 --gather 5 --interval 4
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, "src", "agent"))
+
+SYLLABLES = ["Lý", "Hạo", "Trần", "Phàm", "Lâm", "Vân", "Tô", "Minh", "Hàn", "Lập", "Diệp", "Phong", "Mộ", "Dung", "Thanh", "Tuyết"]
+WORDS = "hắn đi qua núi rừng gặp yêu thú rồi tu luyện công pháp trong động phủ suốt ba ngày đêm không nghỉ".split()
+
+def write_story(story_dir: str, n_chapters: int, seed: int = 0):
+    rng = random.Random(seed)
+    names = [f"{a} {b}" for a in SYLLABLES for b in SYLLABLES if a != b][:40]
+    for i in range(n_chapters):
+        sentences = []
+        for _ in range(40):
+            words = rng.choices(WORDS, k=rng.randint(8, 16))
+            if rng.random() < 0.3:
+                words.insert(rng.randint(1, len(words)), rng.choice(names))
+            sentence = " ".join(words)
+            sentences.append(sentence[0].upper() + sentence[1:] + ".")
+        with open(os.path.join(story_dir, f"{i + 1:05d}_chuong.txt"), "w", encoding="utf-8") as f:
+            f.write(f"Chương {i + 1}\n\n" + "\n".join(sentences) + "\n")
+
+def recording_llm(cache=None):
+    """FakeLLM that records the full prompt of every call, resolving cached prefixes first"""
+    from fake_llm import FakeLLM
+    from llama_index.core.llms import ChatMessage
+
+    class RecordingLLM(FakeLLM):
+        def __init__(self):
+            super().__init__()
+            self.prompts = []
+            self.cached_calls = 0
+            self.resent_prefix = 0
+
+        def _respond(self, messages, generation_config=None):
+            name = (generation_config or {}).get("cached_content")
+            if name is not None:
+                prefix = cache.resolve(name)
+                tail = messages[-1].content or ""
+                self.cached_calls += 1
+                self.resent_prefix += prefix in tail
+                full = prefix + tail
+                self.prompts.append(full)
+                # Answer as if the provider had prepended the cached context
+                response = super()._respond([ChatMessage(role="user", content=full)], generation_config)
+                self.input_chars -= len(prefix)
+                return response
+            self.prompts.append(messages[-1].content or "")
+            return super()._respond(messages, generation_config)
+
+    return RecordingLLM()
+
+async def run(story_paths, gather: int, interval: int, cached: bool):
+    from workflow import BookSummary
+    from prefix_cache import LocalPrefixCache
+    cache = LocalPrefixCache() if cached else None
+    llm = recording_llm(cache)
+    w = BookSummary(
+        story_paths,
+        gather_chapters=gather,
+        max_chapters=len(story_paths),
+        big_summary_interval=gather * interval,
+        quota_per_minute=10**9,
+        daily_quota=10**9,
+        llm=llm,
+        prefix_cache=cache,
+        timeout=None,
+    )
+    with open(os.devnull, "w") as devnull:
+        real_stdout, sys.stdout = sys.stdout, devnull
+        try:
+            result = str(await w.run()).strip()
+        finally:
+            sys.stdout = real_stdout
+    return result, llm, cache
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that LocalPrefixCache reuses prompt prefixes without changing the prompts")
+    parser.add_argument("--chapters", type=int, default=60)
+    parser.add_argument("--gather", type=int, default=3)
+    parser.add_argument("--interval", type=int, default=4, help="batches per roll-up")
+    args = parser.parse_args()
+
+    story_dir = tempfile.mkdtemp(prefix="check_prefix_")
+    try:
+        write_story(story_dir, args.chapters)
+        story_paths = sorted(os.path.join(story_dir, f) for f in os.listdir(story_dir))
+        plain, plain_llm, _ = asyncio.run(run(story_paths, args.gather, args.interval, cached=False))
+        cached, cached_llm, cache = asyncio.run(run(story_paths, args.gather, args.interval, cached=True))
+    finally:
+        shutil.rmtree(story_dir, ignore_errors=True)
+
+    stats = cache.stats()
+    rollups = sum(1 for prompt in plain_llm.prompts if prompt.startswith("Dựa vào tóm tắt"))
+    print(f"uncached: {plain_llm.calls} calls, {plain_llm.input_chars} chars sent")
+    print(f"cached:   {cached_llm.calls} calls, {cached_llm.input_chars} chars sent, {cached_llm.cached_calls} on a cached prefix, {stats}")
+    checks = [
+        ("prompts rebuilt from the cache match the uncached run", cached_llm.prompts == plain_llm.prompts),
+        ("final summary unchanged", cached == plain),
+        ("prefix never resent in a cached call", cached_llm.resent_prefix == 0),
+        ("prefix reused across calls", stats["hits"] > 0 and cached_llm.cached_calls == stats["hits"] + stats["registrations"]),
+        # The first batch's prompt and the empty main summary, then one per roll-up
+        ("one registration per distinct prefix", stats["registrations"] <= rollups + 2),
+        ("fewer characters sent", cached_llm.input_chars < plain_llm.input_chars),
+    ]
+    for label, ok in checks:
+        print(f"{'ok  ' if ok else 'FAIL'} {label}")
+    sys.exit(0 if all(ok for _, ok in checks) else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+"""
+Concurrent-session load test for the Streamlit app.
+
+Starts a local fake story site and `streamlit run app.py` with the offline FakeLLM
+(AUTOSUMMARY_FAKE_LLM), then drives N simulated browser sessions at once through the
+crawl-and-summarize flow over Streamlit's websocket protocol: each session fills in
+the API key, credentials and story URL, submits the form and follows the app's own
+reruns until the final summary (or an error) shows up. For every N a fresh server is
+started and the report has:
+- server CPU (mean and peak % of one core) and RSS (peak and end), from /proc
+- script run time (p50/p95; summarizing runs include the app's 2 s poll) and time to
+  the first element of a run (p95), which is what a user waits for after a click
+- job completion time per session, from submit to the final summary
+
+The crawl drives Chrome against the fake site, so Chrome must be installed (as in the
+Docker image). With --prefill the chapters are fetched over plain HTTP into the story
+cache first, and the crawl step is a cache hit; this needs no browser.
+
+Usage:
+    uv run python scripts/load_test.py --sessions 1 2 4 8
+    uv run python scripts/load_test.py --sessions 1 4 16 --prefill --max-first-delta-p95 1.0
+"""
+
+import argparse
+import asyncio
+import html
+import os
+import random
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, "src", "crawl"))
+
+SYLLABLES = ["Lý", "Hạo", "Trần", "Phàm", "Lâm", "Vân", "Tô", "Minh", "Hàn", "Lập", "Diệp", "Phong", "Mộ", "Dung", "Thanh", "Tuyết"]
+WORDS = "hắn đi qua núi rừng gặp yêu thú rồi tu luyện công pháp trong động phủ suốt ba ngày đêm không nghỉ".split()
+DONE_MARKERS = {
+    "Final Summary Generated": "done",
+    "Summarization failed": "error",
+    "Crawling failed": "error",
+    "Daily API quota used up": "parked",
+}
+CLK_TCK = os.sysconf("SC_CLK_TCK")
+
+def chapter_text(story: str, i: int) -> str:
+    rng = random.Random(f"{story}/{i}")
+    names = [f"{a} {b}" for a in SYLLABLES for b in SYLLABLES if a != b][:60]
+    sentences = []
+    for _ in range(80):
+        words = rng.choices(WORDS, k=rng.randint(8, 16))
+        if rng.random() < 0.3:
+            words.insert(rng.randint(1, len(words)), rng.choice(names))
+        sentences.append(" ".join(words).capitalize() + ".")
+    return "\n".join(sentences)
+
+class FakeSite(BaseHTTPRequestHandler):
+    """
+    Just enough of bnsach for bns_crawler: a story page with the login button, the
+    login form, the TOC buttons and #mucluc-list, and chapter pages with #noi-dung.
+    Chapters are only served to a logged-in session (cookie), like the real site.
+    """
+    chapters = 100
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, body: str, status: int = 200):
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        logged_in = "fake_session=1" in self.headers.get("Cookie", "")
+        login = "" if logged_in else (
+            '<a class="bg-blue-600" href="#" onclick="document.getElementById(\'login-form\').style.display=\'block\';return false;">Đăng nhập</a>'
+            '<div id="login-form" style="display:none"><input name="login"><input name="password" type="password">'
+            '<button onclick="document.cookie=\'fake_session=1; path=/\';location.reload();"><span class="button-text">Đăng nhập</span></button></div>'
+        )
+        match = re.fullmatch(r"/reader/([\w-]+)(?:/chuong-(\d+))?/?", self.path)
+        if not match:
+            return self._send("<html><body>Not found</body></html>", 404)
+        story, chapter = match.group(1), match.group(2)
+        if chapter is None:
+            links = "".join(f'<a class="chuong-link" href="/reader/{story}/chuong-{i}"><span class="chuong-name">Chương {i}</span></a>'
+                            for i in range(1, self.chapters + 1))
+            return self._send(
+                f'<html><body>{login}<h1 id="truyen-title">Truyện {story}</h1>'
+                '<a id="chuong-list-more" href="#" onclick="return false;">Mục lục</a>'
+                '<div class="pager-all"><a class="pager-link" href="#" onclick="return false;">Tất cả</a></div>'
+                f'<div id="mucluc-list">{links}</div></body></html>'
+            )
+        text = html.escape(chapter_text(story, int(chapter))).replace("\n", "<br>") if logged_in else ""
+        self._send(f'<html><body>{login}<div id="noi-dung">{text}</div></body></html>')
+
+def start_site(chapters: int):
+    FakeSite.chapters = chapters
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeSite)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+def prefill(cache_dir: str, url: str, chapters: int):
+    """Fetch a story from the fake site like bns_crawler does and ingest it into the story cache"""
+    from story_cache import StoryCache
+    out_dir = tempfile.mkdtemp(prefix="load_prefill_")
+    try:
+        for i in range(1, chapters + 1):
+            request = urllib.request.Request(f"{url}/chuong-{i}", headers={"Cookie": "fake_session=1"})
+            page = urllib.request.urlopen(request).read().decode("utf-8")
+            text = html.unescape(re.search(r'<div id="noi-dung">(.*?)</div>', page, re.S).group(1).replace("<br>", "\n"))
+            with open(os.path.join(out_dir, f"{i:03d}_Chương {i}.txt"), "w", encoding="utf-8") as f:
+                f.write(f"Chương {i}\n\n{text}\n")
+        StoryCache(root=cache_dir).ingest(url, f"Truyện {url.rstrip('/').rsplit('/', 1)[-1]}", out_dir, total=chapters)
+    finally:
+        shutil.rmtree(out_dir, ignore_errors=True)
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def proc_sample(pid: int):
+    """(cpu seconds, rss MB) of a process from /proc"""
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    cpu = (int(fields[11]) + int(fields[12])) / CLK_TCK
+    with open(f"/proc/{pid}/status") as f:
+        rss = next(int(line.split()[1]) for line in f if line.startswith("VmRSS:"))
+    return cpu, rss / 1024
+
+def percentile(values, q: float):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+def element_text(element) -> str:
+    kind = element.WhichOneof("type")
+    if kind in ("markdown", "alert", "heading", "text"):
+        return getattr(element, kind).body
+    return ""
+
+class Session:
+    """One simulated browser tab on the app's websocket"""
+    def __init__(self, base_url: str, story_url: str, chapters: int, index: int):
+        self.ws_url = base_url.replace("http", "ws", 1) + "/_stcore/stream"
+        self.story_url = story_url
+        self.chapters = chapters
+        self.index = index
+        self.widgets = {}
+        self.states = {}
+        self.run_seconds = []
+        self.first_delta = []
+        self.status = None
+        self.completion = None
+
+    async def _send_rerun(self, ws, trigger: str = None):
+        from streamlit.proto.BackMsg_pb2 import BackMsg
+        msg = BackMsg()
+        msg.rerun_script.SetInParent()
+        for widget_id, (field, value) in self.states.items():
+            state = msg.rerun_script.widget_states.widgets.add()
+            state.id = widget_id
+            setattr(state, field, value)
+        if trigger:
+            state = msg.rerun_script.widget_states.widgets.add()
+            state.id = trigger
+            state.trigger_value = True
+        await ws.send(msg.SerializeToString())
+
+    async def _run_until_finished(self, ws, deadline: float):
+        """Read messages until the current script run ends; returns False on a closed socket"""
+        from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+        from websockets.exceptions import ConnectionClosed
+        run_start, first = None, None
+        while True:
+            try:
+                data = await asyncio.wait_for(ws.recv(), max(0.1, deadline - time.monotonic()))
+            except ConnectionClosed:
+                return False
+            msg = ForwardMsg()
+            msg.ParseFromString(data)
+            kind = msg.WhichOneof("type")
+            now = time.monotonic()
+            if kind == "new_session":
+                run_start, first = now, None
+            elif kind == "delta" and msg.delta.WhichOneof("type") == "new_element":
+                if run_start is not None and first is None:
+                    first = now
+                    self.first_delta.append(first - run_start)
+                element = msg.delta.new_element
+                widget = element.WhichOneof("type")
+                if widget in ("text_input", "number_input", "button"):
+                    self.widgets[getattr(element, widget).label] = getattr(element, widget).id
+                text = element_text(element)
+                for marker, status in DONE_MARKERS.items():
+                    if marker in text:
+                        self.status = status
+            elif kind == "script_finished":
+                if run_start is not None:
+                    self.run_seconds.append(now - run_start)
+                return True
+
+    async def run(self, timeout: float):
+        from websockets.asyncio.client import connect
+        deadline = time.monotonic() + timeout
+        ws = await connect(self.ws_url, max_size=None)
+        try:
+            await self._send_rerun(ws)
+            await self._run_until_finished(ws, deadline)
+            text = {"Google Gemini API Key": f"fake-key-{self.index}", "Enter your Username": "load",
+                    "Enter your Password": "test", "Story URL": self.story_url}
+            for label, value in text.items():
+                self.states[self.widgets[label]] = ("string_value", value)
+            self.states[self.widgets["Chapters to Crawl and Summarize"]] = ("int_value", self.chapters)
+            submitted = time.monotonic()
+            await self._send_rerun(ws, trigger=self.widgets["🚀 Crawl & Summarize"])
+            # The app reruns itself from here on (crawl, then a poll every 2 s)
+            while self.status is None:
+                if not await self._run_until_finished(ws, deadline):
+                    self.status = "closed"
+            self.completion = time.monotonic() - submitted
+        except asyncio.TimeoutError:
+            self.status = "timeout"
+        finally:
+            await ws.close()
+
+def start_app(port: int, env: dict):
+    cmd = [sys.executable, "-m", "streamlit", "run", os.path.join(ROOT, "app.py"), "--server.headless", "true",
+           "--server.port", str(port), "--server.fileWatcherType", "none", "--browser.gatherUsageStats", "false"]
+    proc = subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for _ in range(300):
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/_stcore/health", timeout=1)
+            return proc
+        except OSError:
+            if proc.poll() is not None:
+                break
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError("streamlit did not start")
+
+async def measure(n: int, args, site_url: str, env: dict) -> dict:
+    port = free_port()
+    proc = start_app(port, env)
+    base = f"http://127.0.0.1:{port}"
+    samples = []
+    stop = asyncio.Event()
+
+    async def sampler():
+        last_cpu, last_t = proc_sample(proc.pid)[0], time.monotonic()
+        while not stop.is_set():
+            await asyncio.sleep(0.5)
+            cpu, rss = proc_sample(proc.pid)
+            now = time.monotonic()
+            samples.append(((cpu - last_cpu) / (now - last_t) * 100, rss))
+            last_cpu, last_t = cpu, now
+
+    sampling = asyncio.ensure_future(sampler())
+    try:
+        stories = [f"{site_url}/reader/{'load-story' if args.same_story else f'load-story-{i}'}" for i in range(n)]
+        sessions = [Session(base, stories[i], args.chapters, i) for i in range(n)]
+        await asyncio.gather(*(s.run(args.timeout) for s in sessions))
+        end_rss = proc_sample(proc.pid)[1]
+    finally:
+        stop.set()
+        await sampling
+        proc.terminate()
+        proc.wait(timeout=10)
+    runs = [x for s in sessions for x in s.run_seconds]
+    firsts = [x for s in sessions for x in s.first_delta]
+    completions = [s.completion for s in sessions if s.status == "done"]
+    return {
+        "sessions": n,
+        "done": len(completions),
+        "failed": [s.status for s in sessions if s.status != "done"],
+        "cpu_mean": sum(c for c, _ in samples) / len(samples) if samples else 0.0,
+        "cpu_peak": max((c for c, _ in samples), default=0.0),
+        "rss_peak_mb": max((r for _, r in samples), default=end_rss),
+        "rss_end_mb": end_rss,
+        "run_p50": percentile(runs, 0.5),
+        "run_p95": percentile(runs, 0.95),
+        "first_delta_p95": percentile(firsts, 0.95),
+        "completion_mean": sum(completions) / len(completions) if completions else None,
+        "completion_max": max(completions) if completions else None,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="App capacity versus concurrent sessions")
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--chapters", type=int, default=30, help="chapters per session")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="FakeLLM seconds per call")
+    parser.add_argument("--same-story", action="store_true", help="all sessions summarize one story (crawled once)")
+    parser.add_argument("--prefill", action="store_true", help="fill the story cache over HTTP so no browser is needed")
+    parser.add_argument("--timeout", type=float, default=600, help="seconds per session")
+    parser.add_argument("--max-first-delta-p95", type=float, help="fail if a run's first element takes longer (s)")
+    args = parser.parse_args()
+
+    work = tempfile.mkdtemp(prefix="load_test_")
+    site, site_url = start_site(args.chapters)
+    env = {
+        **os.environ,
+        "AUTOSUMMARY_FAKE_LLM": str(args.llm_latency),
+        "STORY_CACHE_DIR": os.path.join(work, "story_cache"),
+        "JOBS_DIR": os.path.join(work, "jobs"),
+        "AUTOSUMMARY_QUOTA_FILE": os.path.join(work, "quota.json"),
+        "GOOGLE_API_KEYS": "",
+    }
+    try:
+        if args.prefill:
+            slugs = ["load-story"] if args.same_story else [f"load-story-{i}" for i in range(max(args.sessions))]
+            for slug in slugs:
+                prefill(env["STORY_CACHE_DIR"], f"{site_url}/reader/{slug}", args.chapters)
+        results = []
+        print(f"{'sessions':>8} {'done':>5} {'cpu %':>7} {'peak %':>7} {'rss MB':>7} {'end MB':>7} "
+              f"{'run p50':>8} {'run p95':>8} {'first p95':>9} {'job mean':>9} {'job max':>8}")
+        for n in args.sessions:
+            r = asyncio.run(measure(n, args, site_url, env))
+            results.append(r)
+            fmt = lambda v, w, p=2: f"{v:>{w}.{p}f}" if v is not None else f"{'-':>{w}}"
+            print(f"{n:>8} {r['done']:>5} {fmt(r['cpu_mean'], 7, 0)} {fmt(r['cpu_peak'], 7, 0)} {fmt(r['rss_peak_mb'], 7, 0)} "
+                  f"{fmt(r['rss_end_mb'], 7, 0)} {fmt(r['run_p50'], 8)} {fmt(r['run_p95'], 8)} {fmt(r['first_delta_p95'], 9)} "
+                  f"{fmt(r['completion_mean'], 9, 1)} {fmt(r['completion_max'], 8, 1)}"
+                  + (f"  failed: {r['failed']}" if r["failed"] else ""))
+    finally:
+        site.shutdown()
+        shutil.rmtree(work, ignore_errors=True)
+
+    failed = any(r["failed"] for r in results)
+    slow = args.max_first_delta_p95 is not None and any(
+        (r["first_delta_p95"] or 0) > args.max_first_delta_p95 for r in results)
+    if slow:
+        print(f"First-element p95 above {args.max_first_delta_p95}s")
+    sys.exit(1 if failed or slow else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,313 @@
+import os
+import json
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Sequence
+
+from llama_index.core.llms import ChatMessage
+
+from trackapi import TrackApi
+from characters import merge_characters
+from parsing import SummaryParseError, parse_summary_output
+from prompt import (
+    SYSTEM_PROMPT,
+    FIRST_EXTRACTCHARACTERNSUMMARY_PROMPT_TMPL,
+    LONG_SUMMARY_PROMPT_TMPL,
+    REWRITE_SUMMARY_PROMPT_TMPL,
+)
+
+DONE_STATES = {"JOB_STATE_SUCCEEDED", "JOB_STATE_PARTIALLY_SUCCEEDED", "JOB_STATE_FAILED",
+               "JOB_STATE_CANCELLED", "JOB_STATE_EXPIRED"}
+
+def request_line(key: str, prompt: str, system_prompt: str = None, generation_config: Dict = None) -> Dict:
+    """One line of a Gemini batch input file"""
+    request = {"contents": [{"role": "user", "parts": [{"text": prompt}]}]}
+    if system_prompt:
+        request["system_instruction"] = {"parts": [{"text": system_prompt}]}
+    if generation_config:
+        request["generation_config"] = generation_config
+    return {"key": key, "request": request}
+
+def response_text(line: Dict) -> Optional[str]:
+    """Text of one batch output line, None if the request failed"""
+    if line.get("error"):
+        return None
+    try:
+        parts = line["response"]["candidates"][0]["content"]["parts"]
+    except (KeyError, IndexError, TypeError):
+        return None
+    return "".join(part.get("text", "") for part in parts)
+
+class BatchBackend:
+    """
+    Offline execution of a JSONL file of requests. `submit` returns a job id, `state`
+    a Gemini JOB_STATE_* name, and `results` the output lines by request key.
+    """
+    def submit(self, path: str, display_name: str) -> str:
+        raise NotImplementedError
+
+    def state(self, job_id: str) -> str:
+        raise NotImplementedError
+
+    def results(self, job_id: str) -> Dict[str, Dict]:
+        raise NotImplementedError
+
+class LocalBatchServer(BatchBackend):
+    """
+    Stand-in for the Gemini Batch API. Jobs run in a background thread through
+    `llm.chat` with `workers` requests in flight, after `queue_delay` seconds in the
+    queue, and write an output file in the Gemini format next to the input.
+    Keys in `fail_keys` come back as errors.
+    """
+    def __init__(self, llm, workers: int = 4, queue_delay: float = 0.0, fail_keys: Sequence[str] = ()):
+        self.llm = llm
+        self.workers = workers
+        self.queue_delay = queue_delay
+        self.fail_keys = set(fail_keys)
+        self.jobs: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, path: str, display_name: str) -> str:
+        with open(path, "r", encoding="utf-8") as f:
+            lines = [json.loads(line) for line in f if line.strip()]
+        with self._lock:
+            job_id = f"batches/local-{len(self.jobs) + 1}"
+            self.jobs[job_id] = {"state": "JOB_STATE_PENDING", "output": path + ".out.jsonl", "name": display_name}
+        threading.Thread(target=self._run, args=(job_id, lines), daemon=True).start()
+        return job_id
+
+    def _answer(self, line: Dict) -> Dict:
+        if line["key"] in self.fail_keys:
+            return {"key": line["key"], "error": {"code": 500, "message": "simulated failure"}}
+        request = line["request"]
+        text = "".join(part["text"] for part in request["contents"][-1]["parts"])
+        try:
+            response = self.llm.chat([ChatMessage(role="user", content=text)])
+        except Exception as e:
+            return {"key": line["key"], "error": {"code": 500, "message": str(e)}}
+        content = str(response.message.content or "")
+        return {"key": line["key"], "response": {"candidates": [{"content": {"role": "model", "parts": [{"text": content}]}}]}}
+
+    def _run(self, job_id: str, lines: List[Dict]):
+        job = self.jobs[job_id]
+        time.sleep(self.queue_delay)
+        job["state"] = "JOB_STATE_RUNNING"
+        with ThreadPoolExecutor(self.workers) as pool:
+            answers = list(pool.map(self._answer, lines))
+        with open(job["output"], "w", encoding="utf-8") as f:
+            for answer in answers:
+                f.write(json.dumps(answer, ensure_ascii=False) + "\n")
+        failed = any("error" in answer for answer in answers)
+        job["state"] = "JOB_STATE_PARTIALLY_SUCCEEDED" if failed else "JOB_STATE_SUCCEEDED"
+
+    def state(self, job_id: str) -> str:
+        return self.jobs[job_id]["state"]
+
+    def results(self, job_id: str) -> Dict[str, Dict]:
+        with open(self.jobs[job_id]["output"], "r", encoding="utf-8") as f:
+            lines = [json.loads(line) for line in f if line.strip()]
+        return {line["key"]: line for line in lines}
+
+class GeminiBatchBackend(BatchBackend):
+    """Gemini Batch API: the input file is uploaded with the Files API and run with `client.batches`"""
+    def __init__(self, model: str = "models/gemini-2.0-flash", api_key: str = None):
+        self.model = model
+        self.api_key = api_key
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            from google import genai
+            self._client = genai.Client(api_key=self.api_key or os.getenv("GOOGLE_API_KEY"))
+        return self._client
+
+    def submit(self, path: str, display_name: str) -> str:
+        from google.genai import types
+        uploaded = self.client.files.upload(file=path, config=types.UploadFileConfig(display_name=display_name, mime_type="jsonl"))
+        job = self.client.batches.create(model=self.model, src=uploaded.name, config={"display_name": display_name})
+        return job.name
+
+    def state(self, job_id: str) -> str:
+        return self.client.batches.get(name=job_id).state.name
+
+    def results(self, job_id: str) -> Dict[str, Dict]:
+        job = self.client.batches.get(name=job_id)
+        if job.dest is None or not job.dest.file_name:
+            return {}
+        data = self.client.files.download(file=job.dest.file_name)
+        lines = [json.loads(line) for line in data.decode("utf-8").splitlines() if line.strip()]
+        return {line["key"]: line for line in lines if "key" in line}
+
+class BatchSummary:
+    """
+    Offline variant of BookSummary for overnight runs.
+
+    The chained workflow passes each batch the summaries and characters before it, so
+    its calls can only run one after another through the per-minute window. Here every
+    batch is summarized on its own with the first-batch prompt, all of them in one job
+    on a BatchBackend. Character lists are merged in chapter order; the roll-ups (one
+    per `big_summary_interval` chapters) and the final rewrite then run interactively,
+    as in the workflow. Batches the job could not answer are requested interactively.
+    The job id is saved under `work_dir`, so a restarted run polls the same job.
+    """
+    def __init__(
+        self,
+        story_paths: Sequence[str],
+        backend: BatchBackend,
+        llm=None,
+        gather_chapters: int = 10,
+        big_summary_interval: int = 100,
+        max_chapters: Optional[int] = None,
+        work_dir: str = "batch_jobs",
+        name: str = "story",
+        system_prompt: str = None,
+        api_key: str = None,
+        quota_per_minute: int = 15,
+        poll_interval: float = 60,
+        max_wait: float = 24 * 3600,
+        pyramid=None,
+        chapter_offset: int = 0,
+    ):
+        self.story_paths = list(story_paths)[:max_chapters] if max_chapters else list(story_paths)
+        self.backend = backend
+        self.system_prompt = system_prompt or SYSTEM_PROMPT
+        if llm is None:
+            from llama_index.llms.google_genai import GoogleGenAI
+            llm = GoogleGenAI(model="models/gemini-2.0-flash", system_prompt=self.system_prompt, api_key=api_key)
+        self.llm = llm
+        self.gather_chapters = gather_chapters
+        self.big_summary_interval = max(gather_chapters, big_summary_interval // gather_chapters * gather_chapters)
+        self.work_dir = os.path.join(work_dir, name)
+        self.name = name
+        self.limiter = TrackApi(quota_per_minute)
+        self.poll_interval = poll_interval
+        self.max_wait = max_wait
+        self.pyramid = pyramid
+        self.chapter_offset = chapter_offset
+        self.stats = {"batches": 0, "batch_failed": 0, "interactive_calls": 0}
+
+    def batches(self) -> List[Dict]:
+        batches = []
+        for i in range(0, len(self.story_paths), self.gather_chapters):
+            texts = []
+            for path in self.story_paths[i:i + self.gather_chapters]:
+                try:
+                    with open(path, "r", encoding="utf-8") as f:
+                        texts.append(f.read())
+                except (FileNotFoundError, UnicodeDecodeError) as e:
+                    print(f"Error reading {path}: {e}")
+            start = self.chapter_offset + i + 1
+            end = self.chapter_offset + min(i + self.gather_chapters, len(self.story_paths))
+            prompt = FIRST_EXTRACTCHARACTERNSUMMARY_PROMPT_TMPL.format(characters="", previous_summary="", chapter_text="\n".join(texts))
+            batches.append({"key": f"{start:05d}-{end:05d}", "start": start, "end": end, "prompt": prompt})
+        return batches
+
+    def _job_path(self) -> str:
+        return os.path.join(self.work_dir, "job.json")
+
+    def _resume(self, keys: List[str]) -> Optional[str]:
+        """Job id of an earlier submission of the same requests, if the backend still knows it"""
+        if not os.path.exists(self._job_path()):
+            return None
+        with open(self._job_path(), "r", encoding="utf-8") as f:
+            job = json.load(f)
+        if job.get("keys") != keys:
+            return None
+        try:
+            self.backend.state(job["job_id"])
+        except Exception:
+            return None
+        print(f"Resuming batch job {job['job_id']}")
+        return job["job_id"]
+
+    async def collect(self, batches: List[Dict]) -> Dict[str, Dict]:
+        """Submit (or resume) the batch job and wait for its output lines"""
+        os.makedirs(self.work_dir, exist_ok=True)
+        keys = [batch["key"] for batch in batches]
+        job_id = self._resume(keys)
+        if job_id is None:
+            path = os.path.join(self.work_dir, "requests.jsonl")
+            with open(path, "w", encoding="utf-8") as f:
+                for batch in batches:
+                    f.write(json.dumps(request_line(batch["key"], batch["prompt"], self.system_prompt), ensure_ascii=False) + "\n")
+            job_id = await asyncio.to_thread(self.backend.submit, path, f"summary-{self.name}")
+            with open(self._job_path(), "w", encoding="utf-8") as f:
+                json.dump({"job_id": job_id, "keys": keys, "submitted": time.time()}, f)
+            print(f"Submitted batch job {job_id} with {len(batches)} requests")
+
+        start = time.monotonic()
+        while True:
+            state = await asyncio.to_thread(self.backend.state, job_id)
+            if state in DONE_STATES:
+                break
+            if time.monotonic() - start > self.max_wait:
+                raise TimeoutError(f"Batch job {job_id} still {state} after {self.max_wait:.0f} seconds")
+            print(f"Batch job {job_id}: {state}")
+            await asyncio.sleep(self.poll_interval)
+        print(f"Batch job {job_id} finished: {state}")
+        results = {} if state == "JOB_STATE_FAILED" else await asyncio.to_thread(self.backend.results, job_id)
+        os.remove(self._job_path())
+        return results
+
+    async def call(self, prompt: str) -> str:
+        self.stats["interactive_calls"] += 1
+        response = await self.limiter._rate_limited_llm_call(self.llm.achat, [ChatMessage(role="user", content=prompt)])
+        return str(response.message.content or "")
+
+    async def summarize_batch(self, batch: Dict, raw: Optional[str]):
+        """(characters, summary) of one batch, requested interactively if the job gave no usable answer"""
+        for attempt in range(2):
+            if raw is None or attempt:
+                if raw is None:
+                    self.stats["batch_failed"] += 1
+                raw = await self.call(batch["prompt"])
+            try:
+                return parse_summary_output(raw)
+            except SummaryParseError as e:
+                if e.kind == "missing_summary":
+                    return "", raw.strip()
+        print(f"No summary for chapters {batch['start']}-{batch['end']}")
+        return "", ""
+
+    async def run(self) -> str:
+        batches = self.batches()
+        self.stats["batches"] = len(batches)
+        results = await self.collect(batches)
+        parsed = await asyncio.gather(*(
+            self.summarize_batch(batch, response_text(results[batch["key"]]) if batch["key"] in results else None)
+            for batch in batches
+        ))
+
+        characters = ""
+        windows = []
+        for batch, (batch_characters, summary) in zip(batches, parsed):
+            characters = merge_characters(characters, batch_characters)
+            if self.pyramid:
+                self.pyramid.append("batch", batch["start"], batch["end"], summary)
+                self.pyramid.append("characters", batch["start"], batch["end"], characters)
+            if not windows or batch["start"] - windows[-1]["start"] >= self.big_summary_interval:
+                windows.append({"start": batch["start"], "summaries": []})
+            windows[-1]["summaries"].append(summary)
+            windows[-1].update(end=batch["end"], characters=characters)
+
+        # Full windows are rolled up, a shorter last window is passed on as it is
+        full = [w for w in windows if w["end"] - w["start"] + 1 >= self.big_summary_interval]
+        rollups = await asyncio.gather(*(
+            self.call(LONG_SUMMARY_PROMPT_TMPL.format(characters=w["characters"], summaries="\n".join(w["summaries"])))
+            for w in full
+        ))
+        parts = []
+        for window, rollup in zip(full, rollups):
+            if self.pyramid:
+                self.pyramid.append("rollup", window["start"], window["end"], rollup)
+            parts.append(rollup)
+        parts.extend("\n".join(w["summaries"]) for w in windows[len(full):])
+
+        final = await self.call(REWRITE_SUMMARY_PROMPT_TMPL.format(summary="\n".join(parts).strip()))
+        if self.pyramid and batches:
+            self.pyramid.append("final", 1, batches[-1]["end"], final)
+        print(f"Batch summary: {self.stats}")
+        return final
@@ -0,0 +1,155 @@
+import re
+from collections import defaultdict
+from typing import Dict, Tuple
+
+from planner import CHARS_PER_TOKEN, estimate_tokens
+from characters import parse_characters, format_characters, mentioned_names
+
+# Per stage: output tokens per input token of new material, floor and ceiling
+STAGE_BUDGETS = {
+    "short": (0.06, 120, 800),
+    "big": (0.35, 250, 1200),
+    "rewrite": (0.6, 400, 2500),
+}
+# Vietnamese averages about 1.5 Gemini tokens per word
+TOKENS_PER_WORD = 1.5
+
+BUDGET_INSTRUCTION = "\n-----\nĐộ dài: phần tóm tắt khoảng {words} từ, không dài hơn."
+# Gemini 2.5 models think before answering, and the thinking tokens count against
+# max_output_tokens; they get this much extra room, with thinking capped to it
+THINKING_TOKENS = 1024
+
+def is_thinking_model(model: str) -> bool:
+    return "gemini-2.5" in (model or "")
+
+def thinking_allowance(model: str, generation_config: Dict) -> Dict:
+    """generation_config with room for the thinking tokens of a thinking model, unchanged otherwise"""
+    cap = generation_config.get("max_output_tokens")
+    if not cap or not is_thinking_model(model):
+        return generation_config
+    return {**generation_config, "max_output_tokens": cap + THINKING_TOKENS,
+            "thinking_config": {"thinking_budget": THINKING_TOKENS}}
+
+def split_sentences(text: str):
+    return [s for s in re.split(r"(?<=[.!?…])\s+|\n+", text.strip()) if s.strip()]
+
+class OutputBudget:
+    """
+    Output-length budgets per stage, so summaries do not grow over a run.
+
+    A stage's target is `ratio` x the tokens of its new material (chapter text for
+    "short", the summaries being rolled up for "big", everything for "rewrite"),
+    clamped to [floor, ceiling]. The target goes into the prompt as a word count, and
+    `max_output_tokens` is set to `headroom` x target (plus the character list for
+    "short"), so the model is rarely cut off but cannot run away; calls on thinking
+    models get `THINKING_TOKENS` more (see `thinking_allowance`). `fit` records each
+    output against its target and compacts summaries longer than `tolerance` x target
+    to their most central sentences. `fit_characters` keeps the running character list
+    under `character_tokens`.
+    """
+    def __init__(self, budgets: Dict[str, Tuple[float, int, int]] = None, character_tokens: int = 1200,
+                 tolerance: float = 1.25, headroom: float = 1.6):
+        self.budgets = {**STAGE_BUDGETS, **(budgets or {})}
+        self.character_tokens = character_tokens
+        self.tolerance = tolerance
+        self.headroom = headroom
+        self.usage = defaultdict(lambda: {"calls": 0, "target": 0, "output": 0, "over": 0, "compacted": 0, "trimmed": 0, "history": []})
+        self.character_compactions = 0
+
+    def target(self, stage: str, input_tokens: int) -> int:
+        ratio, floor, ceiling = self.budgets[stage]
+        return int(min(ceiling, max(floor, ratio * input_tokens)))
+
+    def instruction(self, target: int) -> str:
+        return BUDGET_INSTRUCTION.format(words=max(10, int(target / TOKENS_PER_WORD)))
+
+    def llm_kwargs(self, target: int, extra_tokens: int = 0) -> Dict:
+        return {"generation_config": {"max_output_tokens": int(target * self.headroom) + extra_tokens}}
+
+    def short_extra_tokens(self, characters: str) -> int:
+        """Room for the character list the batch call repeats before its summary"""
+        return min(self.character_tokens, estimate_tokens(characters)) + 200
+
+    def fit(self, stage: str, target: int, text: str, compact: bool = True) -> str:
+        """Record one output against its target and compact it if it is over the tolerance"""
+        tokens = estimate_tokens(text)
+        usage = self.usage[stage]
+        usage["calls"] += 1
+        usage["target"] += target
+        usage["output"] += tokens
+        usage["history"].append(tokens)
+        if tokens <= self.tolerance * target:
+            return text
+        usage["over"] += 1
+        if not compact:
+            return text
+        compacted = self.compact(text, target)
+        usage["compacted"] += 1
+        usage["trimmed"] += tokens - estimate_tokens(compacted)
+        return compacted
+
+    def compact(self, text: str, target: int) -> str:
+        """
+        The highest-ranked whole sentences, in text order, up to `target` tokens. Sentences
+        are ranked by TextRank as in ExtractiveCompressor, so the ones that share the most
+        with the rest of the summary (the main plot points) are kept. A cut-off last
+        sentence (max_output_tokens reached) is dropped.
+        """
+        from compress import ExtractiveCompressor  # compress imports split_sentences from here
+        sentences = split_sentences(text)
+        if len(sentences) > 1 and not re.search(r"[.!?…\"”)]\s*$", sentences[-1]):
+            sentences = sentences[:-1]
+        limit = target * CHARS_PER_TOKEN
+        if sum(len(s) + 1 for s in sentences) <= limit or len(sentences) <= 2:
+            return " ".join(sentences)
+        scores = ExtractiveCompressor().scores(sentences)
+        chosen, size = [], 0
+        for i in sorted(range(len(sentences)), key=lambda i: -scores[i]):
+            if not chosen or size + len(sentences[i]) + 1 <= limit:
+                chosen.append(i)
+                size += len(sentences[i]) + 1
+        return " ".join(sentences[i] for i in sorted(chosen))
+
+    def fit_characters(self, characters: str, chapter_text: str = "") -> str:
+        """
+        Keep the character list under `character_tokens`: descriptions are cut to their
+        first clause, then characters mentioned in the current batch are kept first and
+        the rest in list order until the budget is used.
+        """
+        if estimate_tokens(characters) <= self.character_tokens:
+            return characters
+        self.character_compactions += 1
+        parsed = parse_characters(characters)
+        short = {name: re.split(r"(?<=[.;])\s|,\s", description, maxsplit=1)[0][:160] for name, description in parsed.items()}
+        if estimate_tokens(format_characters(short)) <= self.character_tokens:
+            return format_characters(short)
+        mentioned = set(mentioned_names(list(short), chapter_text)) if chapter_text else set()
+        order = [name for name in short if name in mentioned] + [name for name in short if name not in mentioned]
+        limit = self.character_tokens * CHARS_PER_TOKEN
+        kept, size = set(), 0
+        for name in order:
+            size += len(name) + len(short[name]) + 3
+            if size > limit:
+                break
+            kept.add(name)
+        return format_characters({name: short[name] for name in short if name in kept})
+
+    def stats(self) -> Dict:
+        """Per stage: calls, output/target ratio, over-budget count, compactions, and output drift"""
+        stats = {}
+        for stage, usage in self.usage.items():
+            history = usage["history"]
+            quarter = max(1, len(history) // 4)
+            stats[stage] = {
+                "calls": usage["calls"],
+                "output_ratio": round(usage["output"] / usage["target"], 2) if usage["target"] else None,
+                "over": usage["over"],
+                "compacted": usage["compacted"],
+                "tokens_trimmed": usage["trimmed"],
+                # mean output tokens in the first and last quarter of the run, flat is good
+                "first_quarter": round(sum(history[:quarter]) / quarter),
+                "last_quarter": round(sum(history[-quarter:]) / quarter),
+            }
+        if self.character_compactions:
+            stats["characters"] = {"compacted": self.character_compactions}
+        return stats
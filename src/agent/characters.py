@@ -0,0 +1,65 @@
+import re
+import unicodedata
+from collections import OrderedDict
+from typing import List
+
+# "Tên nhân vật: giới thiệu", optionally bulleted, numbered or bolded
+CHARACTER_LINE_RE = re.compile(r"^\s*(?:[-*•+]\s*|\d+[.)]\s*)?\**\s*([^:\n*]{1,60}?)\s*\**\s*:\s*(.+?)\s*$")
+
+def normalize_name(name: str) -> str:
+    return unicodedata.normalize("NFC", name).strip().lower()
+
+def parse_characters(text: str) -> "OrderedDict[str, str]":
+    """Parse a character list (one 'name: description' per line) into name -> description"""
+    characters = OrderedDict()
+    for line in (text or "").splitlines():
+        match = CHARACTER_LINE_RE.match(line)
+        if match:
+            characters[match.group(1).strip()] = match.group(2)
+    return characters
+
+def character_names(text: str) -> List[str]:
+    return list(parse_characters(text).keys())
+
+def format_characters(characters: "OrderedDict[str, str]") -> str:
+    return "\n".join(f"{name}: {description}" for name, description in characters.items())
+
+def merge_characters(base: str, update: str) -> str:
+    """
+    Merge two character lists. Entries from `update` replace entries with the same
+    name in `base`, new names are appended, and names only in `base` are kept.
+    """
+    merged = parse_characters(base)
+    keys = {normalize_name(name): name for name in merged}
+    for name, description in parse_characters(update).items():
+        key = normalize_name(name)
+        if key in keys:
+            merged[keys[key]] = description
+        else:
+            merged[name] = description
+            keys[key] = name
+    return format_characters(merged)
+
+def mentioned_names(names: List[str], text: str) -> List[str]:
+    """Names from the list that appear in the text"""
+    haystack = unicodedata.normalize("NFC", text).lower()
+    return [name for name in names if normalize_name(name) and normalize_name(name) in haystack]
+
+def proper_names(text: str, min_syllables: int = 2) -> List[str]:
+    """
+    Capitalized multi-syllable sequences ("Lý Hạo", "Trần Phàm"), in order of appearance.
+    A single capitalized syllable is ignored since every sentence starts with one.
+    """
+    names = []
+    for sentence in re.split(r"(?<=[.!?…:\"“”])\s+|\n+", unicodedata.normalize("NFC", text)):
+        words = sentence.split()
+        run = []
+        for word in words + [""]:
+            word = word.strip(".,!?;:\"'“”‘’()[]…-")
+            if word and word[0].isupper() and word.isalpha():
+                run.append(word)
+                continue
+            if len(run) >= min_syllables:
+                names.append(" ".join(run))
+            run = []
+    return names
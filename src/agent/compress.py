@@ -0,0 +1,122 @@
+import os
+import re
+import sys
+import time
+import argparse
+import unicodedata
+from typing import Dict, List
+
+import numpy as np
+
+from budget import split_sentences
+from dedup import TITLE_RE
+
+WORD_RE = re.compile(r"\w+")
+
+class ExtractiveCompressor:
+    """
+    Shortens chapter text before it is sent, by keeping its most central sentences.
+
+    Each sentence is a TF-IDF vector over the chapter's words, with sentences as the
+    documents; words used in only one sentence are dropped since they add nothing to
+    the similarity between sentences. With method "textrank" a sentence's score is its
+    PageRank in the cosine-similarity graph (power iteration on the row-normalized
+    matrix), with "tfidf" it is its similarity to the chapter centroid. The top
+    sentences are kept, in their original order, until `keep_ratio` of the characters
+    is reached. The chapter title and chapters under `min_sentences` are kept as they are.
+    """
+    def __init__(self, keep_ratio: float = 0.4, method: str = "textrank", min_sentences: int = 12,
+                 damping: float = 0.85, iterations: int = 30):
+        if not 0 < keep_ratio <= 1:
+            raise ValueError("keep_ratio must be in (0, 1]")
+        if method not in ("textrank", "tfidf"):
+            raise ValueError(f"Unknown method {method!r}, use 'textrank' or 'tfidf'")
+        self.keep_ratio = keep_ratio
+        self.method = method
+        self.min_sentences = min_sentences
+        self.damping = damping
+        self.iterations = iterations
+        self.chars_in = 0
+        self.chars_out = 0
+        self.chapters = 0
+        self.seconds = 0.0
+
+    def scores(self, sentences: List[str]) -> np.ndarray:
+        vocab: Dict[str, int] = {}
+        rows, cols = [], []
+        for i, sentence in enumerate(sentences):
+            ids = {vocab.setdefault(w, len(vocab)) for w in WORD_RE.findall(sentence.lower())}
+            rows.extend([i] * len(ids))
+            cols.extend(ids)
+        n = len(sentences)
+        rows, cols = np.array(rows, dtype=np.int64), np.array(cols, dtype=np.int64)
+        tf = np.zeros((n, len(vocab)), dtype=np.float32)
+        # Term frequency per sentence, then keep only words shared by several sentences
+        np.add.at(tf, (rows, cols), 1.0)
+        df = np.bincount(cols, minlength=len(vocab))
+        shared = df > 1
+        if not shared.any():
+            return np.ones(n, dtype=np.float32)
+        x = tf[:, shared] * np.log(n / df[shared]).astype(np.float32)
+        norms = np.linalg.norm(x, axis=1, keepdims=True)
+        x /= np.where(norms > 0, norms, 1.0)
+        if self.method == "tfidf":
+            centroid = x.mean(axis=0)
+            return x @ centroid
+        sim = x @ x.T
+        np.fill_diagonal(sim, 0.0)
+        out = sim.sum(axis=1, keepdims=True)
+        transition = sim / np.where(out > 0, out, 1.0)
+        rank = np.full(n, 1.0 / n, dtype=np.float32)
+        for _ in range(self.iterations):
+            rank = (1 - self.damping) / n + self.damping * (transition.T @ rank)
+        return rank
+
+    def compress(self, text: str) -> str:
+        start = time.perf_counter()
+        text = unicodedata.normalize("NFC", text)
+        match = TITLE_RE.match(text)
+        title, body = (match.group(0), text[match.end():]) if match else ("", text)
+        sentences = split_sentences(body)
+        if len(sentences) < self.min_sentences or self.keep_ratio >= 1:
+            compressed = text
+        else:
+            scores = self.scores(sentences)
+            lengths = np.array([len(s) + 1 for s in sentences])
+            budget = self.keep_ratio * lengths.sum()
+            order = np.argsort(-scores, kind="stable")
+            # Highest scores first until the character budget is used, always at least one
+            keep = order[:max(1, int(np.searchsorted(np.cumsum(lengths[order]), budget, side="right")))]
+            compressed = title + " ".join(sentences[i] for i in np.sort(keep))
+        self.chapters += 1
+        self.chars_in += len(text)
+        self.chars_out += len(compressed)
+        self.seconds += time.perf_counter() - start
+        return compressed
+
+    def stats(self) -> Dict:
+        return {
+            "chapters": self.chapters,
+            "kept": round(self.chars_out / self.chars_in, 3) if self.chars_in else None,
+            "chars_saved": self.chars_in - self.chars_out,
+            "seconds": round(self.seconds, 2),
+        }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compress the chapters of a story and report the size and time")
+    parser.add_argument("story_dir", help="directory with the chapter .txt files")
+    parser.add_argument("--keep-ratio", type=float, default=0.4)
+    parser.add_argument("--method", choices=("textrank", "tfidf"), default="textrank")
+    parser.add_argument("--show", type=int, default=0, help="print the first N compressed chapters")
+    args = parser.parse_args()
+
+    paths = sorted(os.path.join(args.story_dir, f) for f in os.listdir(args.story_dir) if f.endswith(".txt"))
+    if not paths:
+        sys.exit(f"No chapter files in {args.story_dir}")
+    compressor = ExtractiveCompressor(args.keep_ratio, args.method)
+    for i, path in enumerate(paths):
+        with open(path, "r", encoding="utf-8") as f:
+            compressed = compressor.compress(f.read())
+        if i < args.show:
+            print(f"--- {os.path.basename(path)}\n{compressed}\n")
+    print(f"Compression: {compressor.stats()}")
@@ -0,0 +1,234 @@
+import os
+import re
+import sys
+import time
+import argparse
+import unicodedata
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from planner import estimate_tokens
+
+_MASK32 = np.uint64(0xFFFFFFFF)
+_SHIFT = np.uint64(32)
+
+TITLE_RE = re.compile(r"^\s*(?:chương|chapter|quyển|hồi)\s*[\dIVXLC]+[^\n]*\n", re.IGNORECASE)
+ANNOUNCEMENT_TERMS = [
+    "thông báo", "xin nghỉ", "tạm nghỉ", "nghỉ một ngày", "cầu phiếu", "đề cử", "nguyệt phiếu",
+    "ủng hộ", "donate", "cảm ơn các bạn", "lời tác giả", "tác giả có lời", "xin lỗi các bạn",
+    "chương sau", "bù chương", "up chương",
+]
+ANNOUNCEMENT_TITLE_RE = re.compile(r"thông báo|xin nghỉ|tạm nghỉ|lời tác giả|cảm nghĩ|cầu phiếu", re.IGNORECASE)
+
+def normalize(text: str) -> str:
+    """Lowercased NFC text without the chapter title line, so reposts under a new number still match"""
+    text = unicodedata.normalize("NFC", text).lower()
+    return TITLE_RE.sub("", text, count=1)
+
+def is_announcement(text: str, max_chars: int = 2500) -> bool:
+    """A short page whose title marks it as an author's notice rather than story text"""
+    if len(normalize(text).strip()) > max_chars:
+        return False
+    return bool(ANNOUNCEMENT_TITLE_RE.search(text.strip().split("\n", 1)[0]))
+
+def announcement_terms(text: str, max_chars: int = 2500) -> List[str]:
+    """
+    Notice phrases in a short page without an announcement title. Story text uses these
+    words too, so such pages are only reported, never skipped.
+    """
+    body = normalize(text).strip()
+    if len(body) > max_chars:
+        return []
+    return [term for term in ANNOUNCEMENT_TERMS if term in body]
+
+class MinHasher:
+    """
+    MinHash signatures over word shingles. A chapter becomes the set of hashed
+    `shingle`-word windows; each of the `num_perm` universal hash functions keeps its
+    minimum over that set, so the fraction of equal signature entries estimates the
+    Jaccard similarity of two chapters. The hash functions are multiply-shift,
+    (a * x + b) >> 32 in wrapping uint64 arithmetic, vectorized per chapter with numpy.
+    """
+    def __init__(self, num_perm: int = 128, shingle: int = 5, seed: int = 1):
+        rng = np.random.default_rng(seed)
+        self.num_perm = num_perm
+        self.shingle = shingle
+        self.a = rng.integers(1, 1 << 63, size=num_perm, dtype=np.uint64) | np.uint64(1)
+        self.b = rng.integers(0, 1 << 63, size=num_perm, dtype=np.uint64)
+        self.vocab: Dict[str, int] = {}
+
+    def shingles(self, text: str) -> np.ndarray:
+        words = normalize(text).split()
+        ids = np.fromiter((self.vocab.setdefault(w, len(self.vocab) + 1) for w in words), dtype=np.uint64, count=len(words))
+        if len(ids) < self.shingle:
+            return np.unique(ids)
+        # Polynomial hash of each window, truncated to 32 bits
+        h = np.zeros(len(ids) - self.shingle + 1, dtype=np.uint64)
+        for k in range(self.shingle):
+            h = (h * np.uint64(1000003) + ids[k:len(ids) - self.shingle + 1 + k]) & _MASK32
+        return np.unique(h)
+
+    def signature(self, text: str) -> np.ndarray:
+        shingles = self.shingles(text)
+        if len(shingles) == 0:
+            return np.full(self.num_perm, _MASK32, dtype=np.uint64)
+        return ((self.a[:, None] * shingles[None, :] + self.b[:, None]) >> _SHIFT).min(axis=1)
+
+    def signatures(self, texts: Sequence[str]) -> np.ndarray:
+        return np.stack([self.signature(text) for text in texts]) if texts else np.zeros((0, self.num_perm), dtype=np.uint64)
+
+def near_duplicates(signatures: np.ndarray, threshold: float = 0.8, bands: int = 16) -> List[Tuple[int, int, float]]:
+    """
+    (i, j, similarity) for i < j with estimated Jaccard >= threshold. Candidates come from
+    locality-sensitive hashing: chapters that agree on every row of at least one of
+    `bands` signature bands, then each candidate pair is checked on the full signature.
+    """
+    n, num_perm = signatures.shape
+    rows = num_perm // bands
+    candidates = set()
+    for band in range(bands):
+        buckets: Dict[bytes, List[int]] = {}
+        block = np.ascontiguousarray(signatures[:, band * rows:(band + 1) * rows])
+        for i in range(n):
+            buckets.setdefault(block[i].tobytes(), []).append(i)
+        for members in buckets.values():
+            if len(members) > 1:
+                candidates.update((members[x], members[y]) for x in range(len(members)) for y in range(x + 1, len(members)))
+    pairs = []
+    for i, j in sorted(candidates):
+        similarity = float(np.mean(signatures[i] == signatures[j]))
+        if similarity >= threshold:
+            pairs.append((i, j, similarity))
+    return pairs
+
+def dedup_chapters(story_paths: Sequence[str], threshold: float = 0.8, num_perm: int = 128,
+                   bands: int = 16, shingle: int = 5, announcement_chars: int = 2500) -> Tuple[List[str], Dict]:
+    """
+    Drop near-duplicate chapters and short pages titled as announcements.
+
+    Each group of near-duplicates keeps one chapter, the longest (usually the
+    corrected repost), in the position of the group's first chapter. Short pages whose
+    body has two or more notice phrases but no announcement title are kept and listed
+    under `suspects`. Returns the kept paths in order and a report with what was
+    skipped, the suspects, the estimated tokens saved, and `spans`: for each kept path,
+    how many original chapters it stands for (itself plus skipped chapters up to the
+    next kept one), so chapter ranges stay right.
+    """
+    start = time.perf_counter()
+    texts = []
+    for path in story_paths:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                texts.append(f.read())
+        except (FileNotFoundError, UnicodeDecodeError) as e:
+            print(f"Dedup could not read {path}: {e}")
+            texts.append("")
+
+    skipped = {}
+    announcements = [i for i, text in enumerate(texts) if is_announcement(text, announcement_chars)]
+    for i in announcements:
+        skipped[i] = {"reason": "announcement"}
+    suspects = []
+    for i, text in enumerate(texts):
+        terms = announcement_terms(text, announcement_chars) if i not in skipped else []
+        if len(terms) >= 2:
+            suspects.append({"path": story_paths[i], "terms": terms})
+
+    hasher = MinHasher(num_perm=num_perm, shingle=shingle)
+    candidates = [i for i in range(len(texts)) if i not in skipped and texts[i].strip()]
+    signatures = hasher.signatures([texts[i] for i in candidates])
+    parent = {i: i for i in candidates}
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    similarity = {}
+    for x, y, sim in near_duplicates(signatures, threshold, bands):
+        i, j = candidates[x], candidates[y]
+        similarity[j] = max(similarity.get(j, 0.0), sim)
+        parent[find(j)] = find(i)
+    groups: Dict[int, List[int]] = {}
+    for i in candidates:
+        groups.setdefault(find(i), []).append(i)
+
+    replacement = {}
+    for members in groups.values():
+        if len(members) == 1:
+            continue
+        keep = max(members, key=lambda i: len(texts[i]))
+        first = min(members)
+        replacement[first] = keep
+        for i in members:
+            if i != keep:
+                skipped[i] = {"reason": "duplicate", "of": os.path.basename(story_paths[keep]),
+                              "similarity": round(similarity.get(i, similarity.get(keep, 1.0)), 3)}
+
+    # a kept chapter that moved up to its group's first slot is not read again at its own
+    moved = set(replacement.values()) - set(replacement)
+    kept, spans = [], {}
+    leading = 0
+    for i in range(len(story_paths)):
+        if i in replacement:
+            kept.append(story_paths[replacement[i]])
+            spans[kept[-1]] = 1 + leading
+            leading = 0
+        elif i in skipped or i in moved:
+            if kept:
+                spans[kept[-1]] += 1
+            else:
+                leading += 1
+        else:
+            kept.append(story_paths[i])
+            spans[kept[-1]] = 1 + leading
+            leading = 0
+
+    report = {
+        "chapters": len(story_paths),
+        "kept": len(kept),
+        "skipped": [
+            {"path": story_paths[i], **info, "tokens": estimate_tokens(texts[i])}
+            for i, info in sorted(skipped.items())
+        ],
+        "suspects": suspects,
+        "spans": spans,
+        "seconds": time.perf_counter() - start,
+    }
+    report["tokens_saved"] = sum(item["tokens"] for item in report["skipped"])
+    return kept, report
+
+def format_report(report: Dict, limit: int = 20) -> str:
+    announcements = sum(1 for item in report["skipped"] if item["reason"] == "announcement")
+    lines = [
+        f"Dedup: kept {report['kept']} of {report['chapters']} chapters, skipped "
+        f"{len(report['skipped']) - announcements} duplicates and {announcements} announcements, "
+        f"~{report['tokens_saved']} tokens saved ({report['seconds']:.2f}s)"
+    ]
+    for item in report["skipped"][:limit]:
+        detail = f"duplicate of {item['of']} ({item['similarity']:.2f})" if item["reason"] == "duplicate" else "announcement"
+        lines.append(f"  {os.path.basename(item['path'])}: {detail}")
+    if len(report["skipped"]) > limit:
+        lines.append(f"  ... {len(report['skipped']) - limit} more")
+    suspects = report.get("suspects", [])
+    if suspects:
+        lines.append(f"Kept {len(suspects)} short chapters that read like announcements; check them:")
+        for item in suspects[:limit]:
+            lines.append(f"  {os.path.basename(item['path'])}: {', '.join(item['terms'])}")
+        if len(suspects) > limit:
+            lines.append(f"  ... {len(suspects) - limit} more")
+    return "\n".join(lines)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report near-duplicate and announcement chapters of a story")
+    parser.add_argument("story_dir", help="directory with the chapter .txt files")
+    parser.add_argument("--threshold", type=float, default=0.8, help="estimated Jaccard similarity")
+    args = parser.parse_args()
+
+    paths = sorted(os.path.join(args.story_dir, f) for f in os.listdir(args.story_dir) if f.endswith(".txt"))
+    if not paths:
+        sys.exit(f"No chapter files in {args.story_dir}")
+    _, report = dedup_chapters(paths, threshold=args.threshold)
+    print(format_report(report, limit=10**6))
@@ -0,0 +1,162 @@
+import os
+import re
+import json
+import asyncio
+import hashlib
+import time
+from collections import Counter
+
+from llama_index.core.llms import ChatMessage, ChatResponse
+
+from characters import merge_characters, proper_names
+from planner import CHARS_PER_TOKEN
+
+class FakeLLM:
+    """
+    Offline stand-in for GoogleGenAI used by the benchmarks and load tests.
+    Replies are deterministic and extractive: extraction prompts get the character list
+    they were given plus the names found in the chapter text, and the chapter's first
+    sentences; every other prompt gets the first
+    sentences of the longest section after the instructions. A `max_output_tokens` in
+    `generation_config` cuts the reply like the API does. `latency` adds a fixed delay per call;
+    `astream_chat` spreads it over the chunks, with the first one after a quarter of it.
+    """
+    def __init__(self, latency: float = 0.0, summary_chars: int = 400, model: str = "fake"):
+        self.latency = latency
+        self.summary_chars = summary_chars
+        self.model = model
+        self.calls = 0
+        self.input_chars = 0
+        self.output_chars = 0
+
+    def _leading_sentences(self, text: str, limit: int) -> str:
+        out = []
+        size = 0
+        for sentence in re.split(r"(?<=[.!?…])\s+", text.strip()):
+            sentence = sentence.strip()
+            if not sentence:
+                continue
+            if size + len(sentence) > limit and out:
+                break
+            out.append(sentence[:limit])
+            size += len(sentence)
+        return " ".join(out)
+
+    def reply(self, prompt: str) -> str:
+        if "Truyện:" in prompt:
+            chapter_text = prompt.rsplit("Truyện:", 1)[1]
+            names = [name for name, _ in Counter(proper_names(chapter_text)).most_common(5)]
+            characters = "\n".join(f"{name}: nhân vật xuất hiện trong truyện" for name in names)
+            if "Danh sách các nhân vật đã được đề cập:" in prompt:
+                known = prompt.split("Danh sách các nhân vật đã được đề cập:", 1)[1].split("Tóm tắt của các chương truyện gần đây:", 1)[0]
+                characters = merge_characters(known.strip(), characters)
+            summary = self._leading_sentences(" ".join(chapter_text.split("\n")[1:]), self.summary_chars)
+            return f"## Danh sách nhân vật\n{characters}\n\n## Tóm tắt chương truyện:\n{summary}"
+        # Prompts open with instructions, then the material under short "Header:" lines
+        blocks = re.split(r"^[^\n]{0,80}:\s*$|^-{3,}\s*$", prompt, flags=re.MULTILINE)
+        body = max([block for block in blocks[1:] if block.strip()] or blocks, key=len)
+        return self._leading_sentences(body, self.summary_chars * 2)
+
+    def _respond(self, messages, generation_config=None) -> ChatResponse:
+        prompt = messages[-1].content or ""
+        text = self.reply(prompt)
+        max_tokens = (generation_config or {}).get("max_output_tokens")
+        if max_tokens:
+            text = text[:int(max_tokens * CHARS_PER_TOKEN)]
+        self.calls += 1
+        self.input_chars += sum(len(m.content or "") for m in messages)
+        self.output_chars += len(text)
+        return ChatResponse(message=ChatMessage(role="assistant", content=text))
+
+    def chat(self, messages, **kwargs) -> ChatResponse:
+        if self.latency:
+            time.sleep(self.latency)
+        return self._respond(messages, kwargs.get("generation_config"))
+
+    async def achat(self, messages, **kwargs) -> ChatResponse:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._respond(messages, kwargs.get("generation_config"))
+
+    async def astream_chat(self, messages, **kwargs):
+        response = self._respond(messages, kwargs.get("generation_config"))
+        text = response.message.content
+        chunks = re.findall(r"\S+\s*|\s+", text) or [""]
+
+        async def gen():
+            content = ""
+            for n, delta in enumerate(chunks):
+                if self.latency:
+                    await asyncio.sleep(self.latency / 4 if n == 0 else self.latency * 3 / 4 / len(chunks))
+                content += delta
+                yield ChatResponse(message=ChatMessage(role="assistant", content=content), delta=delta)
+
+        return gen()
+
+class ReplayLLM:
+    """
+    Recorded responses, so a benchmark over a fixed corpus can be rerun without API calls.
+    Responses are keyed by the messages and the generation config and stored one JSON
+    object per line in `path`. With an `inner` LLM, prompts that are not recorded yet
+    are sent to it and appended; without one they raise KeyError.
+    """
+    def __init__(self, path: str, inner=None):
+        self.path = path
+        self.inner = inner
+        self.model = getattr(inner, "model", "replay")
+        self.responses = {}
+        self.calls = 0
+        self.recorded = 0
+        self.input_chars = 0
+        self.output_chars = 0
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.responses[entry["key"]] = entry["text"]
+
+    @staticmethod
+    def key(messages, generation_config=None) -> str:
+        payload = json.dumps([[str(m.role), m.content or ""] for m in messages] + [generation_config or {}],
+                             ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _record(self, key: str, text: str):
+        self.responses[key] = text
+        self.recorded += 1
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"key": key, "text": text}, ensure_ascii=False) + "\n")
+
+    def _lookup(self, messages, kwargs):
+        key = self.key(messages, kwargs.get("generation_config"))
+        if key not in self.responses and self.inner is None:
+            raise KeyError(f"No recorded response for prompt {key[:12]}, record it first with an inner LLM")
+        return key
+
+    def _respond(self, messages, text: str) -> ChatResponse:
+        self.calls += 1
+        self.input_chars += sum(len(m.content or "") for m in messages)
+        self.output_chars += len(text)
+        return ChatResponse(message=ChatMessage(role="assistant", content=text))
+
+    def chat(self, messages, **kwargs) -> ChatResponse:
+        key = self._lookup(messages, kwargs)
+        if key not in self.responses:
+            self._record(key, str(self.inner.chat(messages, **kwargs).message.content or ""))
+        return self._respond(messages, self.responses[key])
+
+    async def achat(self, messages, **kwargs) -> ChatResponse:
+        key = self._lookup(messages, kwargs)
+        if key not in self.responses:
+            self._record(key, str((await self.inner.achat(messages, **kwargs)).message.content or ""))
+        return self._respond(messages, self.responses[key])
+
+    async def astream_chat(self, messages, **kwargs):
+        response = await self.achat(messages, **kwargs)
+
+        async def gen():
+            yield ChatResponse(message=response.message, delta=response.message.content)
+
+        return gen()
@@ -0,0 +1,165 @@
+import os
+import re
+import sys
+import math
+import time
+import argparse
+import unicodedata
+from collections import Counter
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from characters import character_names, normalize_name, proper_names
+from planner import estimate_tokens, rollups_after
+
+WORD_RE = re.compile(r"\w+")
+# Lines of speech: opened by a quote or a dash, as Vietnamese web novels write them
+DIALOGUE_RE = re.compile(r"^\s*[\"“”'‘\-–—]")
+
+# Weights of the z-scored signals: new names, dialogue density, lexical novelty
+SIGNAL_WEIGHTS = (0.5, 0.2, 0.3)
+
+def dialogue_density(text: str) -> float:
+    lines = [line for line in text.splitlines() if line.strip()]
+    if not lines:
+        return 0.0
+    return sum(1 for line in lines if DIALOGUE_RE.match(line)) / len(lines)
+
+class ImportanceScorer:
+    """
+    Scores chapters on CPU, without any LLM call, by how much they are likely to add
+    to the summary:
+    - new names: capitalized names used at least `min_mentions` times that are neither
+      in the known character list nor in an earlier chapter
+    - dialogue density: share of lines that are speech
+    - lexical novelty: share of the chapter's distinct words not used in the previous
+      `window` chapters, computed over word ids with numpy
+    Each signal is z-scored over the book and combined with `weights`. A chapter is
+    filler when its score is in the lowest `filler_quantile` and it has no new names.
+    """
+    def __init__(self, window: int = 20, min_mentions: int = 2, filler_quantile: float = 0.3,
+                 weights: Tuple[float, float, float] = SIGNAL_WEIGHTS):
+        self.window = window
+        self.min_mentions = min_mentions
+        self.filler_quantile = filler_quantile
+        self.weights = np.array(weights, dtype=np.float64)
+
+    def score(self, texts: Sequence[str], known_characters: str = "") -> Dict:
+        n = len(texts)
+        known = {normalize_name(name) for name in character_names(known_characters)}
+        vocab: Dict[str, int] = {}
+        word_ids, new_names, dialogue = [], np.zeros(n), np.zeros(n)
+        for i, text in enumerate(texts):
+            text = unicodedata.normalize("NFC", text)
+            words = WORD_RE.findall(text.lower())
+            word_ids.append(np.unique(np.fromiter((vocab.setdefault(w, len(vocab)) for w in words), dtype=np.int64, count=len(words))))
+            counts = Counter(normalize_name(name) for name in proper_names(text))
+            new_names[i] = sum(1 for name, count in counts.items() if count >= self.min_mentions and name not in known)
+            known.update(counts)
+            dialogue[i] = dialogue_density(text)
+
+        # Index of the last chapter each word was seen in; a word is novel if that is
+        # more than `window` chapters back (or never)
+        last_seen = np.full(len(vocab), -(self.window + 1), dtype=np.int64)
+        novelty = np.zeros(n)
+        for i, ids in enumerate(word_ids):
+            if len(ids):
+                novelty[i] = np.mean(last_seen[ids] < i - self.window)
+                last_seen[ids] = i
+        # The first chapters are all novel; compare them with the book instead
+        if n > self.window:
+            novelty[:self.window] = np.median(novelty[self.window:])
+
+        signals = np.stack([np.log1p(new_names), dialogue, novelty], axis=1)
+        std = signals.std(axis=0)
+        z = (signals - signals.mean(axis=0)) / np.where(std > 0, std, 1.0)
+        scores = z @ self.weights
+        # Lowest-ranked chapters, so ties at the cutoff cannot make most of a book filler
+        lowest = np.zeros(n, dtype=bool)
+        lowest[np.argsort(scores, kind="stable")[:int(self.filler_quantile * n)]] = True
+        filler = lowest & (new_names == 0)
+        return {"scores": scores, "filler": filler, "new_names": new_names, "dialogue": dialogue, "novelty": novelty}
+
+def plan_batches(story_paths: Sequence[str], filler: Sequence[bool], gather: int,
+                 filler_weight: float = 0.5, max_batch: int = None) -> List[List[str]]:
+    """
+    Batches of chapter paths in order. A chapter counts 1 towards `gather`, a filler
+    chapter `filler_weight`, so runs of filler are merged into fewer, larger batches.
+    No batch holds more than `max_batch` chapters (2 x gather by default).
+    """
+    max_batch = max_batch or 2 * gather
+    batches, batch, weight = [], [], 0.0
+    for path, is_filler in zip(story_paths, filler):
+        batch.append(path)
+        weight += filler_weight if is_filler else 1.0
+        if weight >= gather - 1e-9 or len(batch) >= max_batch:
+            batches.append(batch)
+            batch, weight = [], 0.0
+    if batch:
+        batches.append(batch)
+    return batches
+
+def importance_batches(story_paths: Sequence[str], gather: int, big_summary_interval: int = 100,
+                       known_characters: str = "", filler_weight: float = 0.5, max_batch: int = None,
+                       scorer: ImportanceScorer = None) -> Tuple[List[List[str]], Dict]:
+    """
+    Score the chapters and plan their batches. Returns the batches for
+    `BookSummary(batches=...)` and a report with the filler chapters and the LLM calls
+    (batch calls and roll-ups) avoided against fixed batches of `gather` chapters.
+    """
+    start = time.perf_counter()
+    texts = []
+    for path in story_paths:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                texts.append(f.read())
+        except (FileNotFoundError, UnicodeDecodeError) as e:
+            print(f"Importance scoring could not read {path}: {e}")
+            texts.append("")
+    scored = (scorer or ImportanceScorer()).score(texts, known_characters)
+    batches = plan_batches(story_paths, scored["filler"], gather, filler_weight, max_batch)
+
+    # Roll-ups follow the chapters covered, not the batch count, see planner.rollups_after
+    baseline = math.ceil(len(story_paths) / gather) if story_paths else 0
+    fixed = [min(gather, len(story_paths) - i) for i in range(0, len(story_paths), gather)]
+    calls_before = baseline + sum(rollups_after(fixed, big_summary_interval))
+    calls_after = len(batches) + sum(rollups_after([len(batch) for batch in batches], big_summary_interval))
+    report = {
+        "chapters": len(story_paths),
+        "filler": [path for path, is_filler in zip(story_paths, scored["filler"]) if is_filler],
+        "batches": len(batches),
+        "baseline_batches": baseline,
+        "calls_avoided": calls_before - calls_after,
+        "calls_before": calls_before,
+        "filler_tokens": sum(estimate_tokens(text) for text, is_filler in zip(texts, scored["filler"]) if is_filler),
+        "scores": {path: round(float(score), 3) for path, score in zip(story_paths, scored["scores"])},
+        "seconds": time.perf_counter() - start,
+    }
+    return batches, report
+
+def format_report(report: Dict, limit: int = 20) -> str:
+    lines = [
+        f"Importance: {len(report['filler'])} of {report['chapters']} chapters are filler, "
+        f"{report['batches']} batches instead of {report['baseline_batches']}, "
+        f"{report['calls_avoided']} of {report['calls_before']} LLM calls avoided ({report['seconds']:.2f}s)"
+    ]
+    for path in report["filler"][:limit]:
+        lines.append(f"  {os.path.basename(path)}: filler ({report['scores'][path]:+.2f})")
+    if len(report["filler"]) > limit:
+        lines.append(f"  ... {len(report['filler']) - limit} more")
+    return "\n".join(lines)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Score the chapters of a story and show the batches filler merging saves")
+    parser.add_argument("story_dir", help="directory with the chapter .txt files")
+    parser.add_argument("--gather", type=int, default=10)
+    parser.add_argument("--interval", type=int, default=100)
+    parser.add_argument("--filler-weight", type=float, default=0.5)
+    args = parser.parse_args()
+
+    paths = sorted(os.path.join(args.story_dir, f) for f in os.listdir(args.story_dir) if f.endswith(".txt"))
+    if not paths:
+        sys.exit(f"No chapter files in {args.story_dir}")
+    _, report = importance_batches(paths, args.gather, args.interval, filler_weight=args.filler_weight)
+    print(format_report(report, limit=10**6))
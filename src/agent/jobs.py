@@ -0,0 +1,403 @@
+import os
+import sys
+import json
+import time
+import uuid
+import shutil
+import socket
+import asyncio
+import hashlib
+import argparse
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: only threads of this process are serialized
+    fcntl = None
+
+from trackapi import QuotaExhausted, QuotaStore, default_api_key, env_api_keys, quota_key
+
+DEFAULT_MODEL = "models/gemini-2.0-flash"
+
+def key_id(api_key: str) -> str:
+    """Id of an API key that a job file can keep without the key itself"""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+def pid_alive(pid: int) -> bool:
+    if os.name == "nt":  # os.kill would terminate the process; rely on the heartbeat alone
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+class JobScheduler:
+    """
+    Runs summary jobs in the background and parks them when a daily quota runs out.
+
+    A job is a JSON file under `jobs_dir` holding the story, the BookSummary settings
+    (batching, chapter spans, output budget, compression, streaming), its status
+    (queued, running, parked, done, failed) and, once parked, a checkpoint from
+    `BookSummary.checkpoint()` plus the quota reset time. Chapter files are linked
+    into the job's own directory, so story cache eviction cannot remove them. Each
+    running job holds one API key; on QuotaExhausted the job is checkpointed and parked,
+    its key is released, and other jobs keep running on other keys. A parked job is
+    picked up again, from its checkpoint, once a key with quota is free.
+
+    A running job records its owner (host, pid and a heartbeat every
+    `heartbeat_interval` seconds). Another scheduler only takes it over once the owner
+    process is gone or its heartbeat is older than `owner_ttl`; jobs are claimed under
+    an fcntl lock on `jobs_dir/.lock`, so several processes can share `jobs_dir`.
+
+    Keys come from GOOGLE_API_KEYS (comma separated) or GOOGLE_API_KEY. A key given to
+    `submit` is kept in memory only, and the job records its `key_id`: that job only
+    runs on that key. After a restart it waits, flagged `key_missing`, until the key is
+    in the pool or given again with `provide_key`. `llm_factory(api_key)` builds the
+    LLM of a run, GoogleGenAI by default.
+    """
+    def __init__(
+        self,
+        jobs_dir: str = "jobs",
+        api_keys: Optional[List[str]] = None,
+        quota_store: QuotaStore = None,
+        model: str = DEFAULT_MODEL,
+        daily_quota: int = 1500,
+        max_running: int = 2,
+        poll_interval: float = 30,
+        llm_factory: Callable = None,
+        workflow_timeout: float = 24 * 3600,
+        heartbeat_interval: float = 60,
+        owner_ttl: float = 300,
+    ):
+        self.jobs_dir = jobs_dir
+        if api_keys is None:
+            api_keys = env_api_keys()
+        self.api_keys = api_keys
+        self.quota_store = quota_store or QuotaStore()
+        self.model = model
+        self.daily_quota = daily_quota
+        self.max_running = max_running
+        self.poll_interval = poll_interval
+        self.llm_factory = llm_factory
+        self.workflow_timeout = workflow_timeout
+        self.heartbeat_interval = heartbeat_interval
+        self.owner_ttl = owner_ttl
+        self.host = socket.gethostname()
+        self.job_keys: Dict[str, str] = {}
+        self.busy_keys = set()
+        self.running: Dict[str, asyncio.Task] = {}
+        self._lock = threading.Lock()
+        self._wake = None
+        self._thread = None
+        os.makedirs(jobs_dir, exist_ok=True)
+
+    @contextmanager
+    def _locked(self):
+        with self._lock:
+            with open(os.path.join(self.jobs_dir, ".lock"), "a") as lock_file:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _path(self, job_id: str) -> str:
+        return os.path.join(self.jobs_dir, f"{job_id}.json")
+
+    def _save(self, job: Dict):
+        job["updated"] = time.time()
+        tmp = self._path(job["id"]) + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(job, f, ensure_ascii=False)
+        os.replace(tmp, self._path(job["id"]))
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        try:
+            with open(self._path(job_id), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def jobs(self) -> List[Dict]:
+        jobs = [self.get(f[:-5]) for f in os.listdir(self.jobs_dir) if f.endswith(".json")]
+        return sorted((job for job in jobs if job), key=lambda job: job["created"])
+
+    def submit(self, story_paths: List[str], name: str, settings: Dict = None, checkpoint: Dict = None,
+               api_key: str = None, reset_at: float = None) -> str:
+        """
+        Queue a summary of `story_paths`. With a checkpoint the job continues a run that
+        was parked; `reset_at` parks it until then.
+        """
+        settings = dict(settings or {})
+        if settings.get("max_chapters"):
+            story_paths = story_paths[:settings["max_chapters"]]
+        job_id = uuid.uuid4().hex[:12]
+        chapter_dir = os.path.join(self.jobs_dir, job_id)
+        os.makedirs(chapter_dir, exist_ok=True)
+        batch_paths = [path for batch in settings.get("batches") or [] for path in batch]
+        linked = {}
+        for path in dict.fromkeys(story_paths + (checkpoint or {}).get("story_paths", []) + batch_paths):
+            target = os.path.join(chapter_dir, os.path.basename(path))
+            try:
+                os.link(path, target)
+            except OSError:
+                shutil.copyfile(path, target)
+            linked[path] = target
+        if checkpoint:
+            checkpoint = {**checkpoint, "story_paths": [linked[p] for p in checkpoint["story_paths"]]}
+        # Batches and chapter spans name chapter files, so they follow the links too
+        if settings.get("batches"):
+            settings["batches"] = [[linked[p] for p in batch] for batch in settings["batches"]]
+        if settings.get("chapter_spans"):
+            settings["chapter_spans"] = {linked[p]: n for p, n in settings["chapter_spans"].items() if p in linked}
+        job = {
+            "id": job_id,
+            "name": name,
+            "story_paths": [linked[p] for p in story_paths],
+            "settings": settings,
+            "status": "parked" if reset_at else "queued",
+            "checkpoint": checkpoint,
+            "reset_at": reset_at,
+            "parked": 1 if reset_at else 0,
+            "key": key_id(api_key) if api_key else None,
+            "key_missing": False,
+            "owner": None,
+            "result": None,
+            "error": None,
+            "created": time.time(),
+        }
+        if api_key:
+            self.job_keys[job_id] = api_key
+        self._save(job)
+        self.wake()
+        return job_id
+
+    def wake(self):
+        """Re-check the queue now, e.g. after a submit"""
+        if self._wake is not None:
+            self._wake.set()
+
+    def provide_key(self, api_key: str):
+        """Give a key again, e.g. when its user comes back after a restart, to the jobs submitted with it"""
+        kid = key_id(api_key)
+        for job in self.jobs():
+            if job.get("key") == kid and job["status"] in ("queued", "parked", "running"):
+                self.job_keys[job["id"]] = api_key
+                if job.get("key_missing"):
+                    self._update(job["id"], key_missing=False)
+        self.wake()
+
+    def _update(self, job_id: str, **fields):
+        with self._locked():
+            job = self.get(job_id)
+            if job is not None:
+                job.update(fields)
+                self._save(job)
+
+    def _key_for(self, job: Dict) -> Optional[str]:
+        """
+        A free key with quota left: the job's own key if it was submitted with one, else
+        one from the pool. A job whose own key this process does not have is flagged.
+        """
+        if job.get("key"):
+            if job["id"] in self.job_keys:
+                candidates = [self.job_keys[job["id"]]]
+            else:
+                candidates = [key for key in self.api_keys if key_id(key) == job["key"]]
+            if not candidates:
+                if not job.get("key_missing"):
+                    self._update(job["id"], key_missing=True)
+                return None
+        else:
+            candidates = self.api_keys
+        for key in candidates:
+            if key not in self.busy_keys and self.quota_store.available(quota_key(key, self.model), self.daily_quota):
+                return key
+        return None
+
+    def _build(self, job: Dict, api_key: str):
+        from workflow import BookSummary
+        from budget import OutputBudget
+        from compress import ExtractiveCompressor
+        settings = job["settings"]
+        checkpoint = job["checkpoint"] or {}
+        llm = self.llm_factory(api_key) if self.llm_factory else None
+        story_paths = checkpoint.get("story_paths", job["story_paths"])
+        batches = None
+        if settings.get("batches"):
+            # A checkpoint is taken after a finished batch, so the remaining batches are whole
+            remaining = set(story_paths)
+            batches = [batch for batch in settings["batches"] if batch[0] in remaining] or None
+        keep_ratio = settings.get("keep_ratio")
+        return BookSummary(
+            story_paths,
+            gather_chapters=settings.get("gather_chapters", 10),
+            max_chapters=len(story_paths),
+            big_summary_interval=settings.get("big_summary_interval", 100),
+            quota_per_minute=settings.get("quota_per_minute", 15),
+            initial_short_summaries=checkpoint.get("short_summaries", settings.get("short_summaries")),
+            initial_long_summaries=checkpoint.get("long_summaries", settings.get("long_summaries")),
+            initial_characters=checkpoint.get("characters", settings.get("characters", "")),
+            chapter_offset=checkpoint.get("chapter_offset", 0),
+            rollup_start=checkpoint.get("rollup_start"),
+            chapter_spans=settings.get("chapter_spans"),
+            batches=batches,
+            budget=OutputBudget() if settings.get("budget") else None,
+            compressor=ExtractiveCompressor(keep_ratio) if keep_ratio and keep_ratio < 1 else None,
+            stream=settings.get("stream", False),
+            api_key=api_key,
+            llm=llm,
+            daily_quota=self.daily_quota,
+            quota_store=self.quota_store,
+            quota_key=quota_key(api_key, self.model),
+            timeout=self.workflow_timeout,
+        )
+
+    def _owner(self) -> Dict:
+        return {"host": self.host, "pid": os.getpid(), "beat": time.time()}
+
+    def _owner_alive(self, owner: Optional[Dict]) -> bool:
+        if not owner or time.time() - owner["beat"] > self.owner_ttl:
+            return False
+        if owner["host"] != self.host:
+            return True
+        # A job this process still ran would be in self.running
+        return owner["pid"] != os.getpid() and pid_alive(owner["pid"])
+
+    def _claim(self, job_id: str) -> Optional[Dict]:
+        """Mark a job as running in this process, unless another live process got to it first"""
+        with self._locked():
+            job = self.get(job_id)
+            if job is None or job["status"] not in ("queued", "parked", "running"):
+                return None
+            if job["status"] == "running" and self._owner_alive(job.get("owner")):
+                return None
+            job.update(status="running", reset_at=None, owner=self._owner(), key_missing=False)
+            self._save(job)
+        return job
+
+    async def _heartbeat(self, job: Dict):
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            job["owner"] = self._owner()
+            self._save(job)
+
+    async def run_job(self, job: Dict, api_key: str):
+        job.update(status="running", reset_at=None, owner=self._owner())
+        self._save(job)
+        heartbeat = asyncio.ensure_future(self._heartbeat(job))
+        w = None
+        try:
+            # Building the LLM can fail too (bad key, network), which must not leave the job running
+            w = self._build(job, api_key)
+            result = await w.run()
+        except QuotaExhausted as e:
+            checkpoint = w.checkpoint() if w is not None else job["checkpoint"]
+            job.update(status="parked", checkpoint=checkpoint, reset_at=e.reset_at, parked=job["parked"] + 1)
+            print(f"Job {job['id']} parked until {datetime.fromtimestamp(e.reset_at):%Y-%m-%d %H:%M}")
+        except Exception as e:
+            job.update(status="failed", error=str(e))
+            print(f"Job {job['id']} failed: {e}")
+        else:
+            job.update(status="done", result=str(result).strip(), checkpoint=None)
+            shutil.rmtree(os.path.join(self.jobs_dir, job["id"]), ignore_errors=True)
+            self.job_keys.pop(job["id"], None)
+        finally:
+            heartbeat.cancel()
+            job["owner"] = None
+            self.busy_keys.discard(api_key)
+            self._save(job)
+            self.wake()
+
+    def _runnable(self) -> List[Dict]:
+        # Parked jobs can go on as soon as any of their keys has quota again; "running"
+        # jobs are only taken over once their owner process stopped
+        return [job for job in self.jobs()
+                if job["id"] not in self.running and (job["status"] in ("queued", "parked")
+                    or job["status"] == "running" and not self._owner_alive(job.get("owner")))]
+
+    def _next_wakeup(self) -> float:
+        resets = [job["reset_at"] for job in self.jobs() if job["status"] == "parked" and job["reset_at"]]
+        return max(0.0, min([self.poll_interval] + [r - time.time() for r in resets]))
+
+    def schedule(self) -> int:
+        """Start runnable jobs while keys and slots are free; returns the number started"""
+        started = 0
+        for job in self._runnable():
+            if len(self.running) >= self.max_running:
+                break
+            api_key = self._key_for(job)
+            if api_key is None:
+                continue
+            job = self._claim(job["id"])
+            if job is None:
+                continue
+            self.busy_keys.add(api_key)
+            task = asyncio.ensure_future(self.run_job(job, api_key))
+            self.running[job["id"]] = task
+            task.add_done_callback(lambda _, job_id=job["id"]: self.running.pop(job_id, None))
+            started += 1
+        return started
+
+    async def run(self, until_idle: bool = False):
+        """Scheduling loop. With until_idle it returns once no job is queued, running or parked."""
+        self._wake = asyncio.Event()
+        while True:
+            self._wake.clear()
+            self.schedule()
+            if until_idle and not self.running and not any(job["status"] in ("queued", "parked") for job in self.jobs()):
+                return
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self._next_wakeup() if not self.running else self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self):
+        """Run the scheduling loop in a daemon thread with its own event loop"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=lambda: asyncio.run(self.run()), daemon=True)
+            self._thread.start()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Queue summary jobs and run them, parking on daily quota exhaustion")
+    sub = parser.add_subparsers(dest="command", required=True)
+    submit = sub.add_parser("submit", help="queue a story directory")
+    submit.add_argument("story_dir")
+    submit.add_argument("--gather", type=int, default=10)
+    submit.add_argument("--interval", type=int, default=100)
+    submit.add_argument("--max-chapters", type=int, default=1000)
+    submit.add_argument("--checkpoint", help="continue from a checkpoint JSON saved by Summary()")
+    sub.add_parser("run", help="run queued and parked jobs until none are left")
+    sub.add_parser("list", help="show job status")
+    parser.add_argument("--jobs-dir", default="jobs")
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+    load_dotenv()
+    scheduler = JobScheduler(args.jobs_dir)
+    if args.command == "submit":
+        paths = sorted(os.path.join(args.story_dir, f) for f in os.listdir(args.story_dir) if f.endswith(".txt"))
+        settings = {"gather_chapters": args.gather, "big_summary_interval": args.interval, "max_chapters": args.max_chapters}
+        checkpoint, reset_at = None, None
+        if args.checkpoint:
+            with open(args.checkpoint, "r", encoding="utf-8") as f:
+                checkpoint = json.load(f)
+            reset_at = checkpoint.pop("reset_at", None)
+        print(scheduler.submit(paths, os.path.basename(os.path.normpath(args.story_dir)), settings, checkpoint, reset_at=reset_at))
+    elif args.command == "run":
+        if not scheduler.api_keys:
+            sys.exit("Set GOOGLE_API_KEY or GOOGLE_API_KEYS")
+        asyncio.run(scheduler.run(until_idle=True))
+    else:
+        for job in scheduler.jobs():
+            when = f" until {datetime.fromtimestamp(job['reset_at']):%Y-%m-%d %H:%M}" if job["status"] == "parked" and job["reset_at"] else ""
+            missing = "  (needs the API key it was submitted with)" if job.get("key_missing") else ""
+            print(f"{job['id']}  {job['status']:<8}{when}  {job['name']}{missing}")
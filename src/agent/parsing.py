@@ -0,0 +1,116 @@
+import re
+import unicodedata
+from typing import Tuple
+
+from characters import CHARACTER_LINE_RE
+
+class SummaryParseError(ValueError):
+    """
+    Model output could not be split into a character list and a summary.
+    `kind` is one of "empty" or "missing_summary".
+    """
+    def __init__(self, kind: str, message: str):
+        super().__init__(message)
+        self.kind = kind
+
+# Heading lines, with or without markdown (#, **), numbering or a trailing colon.
+# Inline content after the colon is kept ("Tóm tắt chương truyện: Lý Hạo ...").
+_HEADING_PREFIX = r"^\s*(?:#{1,6}\s*|\d+[.)]\s*)?\**\s*"
+_HEADING_SUFFIX = r"\s*\**\s*:?\s*\**\s*(?P<rest>.*)$"
+CHARACTER_HEADING_RE = re.compile(
+    _HEADING_PREFIX + r"(?:danh\s+sách\s+(?:các\s+)?)?nhân\s+vật(?:\s+(?:chính|xuất\s+hiện))?" + _HEADING_SUFFIX,
+    re.IGNORECASE,
+)
+SUMMARY_HEADING_RE = re.compile(
+    _HEADING_PREFIX + r"tóm\s+tắt(?:\s+(?:các\s+)?chương(?:\s+truyện)?)?(?:\s+\d+(?:\s*-\s*\d+)?)?" + _HEADING_SUFFIX,
+    re.IGNORECASE,
+)
+FENCE_RE = re.compile(r"^\s*```\w*\s*$")
+RULE_RE = re.compile(r"^\s*-{3,}\s*$")
+
+# Error messages that mean the request itself was too large for the model
+OVERSIZE_TERMS = [
+    "token count", "input token", "too many tokens", "context length", "context window",
+    "too long", "exceeds the maximum", "request payload size", "maximum number of tokens",
+]
+
+def is_oversize_error(error: Exception) -> bool:
+    message = str(error).lower()
+    return any(term in message for term in OVERSIZE_TERMS)
+
+def _clean(text: str) -> str:
+    text = unicodedata.normalize("NFC", text or "").strip()
+    if text.lower().startswith("assistant:"):
+        text = text[len("assistant:"):].lstrip()
+    return text
+
+def parse_summary_output(text: str) -> Tuple[str, str]:
+    """
+    Split a plain-text completion into (characters, summary).
+
+    Accepts the '## Danh sách nhân vật' / '## Tóm tắt chương truyện:' layout the prompts
+    ask for, plus the usual drift: other heading levels or bold headings, missing colons,
+    inline content after the heading, code fences, '-----' rules and a leading 'assistant:'.
+    Without headings, leading 'name: description' lines are taken as the character list
+    and the rest as the summary. The character list may come back empty; callers keep
+    the previous list in that case.
+    """
+    text = _clean(text)
+    if not text:
+        raise SummaryParseError("empty", "Model output is empty")
+
+    sections = {"characters": [], "summary": []}
+    preamble = []
+    current = None
+    for line in text.splitlines():
+        if FENCE_RE.match(line) or RULE_RE.match(line):
+            continue
+        summary_heading = SUMMARY_HEADING_RE.match(line)
+        character_heading = CHARACTER_HEADING_RE.match(line)
+        if summary_heading and (current != "summary" or not sections["summary"]):
+            current = "summary"
+            rest = summary_heading.group("rest").strip(" *")
+            if rest:
+                sections["summary"].append(rest)
+            continue
+        if character_heading and current is None:
+            current = "characters"
+            rest = character_heading.group("rest").strip(" *")
+            if rest and CHARACTER_LINE_RE.match(rest):
+                sections["characters"].append(rest)
+            continue
+        (sections[current] if current else preamble).append(line)
+
+    if current is None:
+        # No headings at all: leading character lines, then the summary
+        lines = [line for line in preamble if line.strip()]
+        split = 0
+        while split < len(lines) and CHARACTER_LINE_RE.match(lines[split]) and len(lines[split]) < 300:
+            split += 1
+        if split == len(lines):
+            raise SummaryParseError("missing_summary", "Model output only contains character lines")
+        return "\n".join(lines[:split]).strip(), "\n".join(lines[split:]).strip()
+
+    if not sections["characters"] and preamble and current == "summary":
+        # Character lines given before the summary heading without their own heading
+        sections["characters"] = [line for line in preamble if CHARACTER_LINE_RE.match(line)]
+
+    characters = "\n".join(sections["characters"]).strip()
+    summary = "\n".join(sections["summary"]).strip()
+    if not summary:
+        raise SummaryParseError("missing_summary", "Model output is missing the chapter summary section")
+    return characters, summary
+
+def partial_summary(text: str) -> str:
+    """
+    Summary section of a completion that is still streaming, "" until its heading has
+    arrived. Only complete lines are checked for the heading, so a half-received
+    heading never leaks into the summary.
+    """
+    lines = _clean(text).split("\n")
+    for i, line in enumerate(lines[:-1]):
+        heading = SUMMARY_HEADING_RE.match(line)
+        if heading:
+            body = [heading.group("rest").strip(" *")] + lines[i + 1:]
+            return "\n".join(l for l in body if not (FENCE_RE.match(l) or RULE_RE.match(l))).strip()
+    return ""
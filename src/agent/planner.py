@@ -0,0 +1,226 @@
+import os
+import math
+import argparse
+from typing import Dict, List, Optional, Sequence
+
+from prompt import (
+    EXTRACT_CHARACTERSNSUMMARY_PROMPT_PREFIX,
+    EXTRACT_CHARACTERSNSUMMARY_PROMPT_SUFFIX,
+    LONG_SUMMARY_PROMPT_TMPL,
+    REWRITE_SUMMARY_PROMPT_TMPL,
+)
+
+# Vietnamese text with diacritics comes out at roughly 3 characters per Gemini token
+CHARS_PER_TOKEN = 3.0
+DAILY_QUOTA = 1500
+
+def estimate_tokens(text_or_chars) -> int:
+    """Token estimate for a string, or for a character count"""
+    chars = text_or_chars if isinstance(text_or_chars, int) else len(text_or_chars)
+    return int(math.ceil(chars / CHARS_PER_TOKEN))
+
+def rollups_after(batch_chapters: Sequence[int], big_summary_interval: int) -> List[bool]:
+    """
+    Whether a roll-up follows each batch, by the rule of BookSummary.summarize_chapter:
+    once the batches since the last roll-up cover `big_summary_interval` chapters, but
+    never after the first batch
+    """
+    since, rollups = 0, []
+    for n, chapters in enumerate(batch_chapters):
+        since += chapters
+        rollups.append(n > 0 and since >= big_summary_interval)
+        if rollups[-1]:
+            since = 0
+    return rollups
+
+def _template_tokens(template: str) -> int:
+    """Tokens of a prompt template without its placeholders"""
+    stripped = template
+    for field in ("long_summary", "characters", "previous_summary", "chapter_text", "summaries", "summary"):
+        stripped = stripped.replace("{" + field + "}", "")
+    return estimate_tokens(stripped)
+
+class RunPlanner:
+    """
+    Dry run of BookSummary over the chapter files, without any LLM call.
+
+    The chain is replayed batch by batch with the same roll-up rule as
+    BookSummary.summarize_chapter: the running context (roll-ups, the current segment
+    and the character list) grows and is reset the same way. Output sizes and call
+    latency come from the constructor parameters, which are rough defaults for
+    gemini-2.0-flash and can be calibrated from a previous run's `latency_stats()`.
+    Calls are placed on a simulated clock with TrackApi's per-minute and daily quotas,
+    so the wall time is what the quotas allow, not just the sum of latencies.
+    """
+    def __init__(
+        self,
+        story_paths: Sequence[str],
+        quota_per_minute: int = 15,
+        daily_quota: int = DAILY_QUOTA,
+        call_overhead: float = 2.0,
+        output_tokens_per_second: float = 120.0,
+        input_tokens_per_second: float = 20000.0,
+        batch_output_tokens: int = 500,
+        rollup_output_tokens: int = 1000,
+        rewrite_output_tokens: int = 2000,
+        character_tokens_cap: int = 1500,
+        max_input_tokens: int = 900_000,
+        safety_factor: float = 1.5,
+        system_prompt_tokens: int = 40,
+    ):
+        self.quota_per_minute = quota_per_minute
+        self.daily_quota = daily_quota
+        self.call_overhead = call_overhead
+        self.output_tokens_per_second = output_tokens_per_second
+        self.input_tokens_per_second = input_tokens_per_second
+        self.batch_output_tokens = batch_output_tokens
+        self.rollup_output_tokens = rollup_output_tokens
+        self.rewrite_output_tokens = rewrite_output_tokens
+        self.character_tokens_cap = character_tokens_cap
+        self.max_input_tokens = max_input_tokens
+        self.safety_factor = safety_factor
+        self.system_prompt_tokens = system_prompt_tokens
+        self.chapter_tokens = []
+        self.path_tokens = {}
+        for path in story_paths:
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    self.chapter_tokens.append(estimate_tokens(f.read()))
+                self.path_tokens[path] = self.chapter_tokens[-1]
+            except (FileNotFoundError, UnicodeDecodeError) as e:
+                print(f"Planner skipped {path}: {e}")
+        self.batch_template_tokens = self.system_prompt_tokens + _template_tokens(
+            EXTRACT_CHARACTERSNSUMMARY_PROMPT_PREFIX + EXTRACT_CHARACTERSNSUMMARY_PROMPT_SUFFIX)
+        self.rollup_template_tokens = _template_tokens(LONG_SUMMARY_PROMPT_TMPL)
+        self.rewrite_template_tokens = _template_tokens(REWRITE_SUMMARY_PROMPT_TMPL)
+
+    def latency(self, input_tokens: int, output_tokens: int) -> float:
+        return (self.call_overhead
+                + input_tokens / self.input_tokens_per_second
+                + output_tokens / self.output_tokens_per_second)
+
+    def plan(self, gather_chapters: int, big_summary_interval: int, max_chapters: Optional[int] = None,
+             batches: Optional[Sequence[Sequence[str]]] = None) -> Dict:
+        """
+        Expected calls, tokens, wall time and a safe workflow timeout for one configuration.
+        `batches` are planned batches of chapter paths, as given to BookSummary(batches=...),
+        in place of fixed groups of `gather_chapters`.
+        """
+        if batches:
+            batches = [[self.path_tokens.get(path, 0) for path in batch] for batch in batches]
+            chapters = [tokens for batch in batches for tokens in batch]
+        else:
+            chapters = self.chapter_tokens[:max_chapters] if max_chapters else self.chapter_tokens
+            batches = [chapters[i:i + gather_chapters] for i in range(0, len(chapters), gather_chapters)]
+
+        calls = []  # (kind, input_tokens, output_tokens)
+        rollups_tokens = []
+        segment_tokens = []
+        character_tokens = 0
+        rollups = rollups_after([len(batch) for batch in batches], big_summary_interval)
+        for batch, rollup in zip(batches, rollups):
+            input_tokens = (self.batch_template_tokens + sum(rollups_tokens) + sum(segment_tokens)
+                            + character_tokens + sum(batch))
+            calls.append(("batch", input_tokens, self.batch_output_tokens + character_tokens))
+            # the character list grows with the story until it saturates
+            character_tokens = min(self.character_tokens_cap, character_tokens + self.batch_output_tokens // 4)
+            segment_tokens.append(self.batch_output_tokens)
+            if rollup:
+                calls.append(("rollup", self.rollup_template_tokens + character_tokens + sum(segment_tokens),
+                              self.rollup_output_tokens))
+                rollups_tokens.append(self.rollup_output_tokens)
+                segment_tokens = segment_tokens[-1:]
+        if batches:
+            calls.append(("rewrite", self.rewrite_template_tokens + sum(rollups_tokens) + segment_tokens[-1],
+                          self.rewrite_output_tokens))
+
+        wall_time, quota_wait, day_waits = self._simulate_clock(calls)
+        busy = sum(self.latency(i, o) for _, i, o in calls)
+        largest_input = max((i for _, i, _ in calls), default=0)
+        return {
+            "gather_chapters": gather_chapters,
+            "big_summary_interval": big_summary_interval,
+            "chapters": len(chapters),
+            "calls": len(calls),
+            "batch_calls": sum(1 for kind, _, _ in calls if kind == "batch"),
+            "rollup_calls": sum(1 for kind, _, _ in calls if kind == "rollup"),
+            "input_tokens": sum(i for _, i, _ in calls),
+            "output_tokens": sum(o for _, _, o in calls),
+            "largest_input_tokens": largest_input,
+            "fits_context": largest_input <= self.max_input_tokens,
+            "llm_seconds": busy,
+            "quota_wait_seconds": quota_wait,
+            "daily_quota_waits": day_waits,
+            "wall_seconds": wall_time,
+            "timeout": int(math.ceil(wall_time * self.safety_factor + 120)),
+            "chapters_per_hour": len(chapters) / wall_time * 3600 if wall_time else 0.0,
+        }
+
+    def _simulate_clock(self, calls):
+        """Replay TrackApi's sliding one-minute window and daily counter on a virtual clock"""
+        now = quota_wait = 0.0
+        day_waits = 0
+        window = []
+        daily_count = 0
+        daily_reset = 24 * 3600
+        for _, input_tokens, output_tokens in calls:
+            if now > daily_reset:
+                daily_count, daily_reset = 0, now + 24 * 3600
+            if daily_count >= self.daily_quota:
+                quota_wait += daily_reset - now
+                now = daily_reset
+                day_waits += 1
+                daily_count, daily_reset = 0, now + 24 * 3600
+            window = [t for t in window if now - t < 60]
+            if len(window) >= self.quota_per_minute:
+                wait = 60 - (now - min(window))
+                quota_wait += wait
+                now += wait
+            window.append(now)
+            daily_count += 1
+            now += self.latency(input_tokens, output_tokens)
+        return now, quota_wait, day_waits
+
+    def suggest(self, big_summary_interval: int, max_chapters: Optional[int] = None,
+                candidates: Sequence[int] = (1, 2, 3, 5, 8, 10, 15, 20, 30, 50)) -> List[Dict]:
+        """
+        Plans for each candidate batch size, fastest first. The roll-up interval is rounded
+        to a multiple of the batch size, as BookSummary only rolls up on whole batches;
+        batch sizes whose largest request would not fit the context window are dropped.
+        """
+        plans = []
+        for gather in candidates:
+            interval = max(gather, int(round(big_summary_interval / gather)) * gather)
+            plan = self.plan(gather, interval, max_chapters)
+            if plan["fits_context"]:
+                plans.append(plan)
+        return sorted(plans, key=lambda p: -p["chapters_per_hour"])
+
+def format_plan(plan: Dict) -> str:
+    return (
+        f"gather={plan['gather_chapters']} interval={plan['big_summary_interval']}: "
+        f"{plan['chapters']} chapters, {plan['calls']} calls ({plan['batch_calls']} batch, "
+        f"{plan['rollup_calls']} roll-up, 1 rewrite), "
+        f"~{plan['input_tokens'] / 1e6:.2f}M input / {plan['output_tokens'] / 1e3:.0f}k output tokens, "
+        f"largest request ~{plan['largest_input_tokens'] / 1e3:.0f}k tokens, "
+        f"wall time ~{plan['wall_seconds'] / 3600:.2f} h ({plan['quota_wait_seconds'] / 60:.0f} min waiting on quota"
+        + (f", {plan['daily_quota_waits']} daily-quota stops" if plan['daily_quota_waits'] else "")
+        + f"), safe timeout {plan['timeout']} s"
+    )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Estimate calls, tokens and duration of a summary run")
+    parser.add_argument("story_dir", help="directory with the chapter .txt files")
+    parser.add_argument("--start-chapter", type=int, default=0)
+    parser.add_argument("--max-chapters", type=int, default=None)
+    parser.add_argument("--gather", type=int, default=10)
+    parser.add_argument("--interval", type=int, default=100)
+    parser.add_argument("--quota", type=int, default=15, help="requests per minute")
+    args = parser.parse_args()
+
+    paths = sorted(os.path.join(args.story_dir, f) for f in os.listdir(args.story_dir) if f.endswith(".txt"))
+    planner = RunPlanner(paths[args.start_chapter:], quota_per_minute=args.quota)
+    print("Requested: " + format_plan(planner.plan(args.gather, args.interval, args.max_chapters)))
+    print("Batch sizes by throughput:")
+    for plan in planner.suggest(args.interval, args.max_chapters)[:5]:
+        print(f"  {plan['chapters_per_hour']:7.0f} chapters/h  " + format_plan(plan))
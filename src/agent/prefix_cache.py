@@ -0,0 +1,127 @@
+import time
+import hashlib
+from collections import OrderedDict
+from typing import Optional
+
+class PrefixCache:
+    """
+    Registers the stable prefix of a prompt once and hands back the LLM kwargs that
+    make later calls reuse it, so only the changing tail is sent on every call.
+
+    Subclasses implement `_register` (create the cached context) and optionally
+    `_release` (drop it). `get` returns None when the prefix is not worth caching,
+    in which case the caller sends the full prompt as usual.
+    """
+    def __init__(self, ttl: int = 3600, max_entries: int = 4):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # key -> (llm_kwargs, expire_time, prefix_len)
+        self.registrations = 0
+        self.hits = 0
+        self.reused_chars = 0
+
+    def _key(self, prefix: str) -> str:
+        return hashlib.sha256(prefix.encode("utf-8")).hexdigest()
+
+    async def get(self, prefix: str) -> Optional[dict]:
+        key = self._key(prefix)
+        entry = self.entries.get(key)
+        # Re-register a little before the provider drops the cached context
+        if entry and entry[1] - time.time() > 60:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            self.reused_chars += entry[2]
+            return entry[0]
+
+        llm_kwargs = await self._register(key, prefix)
+        if llm_kwargs is None:
+            return None
+        self.registrations += 1
+        self.entries[key] = (llm_kwargs, time.time() + self.ttl, len(prefix))
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            _, (old_kwargs, _, _) = self.entries.popitem(last=False)
+            await self._release(old_kwargs)
+        return llm_kwargs
+
+    async def _register(self, key: str, prefix: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    async def _release(self, llm_kwargs: dict):
+        pass
+
+    def stats(self) -> dict:
+        return {
+            "registrations": self.registrations,
+            "hits": self.hits,
+            "reused_chars": self.reused_chars,
+        }
+
+class LocalPrefixCache(PrefixCache):
+    """
+    Local stand-in for a provider cache. Prefixes are kept in memory and calls carry
+    a `local/<hash>` handle, so a fake LLM can `resolve` the handle and check that the
+    prefix it stands for is reused instead of resent.
+    """
+    def __init__(self, ttl: int = 3600, max_entries: int = 4):
+        super().__init__(ttl, max_entries)
+        self.prefixes = {}
+
+    async def _register(self, key: str, prefix: str) -> dict:
+        name = f"local/{key}"
+        self.prefixes[name] = prefix
+        return {"generation_config": {"cached_content": name}}
+
+    async def _release(self, llm_kwargs: dict):
+        self.prefixes.pop(llm_kwargs["generation_config"]["cached_content"], None)
+
+    def resolve(self, name: str) -> str:
+        return self.prefixes[name]
+
+class GeminiPrefixCache(PrefixCache):
+    """
+    Gemini explicit context caching. The system prompt is stored with the cached
+    context, since Gemini rejects requests that set both a system instruction and
+    cached content. Prefixes under `min_tokens` are below the provider minimum and
+    are sent uncached.
+    """
+    def __init__(
+        self,
+        llm,
+        system_prompt: str = None,
+        ttl: int = 3600,
+        max_entries: int = 4,
+        min_tokens: int = 4096,
+        chars_per_token: float = 3.0,
+    ):
+        super().__init__(ttl, max_entries)
+        self.client = llm._client
+        self.model = llm.model
+        self.system_prompt = system_prompt
+        self.min_tokens = min_tokens
+        self.chars_per_token = chars_per_token
+
+    async def _register(self, key: str, prefix: str) -> Optional[dict]:
+        if (len(prefix) + len(self.system_prompt or "")) / self.chars_per_token < self.min_tokens:
+            return None
+        from google.genai import types
+        try:
+            cached = await self.client.aio.caches.create(
+                model=self.model,
+                config=types.CreateCachedContentConfig(
+                    display_name=f"autosummary-{key[:16]}",
+                    system_instruction=self.system_prompt,
+                    contents=[types.Content(role="user", parts=[types.Part(text=prefix)])],
+                    ttl=f"{self.ttl}s",
+                ),
+            )
+        except Exception as e:
+            print(f"Context cache registration failed, sending full prompt: {e}")
+            return None
+        return {"generation_config": {"cached_content": cached.name}}
+
+    async def _release(self, llm_kwargs: dict):
+        try:
+            await self.client.aio.caches.delete(name=llm_kwargs["generation_config"]["cached_content"])
+        except Exception as e:
+            print(f"Error deleting cached context: {e}")
@@ -1,7 +1,14 @@
-FIRST_EXTRACTCHARACTERNSUMMARY_PROMPT_TMPL = """Mỗi dòng liệt kê một nhân vật gồm tên nhân vật, giới thiệu về nhân vật được cung cấp dưới đây. \
+# The extraction prompts are split into a stable PREFIX and a changing SUFFIX.
+# The prefix holds the instructions, the answer layout and the main summary, which
+# only changes at each big summary, so providers can reuse it across chained calls.
+# Everything that changes per batch goes in the suffix.
+SYSTEM_PROMPT = """
+            Bạn là một trợ lí nhiệm vụ của bạn là tóm tắt lại một câu chuyện.\
+            trả lời bằng tiếng Việt.
+            """
+
+FIRST_EXTRACTCHARACTERNSUMMARY_PROMPT_PREFIX = """Mỗi dòng liệt kê một nhân vật gồm tên nhân vật, giới thiệu về nhân vật được cung cấp dưới đây. \
 Tóm tắt chương truyện được cung cấp dưới đây. trả lời theo mẫu không trả lời thêm gì khác:
-{characters}
-{previous_summary}
 Mẫu:
 ## Danh sách nhân vật
 Tên_nhân_vât_1: giới thiệu về nhân vật 1
@@ -10,16 +17,19 @@ Tên_nhân_vât_2: giới thiệu về nhân vật 2
 ## Tóm tắt chương truyện:
 tóm tắt chương truyện
 -----
+"""
+
+FIRST_EXTRACTCHARACTERNSUMMARY_PROMPT_SUFFIX = """{characters}
+{previous_summary}
+-----
 
 Truyện:
 
 {chapter_text}"""
 
-EXTRACT_CHARACTERSNSUMMARY_PROMPT_TMPL = """cho danh sách các nhân vật đã được đề cập:
-{characters}
-Tóm tắt của các chương truyện trước:
-{previous_summary}
-Cập nhập danh sách các nhân vật và thông tin giới thiệu của các nhân vật đó \
+FIRST_EXTRACTCHARACTERNSUMMARY_PROMPT_TMPL = FIRST_EXTRACTCHARACTERNSUMMARY_PROMPT_PREFIX + FIRST_EXTRACTCHARACTERNSUMMARY_PROMPT_SUFFIX
+
+EXTRACT_CHARACTERSNSUMMARY_PROMPT_PREFIX = """Cập nhập danh sách các nhân vật và thông tin giới thiệu của các nhân vật đó \
 nếu có thêm thông tin so với trong giới thiệu nhân vật cũ trong chương truyện được cung cấp dưới đây. \
 Nếu không có gì thay đổi giữ nguyên danh sách cũ. Mỗi dòng liệt kê một nhân vật gồm tên nhân vật, giới thiệu về nhân vật. \
 Tóm tắt chương truyện được cung cấp dưới đây, tóm tắt liền mạch với tóm tắt của các chương truyện trước được cung cấp. \
@@ -33,11 +43,23 @@ Tên_nhân_vât_2: giới thiệu về nhân vật 2
 ## Tóm tắt chương truyện:
 tóm tắt chương truyện
 -----
+Tóm tắt chính của các chương truyện trước:
+{long_summary}
+"""
+
+EXTRACT_CHARACTERSNSUMMARY_PROMPT_SUFFIX = """-----
+Danh sách các nhân vật đã được đề cập:
+{characters}
+Tóm tắt của các chương truyện gần đây:
+{previous_summary}
+-----
 
 Truyện:
 
 {chapter_text}"""
 
+EXTRACT_CHARACTERSNSUMMARY_PROMPT_TMPL = EXTRACT_CHARACTERSNSUMMARY_PROMPT_PREFIX + EXTRACT_CHARACTERSNSUMMARY_PROMPT_SUFFIX
+
 ###
 LONG_SUMMARY_PROMPT_TMPL = """Dựa vào tóm tắt các chương truyện trước được cung cấp dưới đây \
 viết lại thành một tóm tắt những diễn biến chính. Hãy viết một cách liền mạch với các tóm tắt trước đó được cung cấp. \
@@ -65,4 +87,27 @@ Tóm tắt:
 {summary}
 
 Tóm tắt rút gọn:
-"""
\ No newline at end of file
+"""
+QA_PROMPT_TMPL = """Trả lời câu hỏi của người đọc chỉ dựa vào các đoạn truyện và tóm tắt được cung cấp dưới đây. \
+Mỗi đoạn có ghi chương tương ứng, hãy nêu rõ chương khi trả lời. \
+Nếu các đoạn không đủ thông tin để trả lời hãy nói không tìm thấy, không tự suy diễn.
+-----
+{passages}
+-----
+Câu hỏi: {question}
+Trả lời:
+"""
+
+REPAIR_SUMMARY_PROMPT_TMPL = """Sắp xếp lại câu trả lời dưới đây theo đúng mẫu, giữ nguyên nội dung, không thêm bớt ý. \
+Trả lời theo mẫu không trả lời thêm gì khác.
+Mẫu:
+## Danh sách nhân vật
+Tên_nhân_vât_1: giới thiệu về nhân vật 1
+Tên_nhân_vât_2: giới thiệu về nhân vật 2
+
+## Tóm tắt chương truyện:
+tóm tắt chương truyện
+-----
+Câu trả lời:
+{response}
+"""
@@ -0,0 +1,165 @@
+import os
+import json
+import uuid
+from typing import List, Optional
+
+class SummaryPyramid:
+    """
+    Append-only record of everything a summary run produces, tagged with chapter ranges.
+
+    Records are written one JSON object per line to `<name>_pyramid.jsonl` and an
+    index of (kind, start, end, offset, length) is kept in `<name>_pyramid.index.json`
+    so lookups only seek to the records they need.
+
+    Every record carries the id of the run that wrote it. When a run writes a record, the
+    index drops the records of the same kind from earlier runs whose chapter range
+    overlaps it, so re-running a story replaces its old summaries instead of adding a
+    second copy. Superseded records stay in the stream; rebuilding the index replays
+    the same rule.
+
+    Kinds:
+        batch       summary of one batch of gathered chapters
+        rollup      big summary covering one big_summary_interval
+        final       the rewritten summary of the whole run
+        characters  character list snapshot after a batch
+    """
+    KINDS = ("batch", "rollup", "final", "characters")
+
+    def __init__(self, saved_path: str, name: str, run: str = None):
+        os.makedirs(saved_path, exist_ok=True)
+        self.run = run or uuid.uuid4().hex[:12]
+        self.stream_path = os.path.join(saved_path, name + "_pyramid.jsonl")
+        self.index_path = os.path.join(saved_path, name + "_pyramid.index.json")
+        self.entries = self._load_index()
+
+    def _load_index(self) -> List[dict]:
+        stream_size = os.path.getsize(self.stream_path) if os.path.exists(self.stream_path) else 0
+        if os.path.exists(self.index_path):
+            try:
+                with open(self.index_path, "r", encoding="utf-8") as f:
+                    index = json.load(f)
+                if index.get("stream_size") == stream_size:
+                    return index["entries"]
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Rebuilding pyramid index for {self.stream_path}: {e}")
+        return self._rebuild_index()
+
+    def _rebuild_index(self) -> List[dict]:
+        entries = []
+        if not os.path.exists(self.stream_path):
+            return entries
+        offset = 0
+        with open(self.stream_path, "rb") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    self._add_entry(entries, {
+                        "kind": record["kind"],
+                        "start": record["start"],
+                        "end": record["end"],
+                        "run": record.get("run"),
+                        "offset": offset,
+                        "length": len(line),
+                    })
+                except (ValueError, KeyError):
+                    # A torn last line from an interrupted run, skip it
+                    pass
+                offset += len(line)
+        self._write_index(entries, offset)
+        return entries
+
+    def _write_index(self, entries: List[dict], stream_size: int):
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"stream_size": stream_size, "entries": entries}, f)
+        os.replace(tmp_path, self.index_path)
+
+    @staticmethod
+    def _add_entry(entries: List[dict], entry: dict):
+        """Add an entry, dropping same-kind entries of other runs that overlap its range"""
+        entries[:] = [
+            e for e in entries
+            if e["kind"] != entry["kind"] or e.get("run") == entry["run"]
+            or e["end"] < entry["start"] or e["start"] > entry["end"]
+        ]
+        entries.append(entry)
+
+    def append(self, kind: str, start: int, end: int, text: str) -> dict:
+        """Append a record of this run and update the index. Returns the index entry."""
+        if kind not in self.KINDS:
+            raise ValueError(f"Unknown pyramid record kind: {kind}")
+        record = {"kind": kind, "start": start, "end": end, "run": self.run, "text": text}
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+        with open(self.stream_path, "ab") as f:
+            offset = f.tell()
+            f.write(line)
+        entry = {"kind": kind, "start": start, "end": end, "run": self.run, "offset": offset, "length": len(line)}
+        self._add_entry(self.entries, entry)
+        self._write_index(self.entries, offset + len(line))
+        return entry
+
+    def read(self, entry: dict) -> dict:
+        """Read the full record behind an index entry"""
+        with open(self.stream_path, "rb") as f:
+            f.seek(entry["offset"])
+            return json.loads(f.read(entry["length"]))
+
+    def _read_many(self, entries: List[dict]) -> List[dict]:
+        records = []
+        with open(self.stream_path, "rb") as f:
+            for entry in entries:
+                f.seek(entry["offset"])
+                records.append(json.loads(f.read(entry["length"])))
+        return records
+
+    def find(self, kind: Optional[str] = None, start: Optional[int] = None, end: Optional[int] = None) -> List[dict]:
+        """Index entries of the given kind overlapping the chapter range [start, end]"""
+        return [
+            e for e in self.entries
+            if (kind is None or e["kind"] == kind)
+            and (start is None or e["end"] >= start)
+            and (end is None or e["start"] <= end)
+        ]
+
+    def summary_up_to(self, chapter: int) -> str:
+        """
+        Summary of the story up to `chapter`, assembled the same way the workflow
+        builds its running context: roll-ups first, then batch summaries after the last roll-up.
+        """
+        finals = [e for e in self.find("final") if e["end"] <= chapter]
+        if finals and not self.find("batch", start=finals[-1]["end"] + 1, end=chapter):
+            return self.read(finals[-1])["text"]
+
+        rollups = sorted((e for e in self.find("rollup") if e["end"] <= chapter), key=lambda e: e["start"])
+        covered = max((e["end"] for e in rollups), default=0)
+        batches = sorted(
+            (e for e in self.find("batch") if covered < e["start"] <= chapter),
+            key=lambda e: e["start"],
+        )
+        return "\n".join(record["text"] for record in self._read_many(rollups + batches)).strip()
+
+    def summaries_between(self, start: int, end: int) -> str:
+        """What happened in chapters [start, end], from the finest level that covers the range"""
+        entries = self.find("batch", start, end) or self.find("rollup", start, end)
+        entries = sorted(entries, key=lambda e: e["start"])
+        return "\n".join(record["text"] for record in self._read_many(entries)).strip()
+
+    def characters_at(self, chapter: int) -> str:
+        """Latest character list snapshot taken at or before `chapter`"""
+        snapshots = [e for e in self.find("characters") if e["end"] <= chapter]
+        if not snapshots:
+            snapshots = self.find("characters", chapter, chapter)
+        if not snapshots:
+            return ""
+        latest = max(snapshots, key=lambda e: (e["end"], e["offset"]))
+        return self.read(latest)["text"]
+
+    def final_summary(self) -> Optional[str]:
+        finals = self.find("final")
+        if not finals:
+            return None
+        return self.read(finals[-1])["text"]
+
+    @property
+    def last_chapter(self) -> int:
+        return max((e["end"] for e in self.entries), default=0)
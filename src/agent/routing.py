@@ -0,0 +1,186 @@
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+from trackapi import QuotaStore, TrackApi, quota_key
+from planner import estimate_tokens
+from budget import thinking_allowance
+
+# Free-tier request quotas and paid-tier prices (USD per 1M tokens) at the time of writing.
+# Override them per route when the account is on another tier.
+MODEL_TIERS = {
+    "models/gemini-2.0-flash-lite": {"quota_per_minute": 30, "daily_quota": 1500, "input_price": 0.075, "output_price": 0.30},
+    "models/gemini-2.0-flash": {"quota_per_minute": 15, "daily_quota": 1500, "input_price": 0.10, "output_price": 0.40},
+    "models/gemini-2.5-flash": {"quota_per_minute": 10, "daily_quota": 250, "input_price": 0.30, "output_price": 2.50},
+    "models/gemini-2.5-pro": {"quota_per_minute": 5, "daily_quota": 100, "input_price": 1.25, "output_price": 10.0},
+}
+
+STAGES = ("short", "repair", "big", "rewrite")
+
+class ModelRoute:
+    """
+    One model with its own client, generation config and rate limiter. Quotas are per
+    model, so stages routed to the same ModelRoute share its limiter. The GoogleGenAI
+    client is created on first use unless an `llm` is given.
+    """
+    def __init__(
+        self,
+        model: str,
+        llm=None,
+        generation_config: Optional[Dict] = None,
+        quota_per_minute: Optional[int] = None,
+        daily_quota: Optional[int] = None,
+        input_price: Optional[float] = None,
+        output_price: Optional[float] = None,
+    ):
+        tier = MODEL_TIERS.get(model, MODEL_TIERS["models/gemini-2.0-flash"])
+        self.model = model
+        self.llm = llm
+        self.generation_config = generation_config or {}
+        self.input_price = tier["input_price"] if input_price is None else input_price
+        self.output_price = tier["output_price"] if output_price is None else output_price
+        self.limiter = TrackApi(quota_per_minute or tier["quota_per_minute"], daily_quota=daily_quota or tier["daily_quota"])
+
+    def bind_quota(self, quota_store: QuotaStore, api_key: str = None):
+        """Count this route's daily requests in the store, under the bucket of its key and model"""
+        self.limiter.quota_store = quota_store
+        self.limiter.quota_key = quota_key(api_key, self.model)
+
+    def client(self, system_prompt: str = None, api_key: str = None):
+        if self.llm is None:
+            from llama_index.llms.google_genai import GoogleGenAI
+            self.llm = GoogleGenAI(model=self.model, system_prompt=system_prompt, api_key=api_key)
+        return self.llm
+
+    def cost(self, input_tokens: int, output_tokens: int) -> float:
+        return (input_tokens * self.input_price + output_tokens * self.output_price) / 1e6
+
+class StageRouter:
+    """
+    Sends each BookSummary stage to its own model:
+    - `stages` maps "short" (batch extraction), "repair", "big" (roll-up) and "rewrite"
+      to a ModelRoute; "repair" falls back to the "short" route
+    - short and repair requests estimated under `lite_max_tokens` go to `lite`
+    - a retry after a parse failure goes to `escalate`
+    Calls, tokens, latency, estimated cost and quota use are recorded per stage and model.
+    """
+    def __init__(
+        self,
+        stages: Dict[str, ModelRoute],
+        lite: Optional[ModelRoute] = None,
+        lite_max_tokens: int = 12000,
+        escalate: Optional[ModelRoute] = None,
+    ):
+        if "short" not in stages:
+            raise ValueError("The router needs at least a route for the short stage")
+        self.stages = stages
+        self.lite = lite
+        self.lite_max_tokens = lite_max_tokens
+        self.escalate = escalate
+        self.system_prompt = None
+        self.api_key = None
+        self.usage = defaultdict(lambda: {"calls": 0, "input_tokens": 0, "output_tokens": 0, "seconds": [], "escalated": 0})
+
+    def configure(self, system_prompt: str, api_key: str = None, quota_store: QuotaStore = None):
+        """
+        System prompt and key used for the clients the routes create. With a quota store,
+        each route's daily count is persisted per key and model like the workflow's own.
+        """
+        self.system_prompt = system_prompt
+        self.api_key = api_key
+        if quota_store is not None:
+            for route in self._routes().values():
+                route.bind_quota(quota_store, api_key)
+
+    def route(self, stage: str, input_tokens: int = 0, escalated: bool = False) -> ModelRoute:
+        if escalated and self.escalate is not None:
+            return self.escalate
+        if stage in ("short", "repair") and self.lite is not None and input_tokens < self.lite_max_tokens:
+            return self.lite
+        return self.stages.get(stage) or self.stages["short"]
+
+    def client(self, route: ModelRoute):
+        return route.client(self.system_prompt, self.api_key)
+
+    async def call(self, route: ModelRoute, stage: str, messages, method: str = "achat",
+                   runner=None, hedge: bool = None, escalated: bool = False, stream: bool = False, **kwargs):
+        """
+        Rate-limited call on the route's client. `runner(llm, limiter)` can return the
+        callable to use instead of `llm.<method>`, e.g. a streaming wrapper (with
+        `stream`); it is called with (messages, **kwargs) like the client method.
+        """
+        llm = self.client(route)
+        fn = runner(llm, route.limiter) if runner is not None else getattr(llm, method)
+        if route.generation_config:
+            kwargs["generation_config"] = {**route.generation_config, **kwargs.get("generation_config", {})}
+        if "generation_config" in kwargs:
+            # Output budgets are set before routing; an escalation to a thinking model needs more room
+            kwargs["generation_config"] = thinking_allowance(route.model, kwargs["generation_config"])
+        start = time.monotonic()
+        result = await route.limiter._rate_limited_llm_call(fn, messages, hedge=hedge, stage=stage, stream=stream, **kwargs)
+        usage = self.usage[(stage, route.model)]
+        usage["calls"] += 1
+        usage["escalated"] += int(escalated)
+        usage["input_tokens"] += estimate_tokens(sum(len(m.content or "") for m in messages))
+        usage["output_tokens"] += estimate_tokens(_response_text(result))
+        usage["seconds"].append(time.monotonic() - start)
+        return result
+
+    def _routes(self) -> Dict[str, ModelRoute]:
+        routes = list(self.stages.values()) + [self.lite, self.escalate]
+        return {route.model: route for route in routes if route is not None}
+
+    def report(self) -> List[Dict]:
+        """One row per stage and model: calls, tokens, estimated cost, latency and share of the daily quota"""
+        routes = self._routes()
+        rows = []
+        for (stage, model), usage in sorted(self.usage.items(), key=lambda item: STAGES.index(item[0][0]) if item[0][0] in STAGES else len(STAGES)):
+            route = routes[model]
+            seconds = sorted(usage["seconds"])
+            rows.append({
+                "stage": stage,
+                "model": model,
+                "calls": usage["calls"],
+                "escalated": usage["escalated"],
+                "input_tokens": usage["input_tokens"],
+                "output_tokens": usage["output_tokens"],
+                "cost": route.cost(usage["input_tokens"], usage["output_tokens"]),
+                "p50": seconds[len(seconds) // 2] if seconds else None,
+                "p95": seconds[min(len(seconds) - 1, int(round(0.95 * (len(seconds) - 1))))] if seconds else None,
+                "daily_quota_share": usage["calls"] / route.limiter.daily_quota,
+            })
+        return rows
+
+    def format_report(self) -> str:
+        lines = [f"{'stage':<8} {'model':<30} {'calls':>6} {'in tok':>9} {'out tok':>8} {'cost $':>8} {'p50 s':>6} {'p95 s':>6} {'quota/day':>9}"]
+        total = 0.0
+        for row in self.report():
+            total += row["cost"]
+            lines.append(
+                f"{row['stage']:<8} {row['model'].split('/')[-1]:<30} {row['calls']:>6} {row['input_tokens']:>9} "
+                f"{row['output_tokens']:>8} {row['cost']:>8.4f} {row['p50'] or 0:>6.2f} {row['p95'] or 0:>6.2f} "
+                f"{row['daily_quota_share']:>9.1%}"
+                + (f"  ({row['escalated']} escalated)" if row["escalated"] else "")
+            )
+        lines.append(f"estimated cost ${total:.4f}")
+        return "\n".join(lines)
+
+def _response_text(result) -> str:
+    if isinstance(result, str):
+        return result
+    message = getattr(result, "message", None)
+    return str(message.content or "") if message is not None else str(result)
+
+def default_router(lite_max_tokens: int = 12000) -> StageRouter:
+    """
+    Most calls are batch extractions, which go to flash-lite when small and flash otherwise.
+    Roll-ups stay on flash; the single rewrite and parse-failure retries use 2.5 flash.
+    """
+    flash = ModelRoute("models/gemini-2.0-flash")
+    stronger = ModelRoute("models/gemini-2.5-flash")
+    return StageRouter(
+        stages={"short": flash, "big": flash, "rewrite": stronger},
+        lite=ModelRoute("models/gemini-2.0-flash-lite"),
+        lite_max_tokens=lite_max_tokens,
+        escalate=stronger,
+    )
@@ -0,0 +1,217 @@
+import os
+import re
+import json
+import math
+import unicodedata
+from collections import Counter, defaultdict
+from typing import List, Optional
+
+import sys
+sys.path.append(os.path.dirname(__file__))
+from trackapi import TrackApi
+from prompt import QA_PROMPT_TMPL
+
+# Function words that carry no meaning for retrieval
+VIETNAMESE_STOPWORDS = {
+    "và", "là", "của", "có", "không", "được", "cho", "với", "những", "các", "một",
+    "này", "đó", "thì", "mà", "đã", "đang", "sẽ", "ở", "trong", "ra", "vào", "lại",
+    "cũng", "như", "khi", "để", "nên", "rằng", "bị", "từ", "đến", "nhưng", "vì",
+    "ta", "hắn", "nó", "ai", "gì", "nào", "thế", "rồi", "còn", "lên", "xuống",
+}
+
+WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+def tokenize(text: str) -> List[str]:
+    """
+    Vietnamese-aware tokenizer.
+    Vietnamese words are written as space separated syllables ("nhân vật", "Lý Hạo"),
+    so the index holds both single syllables and adjacent syllable pairs joined by "_".
+    Text is NFC normalized so precomposed and combining diacritics match.
+    """
+    syllables = WORD_RE.findall(unicodedata.normalize("NFC", text).lower())
+    tokens = [s for s in syllables if s not in VIETNAMESE_STOPWORDS]
+    tokens.extend(
+        f"{a}_{b}" for a, b in zip(syllables, syllables[1:])
+        if a not in VIETNAMESE_STOPWORDS or b not in VIETNAMESE_STOPWORDS
+    )
+    return tokens
+
+def split_passages(text: str, max_chars: int = 1200) -> List[str]:
+    """Split chapter text into passages on paragraph boundaries"""
+    passages = []
+    current = ""
+    for paragraph in text.split("\n"):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if current and len(current) + len(paragraph) > max_chars:
+            passages.append(current)
+            current = ""
+        current = (current + "\n" + paragraph) if current else paragraph
+    if current:
+        passages.append(current)
+    return passages
+
+class BM25Index:
+    """Inverted index with Okapi BM25 scoring"""
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.docs: List[dict] = []
+        self.doc_lengths: List[int] = []
+        self.postings = defaultdict(dict)
+
+    def add(self, text: str, **meta) -> int:
+        doc_id = len(self.docs)
+        tokens = tokenize(text)
+        for token, tf in Counter(tokens).items():
+            self.postings[token][doc_id] = tf
+        self.docs.append({"text": text, **meta})
+        self.doc_lengths.append(len(tokens))
+        return doc_id
+
+    def search(self, query: str, k: int = 5, source: Optional[str] = None) -> List[dict]:
+        n_docs = len(self.docs)
+        if n_docs == 0:
+            return []
+        avgdl = sum(self.doc_lengths) / n_docs or 1
+        scores = defaultdict(float)
+        for token in set(tokenize(query)):
+            postings = self.postings.get(token)
+            if not postings:
+                continue
+            idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, tf in postings.items():
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_id] / avgdl)
+                scores[doc_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        results = []
+        for doc_id, score in ranked:
+            if source and self.docs[doc_id].get("source") != source:
+                continue
+            results.append({"score": score, **self.docs[doc_id]})
+            if len(results) == k:
+                break
+        return results
+
+    def first_mention(self, phrase: str, source: str = "chapter") -> Optional[dict]:
+        """Earliest document (by chapter) containing the phrase, e.g. a character name"""
+        tokens = tokenize(phrase)
+        if not tokens:
+            return None
+        candidates = None
+        for token in set(tokens):
+            doc_ids = set(self.postings.get(token, {}))
+            candidates = doc_ids if candidates is None else candidates & doc_ids
+        needle = unicodedata.normalize("NFC", phrase).lower()
+        matches = [
+            self.docs[doc_id] for doc_id in candidates or ()
+            if self.docs[doc_id].get("source") == source
+            and needle in unicodedata.normalize("NFC", self.docs[doc_id]["text"]).lower()
+        ]
+        if not matches:
+            return None
+        return min(matches, key=lambda doc: (doc.get("start", 0), doc.get("passage", 0)))
+
+    def save(self, path: str):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "k1": self.k1,
+                "b": self.b,
+                "docs": self.docs,
+                "doc_lengths": self.doc_lengths,
+                "postings": self.postings,
+            }, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        index = cls(data["k1"], data["b"])
+        index.docs = data["docs"]
+        index.doc_lengths = data["doc_lengths"]
+        for token, postings in data["postings"].items():
+            index.postings[token] = {int(doc_id): tf for doc_id, tf in postings.items()}
+        return index
+
+def build_story_index(story_paths: List[str], pyramid=None, chapter_offset: int = 0, max_chars: int = 1200) -> BM25Index:
+    """
+    Index chapter passages and, if a SummaryPyramid is given, the batch summaries
+    and roll-ups BookSummary produced. Chapter numbers follow the sorted story_paths
+    the same way Summary() numbers them.
+    """
+    index = BM25Index()
+    for i, chapter_path in enumerate(story_paths, start=chapter_offset + 1):
+        try:
+            with open(chapter_path, "r", encoding="utf-8") as f:
+                chapter_text = f.read()
+        except (OSError, UnicodeDecodeError) as e:
+            print(f"Error reading {chapter_path}: {e}")
+            continue
+        title = chapter_text.split("\n", 1)[0].strip()
+        for j, passage in enumerate(split_passages(chapter_text, max_chars)):
+            index.add(passage, source="chapter", start=i, end=i, title=title, passage=j)
+
+    if pyramid is not None:
+        for entry in pyramid.entries:
+            if entry["kind"] in ("batch", "rollup"):
+                record = pyramid.read(entry)
+                index.add(record["text"], source=entry["kind"], start=entry["start"], end=entry["end"])
+    return index
+
+class StoryQA(TrackApi):
+    """Answer reader questions from the top BM25 passages with a single small LLM call"""
+    def __init__(self, index: BM25Index, llm=None, quota_per_minute: int = 15, api_key: str = None):
+        TrackApi.__init__(self, quota_per_minute)
+        if llm is None:
+            from llama_index.llms.google_genai import GoogleGenAI
+            llm = GoogleGenAI(model="models/gemini-2.0-flash", api_key=api_key or os.getenv("GOOGLE_API_KEY"))
+        self.index = index
+        self.llm = llm
+
+    def retrieve(self, question: str, k: int = 6) -> List[dict]:
+        return self.index.search(question, k=k)
+
+    def format_passages(self, passages: List[dict]) -> str:
+        blocks = []
+        for passage in passages:
+            if passage["start"] == passage["end"]:
+                where = f"Chương {passage['start']}"
+            else:
+                where = f"Chương {passage['start']}-{passage['end']}"
+            label = "nguyên văn" if passage["source"] == "chapter" else "tóm tắt"
+            blocks.append(f"[{where}, {label}]\n{passage['text']}")
+        return "\n\n".join(blocks)
+
+    async def ask(self, question: str, k: int = 6) -> str:
+        from llama_index.core.llms import ChatMessage
+        passages = self.retrieve(question, k)
+        if not passages:
+            return "Không tìm thấy đoạn truyện liên quan."
+        response = await self._rate_limited_llm_call(
+            self.llm.achat,
+            [ChatMessage(role="user", content=QA_PROMPT_TMPL.format(
+                passages=self.format_passages(passages),
+                question=question,
+            ))]
+        )
+        return str(response.message.content).strip()
+
+if __name__ == "__main__":
+    import asyncio
+    from pyramid import SummaryPyramid
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    name = "Khủng Bố Sống Lại [C]"
+    story_dir = os.path.join("story", name)
+    story_paths = sorted(os.path.join(story_dir, f) for f in os.listdir(story_dir) if f.endswith(".txt"))
+    pyramid = SummaryPyramid("summary", name) if os.path.exists(os.path.join("summary", name + "_pyramid.jsonl")) else None
+    index = build_story_index(story_paths, pyramid)
+    os.makedirs("summary", exist_ok=True)
+    index.save(os.path.join("summary", name + "_index.json"))
+
+    qa = StoryQA(index)
+    print(asyncio.run(qa.ask("Nhân vật chính lần đầu xuất hiện ở chương nào?")))
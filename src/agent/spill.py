@@ -0,0 +1,53 @@
+import os
+import json
+from collections import deque
+from typing import Iterable, Iterator, Optional
+
+class SpillList:
+    """
+    Append-only list of strings for the bounded-memory mode.
+
+    Only the last `keep` items stay in RAM; older items are appended to `path` as JSON
+    lines and can still be streamed back with `iter_all`. With keep=None nothing is
+    spilled and it behaves like a plain list. The joined text of the in-memory items
+    is cached so it is only rebuilt when the list changes.
+    """
+    def __init__(self, path: Optional[str] = None, keep: Optional[int] = None, initial: Iterable[str] = ()):
+        if keep is not None and path is None:
+            raise ValueError("SpillList needs a path to spill to when keep is set")
+        self.path = path
+        self.keep = keep
+        self.recent = deque()
+        self.spilled = 0
+        self._joined = None
+        if path is not None:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            open(path, "w", encoding="utf-8").close()
+        for item in initial:
+            self.append(item)
+
+    def append(self, text: str):
+        self.recent.append(text)
+        self._joined = None
+        if self.keep is not None and len(self.recent) > self.keep:
+            with open(self.path, "a", encoding="utf-8") as f:
+                while len(self.recent) > self.keep:
+                    f.write(json.dumps(self.recent.popleft(), ensure_ascii=False) + "\n")
+                    self.spilled += 1
+
+    def text(self) -> str:
+        """In-memory items joined by newlines"""
+        if self._joined is None:
+            self._joined = "\n".join(self.recent)
+        return self._joined
+
+    def iter_all(self) -> Iterator[str]:
+        """Every item, spilled ones streamed from disk first"""
+        if self.spilled:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    yield json.loads(line)
+        yield from self.recent
+
+    def __len__(self) -> int:
+        return self.spilled + len(self.recent)
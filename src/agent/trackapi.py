@@ -1,14 +1,238 @@
+import os
+import sys
 import time
 import json
 import re
 import asyncio
+import hashlib
+import threading
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: only threads of this process are serialized
+    fcntl = None
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from profiling import span
+
+# Only used for errors without an HTTP status
+QUOTA_ERROR_TERMS = ['quota', 'rate limit', 'too many requests', 'resource_exhausted']
+# Failures of the service itself, as opposed to a bad request: retried and counted by the
+# circuit breaker. Without a status, matched by class name anywhere in the exception's
+# MRO, so the httpx and google-genai error types need not be imported here.
+TRANSIENT_ERROR_TYPES = {'ServerError', 'TransportError', 'ConnectionError', 'TimeoutError'}
+# google-genai formats API errors as "<code> <STATUS>. <details>"
+STATUS_RE = re.compile(r"^\s*(\d{3})\s+[A-Z_]+\b")
+
+class CircuitOpenError(Exception):
+    """Raised while the circuit breaker is open after repeated service failures"""
+
+def error_status(error: Exception) -> Optional[int]:
+    """HTTP status of an API error: its `code` or `status_code`, its response's, or the leading code of its message"""
+    for value in (getattr(error, "code", None), getattr(error, "status_code", None),
+                  getattr(getattr(error, "response", None), "status_code", None)):
+        if isinstance(value, int) and 100 <= value < 600:
+            return value
+    match = STATUS_RE.match(str(error))
+    return int(match.group(1)) if match else None
+
+def is_quota_error(error: Exception) -> bool:
+    status = error_status(error)
+    if status is not None:
+        return status == 429
+    return any(term in str(error).lower() for term in QUOTA_ERROR_TERMS)
+
+def is_transient_error(error: Exception) -> bool:
+    status = error_status(error)
+    if status is not None:
+        return status >= 500 or status == 408
+    return any(cls.__name__ in TRANSIENT_ERROR_TYPES for cls in type(error).__mro__)
+
+class QuotaExhausted(Exception):
+    """The daily request quota of `key` is used up until `reset_at` (epoch seconds)"""
+    def __init__(self, reset_at: float, key: str = None):
+        super().__init__(f"Daily quota{' of ' + key if key else ''} exhausted until "
+                         f"{datetime.fromtimestamp(reset_at).strftime('%Y-%m-%d %H:%M')}")
+        self.reset_at = reset_at
+        self.key = key
+
+def next_quota_reset(now: float = None) -> float:
+    """Gemini daily quotas reset at midnight Pacific time"""
+    now = time.time() if now is None else now
+    try:
+        from zoneinfo import ZoneInfo
+        tz = ZoneInfo("America/Los_Angeles")
+    except Exception:
+        return now + 24 * 3600
+    local = datetime.fromtimestamp(now, tz)
+    midnight = (local + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return midnight.timestamp()
+
+def quota_key(api_key: Optional[str], model: str) -> str:
+    """Quota bucket of an API key and model, without keeping the key itself"""
+    return hashlib.sha256(f"{api_key or ''}|{model}".encode("utf-8")).hexdigest()[:16]
+
+def env_api_keys() -> List[str]:
+    """API keys from GOOGLE_API_KEYS (comma separated), or else GOOGLE_API_KEY"""
+    return [k.strip() for k in os.getenv("GOOGLE_API_KEYS", os.getenv("GOOGLE_API_KEY", "")).split(",") if k.strip()]
+
+def default_api_key() -> Optional[str]:
+    """
+    The key a run given none uses: the first key of the scheduler's pool, so its
+    requests are counted in the same quota bucket
+    """
+    keys = env_api_keys()
+    return keys[0] if keys else None
+
+class QuotaStore:
+    """
+    Daily request counts per quota key, persisted in a JSON file so a restart does not
+    lose them and several processes share them. Updates take an fcntl lock next to
+    the file. Default path: AUTOSUMMARY_QUOTA_FILE or ~/.cache/summary-story/quota.json.
+    """
+    def __init__(self, path: str = None):
+        self.path = path or os.getenv("AUTOSUMMARY_QUOTA_FILE", os.path.join(os.path.expanduser("~"), ".cache", "summary-story", "quota.json"))
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._thread_lock = threading.Lock()
+
+    @contextmanager
+    def _locked(self):
+        with self._thread_lock:
+            with open(self.path + ".lock", "a") as lock_file:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield self._load()
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _load(self) -> Dict:
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (json.JSONDecodeError, OSError):
+            return {}
+
+    def _save(self, state: Dict):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp, self.path)
+
+    def _entry(self, state: Dict, key: str) -> Dict:
+        entry = state.setdefault(key, {"count": 0, "reset_at": next_quota_reset()})
+        if time.time() >= entry["reset_at"]:
+            entry.update(count=0, reset_at=next_quota_reset())
+        return entry
+
+    def get(self, key: str) -> Dict:
+        """{"count": requests today, "reset_at": epoch seconds}"""
+        with self._locked() as state:
+            return dict(self._entry(state, key))
+
+    def add(self, key: str, n: int = 1) -> Dict:
+        with self._locked() as state:
+            entry = self._entry(state, key)
+            entry["count"] += n
+            self._save(state)
+            return dict(entry)
+
+    def exhaust(self, key: str, reset_at: float = None):
+        """Mark a key as used up, e.g. after the API reported its daily quota exceeded"""
+        with self._locked() as state:
+            entry = self._entry(state, key)
+            entry["count"] = max(entry["count"], 10 ** 9)
+            if reset_at:
+                entry["reset_at"] = reset_at
+            self._save(state)
+
+    def available(self, key: str, daily_quota: int) -> bool:
+        return self.get(key)["count"] < daily_quota
+
+class LatencyTracker:
+    """Rolling window of successful call latencies of one stage plus hedge and timeout counters"""
+    def __init__(self, window: int = 200, min_samples: int = 5):
+        self.samples = deque(maxlen=window)
+        self.min_samples = min_samples
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.timeouts = 0
+
+    def record(self, seconds: float):
+        self.samples.append(seconds)
+
+    def percentile(self, p: float) -> Optional[float]:
+        if len(self.samples) < self.min_samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+    def stats(self) -> dict:
+        ordered = sorted(self.samples)
+        return {
+            "calls": len(ordered),
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+            "max": ordered[-1] if ordered else None,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "timeouts": self.timeouts,
+        }
 
 class TrackApi:
-    def __init__(self, quota_per_minute: int = 15):
+    def __init__(
+        self,
+        quota_per_minute: int = 15,
+        daily_quota: int = 1500,
+        hedge: bool = True,
+        default_deadline: float = 180,
+        min_deadline: float = 30,
+        max_deadline: float = 600,
+        deadline_factor: float = 3.0,
+        breaker_threshold: int = 5,
+        breaker_cooldown: float = 120,
+        quota_key: str = None,
+        quota_store: QuotaStore = None,
+        park_on_quota: bool = True,
+    ):
         self.quota_per_minute = quota_per_minute
+        self.daily_quota = daily_quota
         self.request_timestamps = []
+        # With a quota store the daily count is shared with other runs on the same key
+        # and survives restarts. On a used-up daily quota, park_on_quota raises
+        # QuotaExhausted for the caller to checkpoint the job instead of sleeping here.
+        self.quota_key = quota_key
+        self.quota_store = quota_store
+        self.park_on_quota = park_on_quota
         self.daily_request_count = 0
-        self.daily_reset_time = time.time() + 24 * 3600  # Reset every 24h
+        self.daily_reset_time = next_quota_reset()
+        if quota_store is not None and quota_key:
+            entry = quota_store.get(quota_key)
+            self.daily_request_count, self.daily_reset_time = entry["count"], entry["reset_at"]
+        # Serializes limit checks so concurrent calls cannot all pass the same free slot
+        self._rate_lock = asyncio.Lock()
+
+        # Tail latency control: per-call deadline from observed p99, a duplicate request
+        # after p95 when quota allows, and a circuit breaker for persistent failures.
+        # Latencies are kept per stage, a roll-up or rewrite takes longer than a batch call.
+        self.hedge = hedge
+        self.default_deadline = default_deadline
+        self.min_deadline = min_deadline
+        self.max_deadline = max_deadline
+        self.deadline_factor = deadline_factor
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+        self.latencies: Dict[str, LatencyTracker] = {}
+        self.consecutive_failures = 0
+        self.breaker_open_until = 0.0
 
     def _parse_google_api_error(self, error_message: str):
         """
@@ -49,30 +273,45 @@ class TrackApi:
             print(f"Error parsing API error message: {e}")
             return None, None
 
-    async def _rate_limited_llm_call(self, llm_method, *args, **kwargs):
+    async def _rate_limited_llm_call(self, llm_method, *args, hedge: bool = None, stage: str = "default",
+                                     stream: bool = False, **kwargs):
         """
         Wrapper for LLM calls with rate limiting for Google Gemini free tier.
         Dynamically adjusts based on API error responses.
+        Each attempt has a deadline and may be hedged, see `_timed_call`; `stage` picks the
+        latency statistics both are derived from. A `stream` call reads its chunks through
+        `timed_stream`, which enforces its deadlines instead. After the last attempt its
+        error is raised.
         """
         max_retries = 2
         base_delay = 60 // self.quota_per_minute
+        last_error = None
 
         for attempt in range(max_retries):
+            self._check_circuit()
             try:
-                await self._check_rate_limits()
+                result = await self._timed_call(llm_method, args, kwargs, self.hedge if hedge is None else hedge, stage, stream)
+                self.consecutive_failures = 0
+                return result
 
-                if asyncio.iscoroutinefunction(llm_method):
-                    result = await llm_method(*args, **kwargs)
-                else:
-                    result = llm_method(*args, **kwargs)
+            except QuotaExhausted:
+                raise
 
-                self._track_request()
-                return result
+            except asyncio.TimeoutError as e:
+                last_error = e
+                self._record_failure()
+                print(f"LLM call timed out: {e} (attempt {attempt + 1}/{max_retries})")
+                continue
 
             except Exception as e:
                 error_msg = str(e)
+                last_error = e
 
-                if any(term in error_msg.lower() for term in ['quota', 'rate limit', 'too many requests', '429', 'resource_exhausted']):
+                if is_quota_error(e):
+                    if "perday" in error_msg.lower() and self.park_on_quota:
+                        # The service's own daily counter ran out, retrying before the reset is useless
+                        self._exhaust(next_quota_reset())
+                        raise QuotaExhausted(self.daily_reset_time, self.quota_key)
                     api_quota_value, api_retry_delay = self._parse_google_api_error(error_msg)
 
                     if api_quota_value and api_quota_value != self.quota_per_minute:
@@ -88,25 +327,159 @@ class TrackApi:
 
                     await asyncio.sleep(wait_time)
                     continue
+                elif is_transient_error(e):
+                    self._record_failure()
+                    print(f"LLM service error: {error_msg} (attempt {attempt + 1}/{max_retries})")
+                    continue
                 else:
-                    raise e
+                    raise
+
+        print(f"LLM call failed after {max_retries} attempts")
+        raise last_error
+
+    def _latency(self, stage: str) -> LatencyTracker:
+        if stage not in self.latencies:
+            self.latencies[stage] = LatencyTracker()
+        return self.latencies[stage]
+
+    def _deadline(self, latency: LatencyTracker) -> float:
+        p99 = latency.percentile(99)
+        if p99 is None:
+            return self.default_deadline
+        return min(self.max_deadline, max(self.min_deadline, p99 * self.deadline_factor))
+
+    async def _invoke(self, llm_method, args, kwargs):
+        with span("llm.call", method=getattr(llm_method, "__name__", "call")):
+            if asyncio.iscoroutinefunction(llm_method):
+                return await llm_method(*args, **kwargs)
+            # Blocking clients run in a thread so the deadline and hedging still apply
+            return await asyncio.to_thread(llm_method, *args, **kwargs)
+
+    async def _timed_call(self, llm_method, args, kwargs, hedge: bool, stage: str = "default", stream: bool = False):
+        """
+        Send one request with a deadline. If it is still running after the p95 latency
+        observed for its stage and a spare request fits in the quota, send a duplicate
+        and keep whichever answer arrives first.
+        A blocking client runs in a thread that a deadline cannot stop: it would keep
+        spending quota next to a duplicate, so it is never hedged. A stream has no overall
+        deadline, since it can run long while it makes progress; see `timed_stream`.
+        """
+        with span("llm.rate_limit_wait"):
+            async with self._rate_lock:
+                await self._check_rate_limits()
+                # Count the request when it is sent so concurrent callers see it
+                self._track_request()
 
-        raise Exception(f"Failed to complete LLM call after {max_retries} attempts")
+        latency = self._latency(stage)
+        deadline = None if stream else self._deadline(latency)
+        hedge = hedge and not stream and asyncio.iscoroutinefunction(llm_method)
+        start = time.monotonic()
+        primary = asyncio.ensure_future(self._invoke(llm_method, args, kwargs))
+        started = {primary: start}
+        pending = {primary}
+
+        hedge_after = latency.percentile(95) if hedge else None
+        if hedge_after is not None and (deadline is None or hedge_after < deadline):
+            done, pending = await asyncio.wait(pending, timeout=hedge_after)
+            if not done and self._try_reserve_request():
+                duplicate = asyncio.ensure_future(self._invoke(llm_method, args, kwargs))
+                started[duplicate] = time.monotonic()
+                pending.add(duplicate)
+                latency.hedges += 1
+            pending |= done
+
+        error = None
+        try:
+            while pending:
+                remaining = None if deadline is None else max(0, deadline - (time.monotonic() - start))
+                done, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    latency.timeouts += 1
+                    raise asyncio.TimeoutError(f"no response within {deadline:.1f}s")
+                for task in done:
+                    if task.exception() is None:
+                        latency.record(time.monotonic() - started[task])
+                        if task is not primary:
+                            latency.hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def timed_stream(self, stream, stage: str = "default"):
+        """
+        Chunks of a streamed response, each awaited with a deadline from the stage's own
+        trackers: `<stage>.first` for the first chunk and `<stage>.chunk` for the gaps
+        after it. A stream that stalls is cut, one that keeps sending chunks is not.
+        """
+        chunks = stream.__aiter__()
+        tracker = self._latency(f"{stage}.first")
+        while True:
+            deadline = self._deadline(tracker)
+            start = time.monotonic()
+            try:
+                chunk = await asyncio.wait_for(chunks.__anext__(), timeout=deadline)
+            except StopAsyncIteration:
+                return
+            except asyncio.TimeoutError:
+                tracker.timeouts += 1
+                raise asyncio.TimeoutError(f"stream stalled for {deadline:.1f}s")
+            tracker.record(time.monotonic() - start)
+            tracker = self._latency(f"{stage}.chunk")
+            yield chunk
+
+    def _try_reserve_request(self) -> bool:
+        """Record a request without waiting, only if it fits in the current quota"""
+        current_time = time.time()
+        self.request_timestamps = [ts for ts in self.request_timestamps if current_time - ts < 60]
+        if len(self.request_timestamps) >= self.quota_per_minute - 1 or self.daily_request_count >= self.daily_quota:
+            return False
+        self._track_request()
+        return True
+
+    def _check_circuit(self):
+        if time.time() < self.breaker_open_until:
+            raise CircuitOpenError(
+                f"LLM circuit open after {self.consecutive_failures} consecutive failures, "
+                f"retry in {self.breaker_open_until - time.time():.0f} seconds"
+            )
+
+    def _record_failure(self):
+        self.consecutive_failures += 1
+        # Once open, a single failure after the cooldown opens it again
+        if self.consecutive_failures >= self.breaker_threshold:
+            self.breaker_open_until = time.time() + self.breaker_cooldown
+            print(f"Circuit breaker open for {self.breaker_cooldown} seconds after {self.consecutive_failures} failures")
+
+    def latency_stats(self) -> dict:
+        """Tail latency metrics of the calls made so far, per stage"""
+        return {
+            "stages": {stage: {**latency.stats(), "deadline": self._deadline(latency)} for stage, latency in self.latencies.items()},
+            "consecutive_failures": self.consecutive_failures,
+        }
 
     async def _check_rate_limits(self):
         """Check and enforce rate limits"""
         current_time = time.time()
 
-        if current_time > self.daily_reset_time:
+        if self.quota_store is not None and self.quota_key:
+            entry = self.quota_store.get(self.quota_key)
+            self.daily_request_count, self.daily_reset_time = entry["count"], entry["reset_at"]
+        elif current_time > self.daily_reset_time:
             self.daily_request_count = 0
-            self.daily_reset_time = current_time + 24 * 3600
+            self.daily_reset_time = next_quota_reset(current_time)
 
-        if self.daily_request_count >= 1500:
+        if self.daily_request_count >= self.daily_quota:
+            if self.park_on_quota:
+                print(f"Daily request limit ({self.daily_quota}) reached, parking until the quota resets")
+                raise QuotaExhausted(self.daily_reset_time, self.quota_key)
             sleep_time = self.daily_reset_time - current_time
-            print(f"Daily request limit (1500) reached. Sleeping for {sleep_time/3600:.2f} hours")
+            print(f"Daily request limit ({self.daily_quota}) reached. Sleeping for {sleep_time/3600:.2f} hours")
             await asyncio.sleep(sleep_time)
             self.daily_request_count = 0
-            self.daily_reset_time = time.time() + 24 * 3600
+            self.daily_reset_time = next_quota_reset()
 
         self.request_timestamps = [ts for ts in self.request_timestamps if current_time - ts < 60]
 
@@ -118,7 +491,15 @@ class TrackApi:
                 await asyncio.sleep(sleep_time)
 
     def _track_request(self):
-        """Track a successful request"""
+        """Track a sent request"""
         current_time = time.time()
         self.request_timestamps.append(current_time)
-        self.daily_request_count += 1
\ No newline at end of file
+        self.daily_request_count += 1
+        if self.quota_store is not None and self.quota_key:
+            self.daily_request_count = self.quota_store.add(self.quota_key)["count"]
+
+    def _exhaust(self, reset_at: float):
+        self.daily_request_count = self.daily_quota
+        self.daily_reset_time = reset_at
+        if self.quota_store is not None and self.quota_key:
+            self.quota_store.exhaust(self.quota_key, reset_at)
\ No newline at end of file
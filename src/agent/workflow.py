@@ -6,28 +6,45 @@ from llama_index.core.workflow import (
     Context,
     step,
 )
-from dotenv import load_dotenv
-from llama_index.llms.google_genai import GoogleGenAI
 import asyncio
-from llama_index.utils.workflow import draw_most_recent_execution
+import functools
+from collections import Counter, deque
 from llama_index.core.llms import ChatMessage
 from typing import Any, List
 from llama_index.core.bridge.pydantic import BaseModel, Field
-from llama_index.core.prompts import PromptTemplate
 from llama_index.core.llms import ChatResponse
 
 import sys
 import os
+import json
+import shutil
+import tempfile
 sys.path.append("..")
 sys.path.append(os.path.dirname(__file__))
-from trackapi import TrackApi
+from trackapi import TrackApi, QuotaExhausted, QuotaStore, default_api_key
+from pyramid import SummaryPyramid
+from characters import character_names, merge_characters, mentioned_names
+from prefix_cache import PrefixCache, GeminiPrefixCache
+from spill import SpillList
+from planner import RunPlanner, format_plan, estimate_tokens
+from routing import StageRouter, default_router
+from batch import BatchBackend, BatchSummary
+from dedup import dedup_chapters, format_report
+from importance import importance_batches, format_report as format_importance_report
+from compress import ExtractiveCompressor
+from budget import OutputBudget, thinking_allowance
+from profiling import span
+from parsing import SummaryParseError, parse_summary_output, partial_summary, is_oversize_error
 from prompt import (
-    FIRST_EXTRACTCHARACTERNSUMMARY_PROMPT_TMPL,
-    EXTRACT_CHARACTERSNSUMMARY_PROMPT_TMPL,
+    SYSTEM_PROMPT,
+    FIRST_EXTRACTCHARACTERNSUMMARY_PROMPT_PREFIX,
+    FIRST_EXTRACTCHARACTERNSUMMARY_PROMPT_SUFFIX,
+    EXTRACT_CHARACTERSNSUMMARY_PROMPT_PREFIX,
+    EXTRACT_CHARACTERSNSUMMARY_PROMPT_SUFFIX,
     LONG_SUMMARY_PROMPT_TMPL,
-    REWRITE_SUMMARY_PROMPT_TMPL
+    REWRITE_SUMMARY_PROMPT_TMPL,
+    REPAIR_SUMMARY_PROMPT_TMPL,
 )
-load_dotenv()
 
 class ChapterSummary(BaseModel):
     character: str = Field(description="Danh sách các nhân vật được đề cập. Mỗi dòng liệt kê một nhân vật (Tên_nhân_vât: giới thiệu về nhân vật)")
@@ -39,6 +56,17 @@ class SummarizeEvent(Event):
 class ProgressSummaryEvent(Event):
     msg: str = Field(description="Progress message")
 
+class SummaryDeltaEvent(Event):
+    kind: str = Field(description="batch for a chapter summary, final for the rewrite")
+    text: str = Field(description="Summary text received so far, restarts from empty on a retry")
+
+class ChapterBatch(list):
+    """Chapter texts of one batch; `chapters` also counts the skipped chapters they stand for"""
+    def __init__(self):
+        super().__init__()
+        self.chapters = 0
+        self.paths = []
+
 class BookSummary(Workflow, TrackApi):
     def __init__(
         self,
@@ -52,23 +80,60 @@ class BookSummary(Workflow, TrackApi):
         initial_characters: str = "",
         system_prompt=None,
         api_key: str = None,
+        pyramid: SummaryPyramid = None,
+        chapter_offset: int = 0,
+        rollup_start: int = None,
+        prefix_cache: PrefixCache = None,
+        lookahead: int = 0,
+        lookahead_threshold: float = 0.8,
+        llm = None,
+        bounded_memory: bool = False,
+        keep_big_summaries: int = 4,
+        spill_dir: str = None,
+        stream: bool = False,
+        router: StageRouter = None,
+        chapter_spans: dict = None,
+        budget: OutputBudget = None,
+        daily_quota: int = 1500,
+        quota_store: QuotaStore = None,
+        quota_key: str = None,
+        batches: List[List[str]] = None,
+        compressor: ExtractiveCompressor = None,
         **kwargs
     ):
         Workflow.__init__(self, **kwargs)
-        TrackApi.__init__(self, quota_per_minute)
+        TrackApi.__init__(self, quota_per_minute, daily_quota=daily_quota, quota_key=quota_key, quota_store=quota_store)
 
         if system_prompt is None:
-            system_prompt = """
-            Bạn là một trợ lí nhiệm vụ của bạn là tóm tắt lại một câu chuyện.\
-            trả lời bằng tiếng Việt.
-            """
-        if api_key is None:
-            api_key = os.getenv("GOOGLE_API_KEY")
+            system_prompt = SYSTEM_PROMPT
+        if api_key is None and llm is None:
+            from dotenv import load_dotenv
+            load_dotenv()
+            api_key = default_api_key()
+        if batches:
+            story_paths = [path for batch in batches for path in batch]
         self.story_paths = story_paths
+        # After dedup, a kept chapter also stands for the skipped chapters after it
+        self.chapter_spans = chapter_spans or {}
+        # Planned batches (importance.py merges filler chapters) replace fixed groups of
+        # gather_chapters; a batch ends at its last path
+        self.batch_ends = {batch[-1] for batch in batches} if batches else None
         self.big_summary_interval = big_summary_interval
         self.max_chapters = max_chapters
         self.gather_chapters = gather_chapters
-        self.llm = GoogleGenAI(model="models/gemini-2.0-flash", system_prompt=system_prompt, api_key=api_key)
+        self.system_prompt = system_prompt
+        self.prefix_cache = prefix_cache
+        # Per-stage model routing: each stage gets its own model, config and quota
+        self.router = router
+        if router is not None:
+            router.configure(system_prompt, api_key, quota_store)
+            if llm is None:
+                llm = router.client(router.stages["short"])
+        if llm is None:
+            # google-genai is only imported once a summary actually starts
+            from llama_index.llms.google_genai import GoogleGenAI
+            llm = GoogleGenAI(model="models/gemini-2.0-flash", system_prompt=system_prompt, api_key=api_key)
+        self.llm = llm
         self.chapter_generator = self.get_chapter(gather_chapters)
         
         # Store initial data
@@ -76,19 +141,64 @@ class BookSummary(Workflow, TrackApi):
         self.initial_short_summaries = initial_short_summaries or []
         self.initial_long_summaries = initial_long_summaries or []
         self.initial_characters = initial_characters
+
+        # Bounded-memory mode keeps only the last `keep_big_summaries` big summaries in RAM
+        # (and in the running context), older ones are spilled to disk for the final rewrite
+        self.bounded_memory = bounded_memory
+        self.keep_big_summaries = keep_big_summaries
+        self.spill_dir = spill_dir
+        # Spill directory this run created itself, removed when the run ends either way
+        self.own_spill_dir = None
+
+        # Chapter range bookkeeping for the summary pyramid
+        self.pyramid = pyramid
+        self.chapter_offset = chapter_offset
+        self.chapters_read = 0
+        # First chapter not yet in a roll-up; a resumed run continues the interval it was in
+        self.rollup_start = chapter_offset + 1 if rollup_start is None else rollup_start
+
+        # Speculative lookahead: the next `lookahead` batches are summarized in parallel
+        # against the latest known context and reconciled when their predecessor finishes
+        self.lookahead = lookahead
+        self.lookahead_threshold = lookahead_threshold
+        self.pending = deque()
+        self.speculation_stats = {"accepted": 0, "rerun": 0}
+        # Which kind of failure each recovery was for: oversize, empty, missing_summary, ...
+        self.failure_counts = Counter()
+
+        # Streaming mode: chapter summaries and the rewrite are requested with astream_chat
+        # and their text so far is written to the event stream as SummaryDeltaEvent
+        self.stream = stream
+
+        # Output budgets: per-stage length targets in the prompt and max_output_tokens,
+        # with overlong summaries and character lists compacted before they are resent
+        self.budget = budget
+
+        # Extractive compression: each chapter is cut to its most central sentences when read,
+        # so more chapters fit in one call
+        self.compressor = compressor
+
+        # State after the last finished batch, for `checkpoint()` when the daily quota runs out
+        self.resume_state = None
+        # Checkpoint taken when the run stopped on QuotaExhausted, before its spill files were removed
+        self.parked_checkpoint = None
         
     def get_chapter(self, gather = 1):
-        gather_chapters = []
+        gather_chapters = ChapterBatch()
         for chapter_path in self.story_paths:
             try:
-                with open(chapter_path, "r", encoding="utf-8") as f:
+                with span("summary.read_chapter"), open(chapter_path, "r", encoding="utf-8") as f:
                     chapter_text = f.read()
-                    gather_chapters.append(chapter_text)
-                    if len(gather_chapters) == gather:
-                        cop = gather_chapters
-                        gather_chapters = []
-                        print(f"Yielding {len(cop)} chapters with total length: {sum(len(ch) for ch in cop)}")
-                        yield cop
+                if self.compressor:
+                    chapter_text = self.compressor.compress(chapter_text)
+                gather_chapters.append(chapter_text)
+                gather_chapters.chapters += self.chapter_spans.get(chapter_path, 1)
+                gather_chapters.paths.append(chapter_path)
+                if (chapter_path in self.batch_ends) if self.batch_ends else len(gather_chapters) == gather:
+                    cop = gather_chapters
+                    gather_chapters = ChapterBatch()
+                    print(f"Yielding {len(cop)} chapters with total length: {sum(len(ch) for ch in cop)}")
+                    yield cop
             except FileNotFoundError:
                 print(f"File not found: {chapter_path}")
             except Exception as e:
@@ -105,6 +215,24 @@ class BookSummary(Workflow, TrackApi):
         ctx: Context,
         ev: StartEvent | SummarizeEvent,
     ) -> SummarizeEvent | StopEvent:
+        try:
+            return await self.summarize_next(ctx, ev)
+        except BaseException as e:
+            # Speculative batches of a failed run would otherwise keep spending quota
+            await self.discard_speculation()
+            if isinstance(e, QuotaExhausted):
+                # The checkpoint reads spilled big summaries back, so take it before they go
+                self.parked_checkpoint = self.checkpoint()
+            self.remove_spill_dir()
+            raise
+
+    def remove_spill_dir(self):
+        """Remove the temporary spill directory of a bounded-memory run, never a caller's spill_dir"""
+        if self.own_spill_dir is not None:
+            shutil.rmtree(self.own_spill_dir, ignore_errors=True)
+            self.own_spill_dir = None
+
+    async def summarize_next(self, ctx: Context, ev: StartEvent | SummarizeEvent) -> SummarizeEvent | StopEvent:
         # Initialize context store with initial data on first run
         if isinstance(ev, StartEvent):
             # Convert string summaries to ChapterSummary objects
@@ -116,60 +244,250 @@ class BookSummary(Workflow, TrackApi):
                 )
                 initial_chapter_summaries.append(chapter_summary_obj)
             
+            if self.bounded_memory:
+                spill_dir = self.spill_dir
+                if spill_dir is None:
+                    spill_dir = self.own_spill_dir = tempfile.mkdtemp(prefix="autosummary_spill_")
+                big_summaries = SpillList(os.path.join(spill_dir, "big_summaries.jsonl"), self.keep_big_summaries, self.initial_long_summaries)
+            else:
+                big_summaries = SpillList(initial=self.initial_long_summaries)
+            
             await ctx.store.set("chapter_summaries", initial_chapter_summaries)
-            await ctx.store.set("big_summaries", self.initial_long_summaries)
+            await ctx.store.set("big_summaries", big_summaries)
             await ctx.store.set("characters", self.initial_characters)
             
         summaries_segment = await ctx.store.get("chapter_summaries", [])
         chapter_summary = '\n'.join(summary.summary for summary in summaries_segment)
-        chapters_summary_list = await ctx.store.get("big_summaries", [])
-        chapters_summary = '\n'.join(summary for summary in chapters_summary_list)
-        summaries = (chapters_summary + '\n' + chapter_summary).strip()
+        big_summaries = await ctx.store.get("big_summaries")
+        chapters_summary = big_summaries.text()
         
         characters = await ctx.store.get("characters", "")
         
-        # Get the next chapter from the instance generator
-        try:
-            gather_chapters = next(self.chapter_generator)
-        except StopIteration:
-            gather_chapters = None
+        # Get the next chapter, either already speculated on or from the instance generator
+        if self.pending:
+            gather_chapters, speculation, speculated_characters = self.pending.popleft()
+        else:
+            gather_chapters, speculation, speculated_characters = self.next_batch(), None, None
         
-        if (self.chapter_count*self.gather_chapters < self.max_chapters) and gather_chapters:
-            self.chapter_count += 1
-            if (summaries_segment == []) and (chapters_summary_list == []):
+        if gather_chapters:
+            batch_start = self.chapter_offset + self.chapters_read + 1
+            self.chapters_read += gather_chapters.chapters
+            batch_end = self.chapter_offset + self.chapters_read
+            is_first = (summaries_segment == []) and (len(big_summaries) == 0)
+            if self.lookahead and not is_first:
+                self.schedule_lookahead(ctx, characters, chapter_summary, chapters_summary)
+
+            speculative_summary = None
+            if speculation is not None:
+                if self.speculation_close_enough(speculated_characters, characters, gather_chapters):
+                    speculative_summary = await self.settle_speculation(speculation)
+                else:
+                    await self.settle_speculation(speculation, cancel=True)
+                if speculative_summary is None:
+                    self.speculation_stats["rerun"] += 1
+
+            if speculative_summary is not None:
+                # Patch continuity: keep what the real predecessor knows about characters
+                # and apply what the speculative pass learned from this batch on top.
+                # The summary text itself is kept as speculated, see speculation_close_enough.
+                chapter_summary = ChapterSummary(
+                    character=merge_characters(characters, speculative_summary.character),
+                    summary=speculative_summary.summary,
+                )
+                ctx.write_event_to_stream(ProgressSummaryEvent(msg=chapter_summary.summary))
+                self.speculation_stats["accepted"] += 1
+            elif is_first:
                 chapter_summary = await self.short_summary(
                     ctx=ctx,
-                    prompt_tmpl=FIRST_EXTRACTCHARACTERNSUMMARY_PROMPT_TMPL,
+                    prompt_prefix=FIRST_EXTRACTCHARACTERNSUMMARY_PROMPT_PREFIX,
+                    prompt_suffix=FIRST_EXTRACTCHARACTERNSUMMARY_PROMPT_SUFFIX,
                     characters=characters,
-                    previous_summary=summaries,
+                    previous_summary=chapter_summary,
                     gather_chapters=gather_chapters
                 )
             else:
                 chapter_summary = await self.short_summary(
                     ctx=ctx,
-                    prompt_tmpl=EXTRACT_CHARACTERSNSUMMARY_PROMPT_TMPL,
+                    prompt_prefix=EXTRACT_CHARACTERSNSUMMARY_PROMPT_PREFIX,
+                    prompt_suffix=EXTRACT_CHARACTERSNSUMMARY_PROMPT_SUFFIX,
                     characters=characters,
-                    previous_summary=summaries,
-                    gather_chapters=gather_chapters
+                    previous_summary=chapter_summary,
+                    gather_chapters=gather_chapters,
+                    long_summary=chapters_summary,
                 )
-            summaries_segment.append(chapter_summary)
+            if self.bounded_memory:
+                # The running character list lives in the "characters" key, no need for a copy per batch
+                summaries_segment.append(ChapterSummary(character="", summary=chapter_summary.summary))
+            else:
+                summaries_segment.append(chapter_summary)
             await ctx.store.set("chapter_summaries", summaries_segment)
             await ctx.store.set("characters", chapter_summary.character)
+            if self.pyramid:
+                self.pyramid.append("batch", batch_start, batch_end, chapter_summary.summary)
+                self.pyramid.append("characters", batch_start, batch_end, chapter_summary.character)
             
-            if ((len(summaries_segment)*self.gather_chapters) % self.big_summary_interval == 0) and (not isinstance(ev, StartEvent)):
+            # Roll up once the batches since the last roll-up cover big_summary_interval
+            # chapters: planned batches and dedup spans make batches differ in size
+            if (batch_end - self.rollup_start + 1 >= self.big_summary_interval) and (not isinstance(ev, StartEvent)):
                 long_summary = await self.big_summary(ctx, summaries_segment)
-                await ctx.store.set("big_summaries", chapters_summary_list + [long_summary])
+                big_summaries.append(long_summary)
+                await ctx.store.set("big_summaries", big_summaries)
                 await ctx.store.set("chapter_summaries", summaries_segment[-1:])
-            
+                if self.pyramid:
+                    self.pyramid.append("rollup", self.rollup_start, batch_end, long_summary)
+                self.rollup_start = batch_end + 1
+
+            self.resume_state = {
+                "last_path": gather_chapters.paths[-1] if gather_chapters.paths else None,
+                "chapters_read": self.chapters_read,
+                "rollup_start": self.rollup_start,
+                "segment": await ctx.store.get("chapter_summaries"),
+                "big_summaries": big_summaries,
+                "characters": chapter_summary.character,
+            }
+            if self.bounded_memory:
+                # The workflow runtime keeps every step's result for the whole run; the next
+                # step reads the context store, so the event need not carry the summary
+                return SummarizeEvent(summary=ChapterSummary(character="", summary=""))
             return SummarizeEvent(summary=chapter_summary)
         
-        rewrite_summary = await self._rate_limited_llm_call(
-            self.llm.chat,
-            [ChatMessage(role="user", content=REWRITE_SUMMARY_PROMPT_TMPL.format(summary=summaries))]
-        )
-        rewrite_summary = self.clean_response(str(rewrite_summary))
+        if self.lookahead:
+            print(f"Speculative lookahead: {self.speculation_stats}")
+        if self.failure_counts:
+            print(f"Summary failures recovered: {dict(self.failure_counts)}")
+        if self.compressor:
+            print(f"Chapter compression: {self.compressor.stats()}")
+        if self.router is None:
+            print(f"LLM latency: {self.latency_stats()}")
+        # Spilled big summaries are streamed back once, for the final rewrite only
+        summaries = ('\n'.join(big_summaries.iter_all()) + '\n' + chapter_summary).strip()
+        self.remove_spill_dir()
+        rewrite_prompt = REWRITE_SUMMARY_PROMPT_TMPL.format(summary=summaries)
+        llm_kwargs = {}
+        if self.budget:
+            target = self.budget.target("rewrite", estimate_tokens(summaries))
+            rewrite_prompt += self.budget.instruction(target)
+            llm_kwargs = self.budget.llm_kwargs(target)
+        rewrite_messages = [ChatMessage(role="user", content=rewrite_prompt)]
+        with span("summary.rewrite"):
+            if self.stream:
+                rewrite_summary = await self.call_stage("rewrite", rewrite_messages, runner=self.streamer(ctx, "final", "rewrite"), stream=True, **llm_kwargs)
+            else:
+                rewrite_summary = str(await self.call_stage("rewrite", rewrite_messages, method="chat", **llm_kwargs))
+        rewrite_summary = self.clean_response(rewrite_summary)
+        if self.budget:
+            # The final text is only monitored, never cut
+            self.budget.fit("rewrite", target, rewrite_summary, compact=False)
+            print(f"Output budgets: {self.budget.stats()}")
+        if self.router is not None:
+            print("Model routing:\n" + self.router.format_report())
+        if self.pyramid:
+            self.pyramid.append("final", 1, self.chapter_offset + self.chapters_read, rewrite_summary)
         return StopEvent(result=rewrite_summary)
         
+    def checkpoint(self) -> dict:
+        """
+        Everything needed to continue the run in a new BookSummary after the last finished
+        batch: the remaining chapter files, the chapter offset, where the current roll-up
+        interval started and the running context as initial_short_summaries /
+        initial_long_summaries / initial_characters.
+        """
+        if self.parked_checkpoint is not None:
+            return self.parked_checkpoint
+        state = self.resume_state
+        if state is None:
+            return {
+                "story_paths": list(self.story_paths),
+                "chapter_offset": self.chapter_offset,
+                "rollup_start": self.rollup_start,
+                "short_summaries": list(self.initial_short_summaries),
+                "long_summaries": list(self.initial_long_summaries),
+                "characters": self.initial_characters,
+            }
+        paths = list(self.story_paths)
+        remaining = paths[paths.index(state["last_path"]) + 1:] if state["last_path"] in paths else []
+        return {
+            "story_paths": remaining,
+            "chapter_offset": self.chapter_offset + state["chapters_read"],
+            "rollup_start": state["rollup_start"],
+            "short_summaries": [summary.summary for summary in state["segment"]],
+            "long_summaries": list(state["big_summaries"].iter_all()),
+            "characters": state["characters"],
+        }
+
+    def next_batch(self):
+        """Next batch of chapters from the instance generator, or None once max_chapters is reached"""
+        if self.chapter_count*self.gather_chapters >= self.max_chapters:
+            return None
+        try:
+            gather_chapters = next(self.chapter_generator)
+        except StopIteration:
+            return None
+        self.chapter_count += 1
+        return gather_chapters
+
+    def schedule_lookahead(self, ctx: Context, characters: str, previous_summary: str, long_summary: str):
+        """Start speculative summaries for upcoming batches against the latest known context"""
+        while len(self.pending) < self.lookahead:
+            gather_chapters = self.next_batch()
+            if not gather_chapters:
+                break
+            speculation = asyncio.create_task(self.short_summary(
+                ctx=ctx,
+                prompt_prefix=EXTRACT_CHARACTERSNSUMMARY_PROMPT_PREFIX,
+                prompt_suffix=EXTRACT_CHARACTERSNSUMMARY_PROMPT_SUFFIX,
+                characters=characters,
+                previous_summary=previous_summary,
+                gather_chapters=gather_chapters,
+                long_summary=long_summary,
+                emit=False,
+            ))
+            self.pending.append((gather_chapters, speculation, characters))
+
+    async def settle_speculation(self, speculation: asyncio.Task, cancel: bool = False):
+        """
+        Wait for a speculative task, cancelling it first if its result is not wanted, so its
+        outcome or exception is always retrieved. Returns its summary, or None if it was
+        cancelled or failed (the batch is then rerun, which surfaces a persistent error).
+        """
+        if cancel:
+            speculation.cancel()
+        try:
+            return await speculation
+        except asyncio.CancelledError:
+            if not cancel:
+                raise
+        except QuotaExhausted:
+            raise
+        except Exception as e:
+            print(f"Speculative summary failed, rerunning the batch: {e}")
+        return None
+
+    async def discard_speculation(self):
+        """Cancel and settle the speculative batches still pending, e.g. after a failure"""
+        while self.pending:
+            _, speculation, _ = self.pending.popleft()
+            await self.settle_speculation(speculation, cancel=True)
+
+    def speculation_close_enough(self, speculated_characters: str, characters: str, gather_chapters: List[str]) -> bool:
+        """
+        Acceptance rule of the lookahead mode. A speculative summary is kept when the
+        characters the real predecessor knows about and that appear in this batch were
+        (mostly, `lookahead_threshold`) already known when speculating.
+
+        This is a heuristic on character coverage only: the speculative summary is never
+        compared with what the real predecessor would have produced, and the only
+        reconciliation is merging its character list onto the predecessor's. Plot details
+        the predecessor added since the speculation started are not reflected in it.
+        """
+        chapter_text = '\n'.join(gather_chapters)
+        relevant = mentioned_names(character_names(characters), chapter_text)
+        if not relevant:
+            return True
+        known = {name.lower() for name in mentioned_names(character_names(speculated_characters), chapter_text)}
+        covered = sum(1 for name in relevant if name.lower() in known)
+        return covered / len(relevant) >= self.lookahead_threshold
+
     async def big_summary(
         self,
         ctx: Context,
@@ -177,56 +495,218 @@ class BookSummary(Workflow, TrackApi):
     ) -> str:
         characters = await ctx.store.get("characters", "")
         summaries = '\n'.join(summary.summary for summary in chapter_summary)
-        big_summary_response = await self._rate_limited_llm_call(
-            self.llm.chat,
-            [ChatMessage(role="user", content=LONG_SUMMARY_PROMPT_TMPL.format(characters=characters,summaries=summaries))]
-        )
+        prompt = LONG_SUMMARY_PROMPT_TMPL.format(characters=characters,summaries=summaries)
+        llm_kwargs = {}
+        if self.budget:
+            target = self.budget.target("big", estimate_tokens(summaries))
+            prompt += self.budget.instruction(target)
+            llm_kwargs = self.budget.llm_kwargs(target)
+        with span("summary.rollup"):
+            big_summary_response = await self.call_stage(
+                "big",
+                [ChatMessage(role="user", content=prompt)],
+                method="chat",
+                **llm_kwargs,
+            )
+        if self.budget:
+            return self.budget.fit("big", target, self.clean_response(str(big_summary_response)))
         return str(big_summary_response)
     
     async def short_summary(
         self,
         ctx: Context,
-        prompt_tmpl,
+        prompt_prefix: str,
+        prompt_suffix: str,
         characters:str,
         previous_summary:str,
         gather_chapters: List[str],
+        long_summary: str = "",
+        emit: bool = True,
     ) -> ChapterSummary:
+        chapter_text = '\n'.join(gather_chapters)
+
+        async def request(escalated: bool = False):
+            with span("summary.request", chapters=len(gather_chapters), chars=len(chapter_text), speculative=not emit):
+                return await self.request_summary(prompt_prefix, prompt_suffix, characters, previous_summary, chapter_text, long_summary,
+                                                  ctx=ctx if emit else None, escalated=escalated)
+
         try:
-            chapter_summary = await self._rate_limited_llm_call(
-                self.llm.astructured_predict,
-                ChapterSummary,
-                PromptTemplate(prompt_tmpl),
-                characters = characters,
-                previous_summary = previous_summary,
-                chapter_text = '\n'.join(gather_chapters)
-            )
-            ctx.write_event_to_stream(ProgressSummaryEvent(msg=chapter_summary.summary))
-            return chapter_summary
-        except ValueError as e:
-            first_half = '\n'.join(gather_chapters)[:len('\n'.join(gather_chapters))//2]
+            raw_summary = await request()
+        except Exception as e:
+            # Only a request that is too large for the model is worth splitting in half
+            if not is_oversize_error(e):
+                raise
+            self.failure_counts["oversize"] += 1
+            first_half = chapter_text[:len(chapter_text)//2]
             first_half_chapter_summary = await self.short_summary(
                 ctx,
-                prompt_tmpl,
+                prompt_prefix,
+                prompt_suffix,
                 characters,
                 previous_summary,
-                [first_half]
+                [first_half],
+                long_summary,
+                emit,
             )
-            ctx.write_event_to_stream(ProgressSummaryEvent(msg=first_half_chapter_summary.summary))
-            second_half = '\n'.join(gather_chapters)[len('\n'.join(gather_chapters))//2:]
+            second_half = chapter_text[len(chapter_text)//2:]
             second_half_chapter_summary = await self.short_summary(
                 ctx,
-                prompt_tmpl,
-                characters,
+                prompt_prefix,
+                prompt_suffix,
+                first_half_chapter_summary.character,
                 previous_summary + "\n" + first_half_chapter_summary.summary,
-                [second_half]
+                [second_half],
+                long_summary,
+                emit,
             )
-            ctx.write_event_to_stream(ProgressSummaryEvent(msg=second_half_chapter_summary.summary))
             final_summary = ChapterSummary(
                 character=second_half_chapter_summary.character,
                 summary=first_half_chapter_summary.summary + "\n" + second_half_chapter_summary.summary
             )
             return final_summary
 
+        chapter_summary = await self.parse_summary(raw_summary, characters, request)
+        if self.budget:
+            target = self.budget.target("short", estimate_tokens(chapter_text))
+            chapter_summary = ChapterSummary(
+                character=self.budget.fit_characters(chapter_summary.character, chapter_text),
+                summary=self.budget.fit("short", target, chapter_summary.summary),
+            )
+        if emit:
+            ctx.write_event_to_stream(ProgressSummaryEvent(msg=chapter_summary.summary))
+        return chapter_summary
+
+    async def request_summary(
+        self,
+        prompt_prefix: str,
+        prompt_suffix: str,
+        characters: str,
+        previous_summary: str,
+        chapter_text: str,
+        long_summary: str = "",
+        ctx: Context = None,
+        escalated: bool = False,
+    ) -> str:
+        """
+        One character + summary extraction call. Returns the raw completion text.
+        In streaming mode, and with a ctx to write to, the summary part is streamed as it arrives.
+        With a router, `escalated` sends the call to the router's escalation model.
+        """
+        with span("summary.prompt"):
+            prefix = prompt_prefix.format(long_summary=long_summary)
+            suffix = prompt_suffix.format(
+                characters = characters,
+                previous_summary = previous_summary,
+                chapter_text = chapter_text
+            )
+            llm_kwargs = {}
+            if self.budget:
+                target = self.budget.target("short", estimate_tokens(chapter_text))
+                suffix += self.budget.instruction(target)
+                llm_kwargs = self.budget.llm_kwargs(target, self.budget.short_extra_tokens(characters))
+            route = None
+            if self.router is not None:
+                route = self.router.route("short", estimate_tokens(len(prefix) + len(suffix)), escalated)
+            # A Gemini context cache belongs to one model, so it only serves calls on the main client
+            use_cache = self.prefix_cache is not None and (route is None or self.router.client(route) is self.llm)
+            cache_kwargs = await self.prefix_cache.get(prefix) if use_cache else None
+            if cache_kwargs is None:
+                messages = [
+                    ChatMessage(role="system", content=self.system_prompt),
+                    ChatMessage(role="user", content=prefix + suffix),
+                ]
+            else:
+                # The cached context already holds the system prompt and the prefix, only the tail is sent
+                messages = [ChatMessage(role="user", content=suffix)]
+                llm_kwargs = {"generation_config": {**llm_kwargs.get("generation_config", {}), **cache_kwargs["generation_config"]}}
+        if self.stream and ctx is not None:
+            # A duplicate stream would show up twice in the UI, so streamed calls are never hedged
+            return await self.call_stage("short", messages, route=route, escalated=escalated,
+                                         runner=self.streamer(ctx, "batch", "short"), stream=True, **llm_kwargs)
+        response = await self.call_stage("short", messages, route=route, escalated=escalated, **llm_kwargs)
+        return str(response.message.content or "")
+
+    async def call_stage(self, stage: str, messages: List[ChatMessage], method: str = "achat", route=None,
+                         escalated: bool = False, runner=None, hedge: bool = None, stream: bool = False, **llm_kwargs):
+        """
+        One rate-limited LLM call for a stage (short, repair, big or rewrite). Without a
+        router every stage uses self.llm and this instance's limiter. `runner(llm, limiter)`
+        may return the callable to use instead of `llm.<method>`, see `streamer`.
+        """
+        if self.router is None:
+            fn = runner(self.llm, self) if runner is not None else getattr(self.llm, method)
+            if "generation_config" in llm_kwargs:
+                llm_kwargs["generation_config"] = thinking_allowance(getattr(self.llm, "model", ""), llm_kwargs["generation_config"])
+            return await self._rate_limited_llm_call(fn, messages, hedge=hedge, stage=stage, stream=stream, **llm_kwargs)
+        if route is None:
+            route = self.router.route(stage, estimate_tokens(sum(len(m.content or "") for m in messages)), escalated)
+        return await self.router.call(route, stage, messages, method=method, runner=runner, hedge=hedge,
+                                      escalated=escalated, stream=stream, **llm_kwargs)
+
+    def streamer(self, ctx: Context, kind: str, stage: str):
+        return lambda llm, limiter: functools.partial(self.stream_chat, ctx, kind, stage, llm=llm, limiter=limiter)
+
+    async def stream_chat(self, ctx: Context, kind: str, stage: str, messages: List[ChatMessage], llm=None,
+                          limiter: TrackApi = None, **llm_kwargs) -> str:
+        """
+        Run one astream_chat call and write the text received so far to the event stream.
+        For chapter batches only the summary section is shown; the character list is
+        parsed with the rest once the stream completes. Returns the full completion text.
+        Chunks are read through the limiter's `timed_stream`, with deadlines from `stage`.
+        """
+        # Empty text first, so a retried call replaces what an earlier attempt showed
+        ctx.write_event_to_stream(SummaryDeltaEvent(kind=kind, text=""))
+        text = ""
+        shown = ""
+        stream = await (llm or self.llm).astream_chat(messages, **llm_kwargs)
+        async for chunk in (limiter or self).timed_stream(stream, stage):
+            text += chunk.delta or ""
+            visible = partial_summary(text) if kind == "batch" else self.clean_response(text)
+            if visible != shown:
+                shown = visible
+                ctx.write_event_to_stream(SummaryDeltaEvent(kind=kind, text=shown))
+        return text
+
+    async def parse_summary(self, raw_summary: str, characters: str, request) -> ChapterSummary:
+        """
+        Parse a completion locally. Layout problems get one short repair call that only
+        resends the completion; an empty completion gets the request repeated once.
+        With a router that has an escalation model, both retries repeat the request on it.
+        If the character list is missing the previous one is kept.
+        """
+        retried = repaired = False
+        while True:
+            try:
+                with span("summary.parse"):
+                    new_characters, summary = parse_summary_output(raw_summary)
+                break
+            except SummaryParseError as e:
+                self.failure_counts[e.kind] += 1
+                if e.kind == "empty" and not retried:
+                    retried = True
+                    raw_summary = await request(escalated=True)
+                    continue
+                if e.kind == "missing_summary" and not repaired:
+                    repaired = True
+                    if self.router is not None and self.router.escalate is not None:
+                        raw_summary = await request(escalated=True)
+                        continue
+                    response = await self.call_stage(
+                        "repair",
+                        [ChatMessage(role="user", content=REPAIR_SUMMARY_PROMPT_TMPL.format(response=raw_summary))]
+                    )
+                    raw_summary = str(response.message.content or "")
+                    continue
+                self.failure_counts["repair_failed"] += 1
+                if e.kind == "empty":
+                    raise
+                new_characters, summary = "", self.clean_response(raw_summary).strip()
+                break
+        if not new_characters:
+            self.failure_counts["missing_characters"] += 1
+            new_characters = characters
+        return ChapterSummary(character=new_characters, summary=summary)
+
     def clean_response(self, text: str) -> str:
         prefix = "assistant:"
         # Remove only if it starts with 'assistant:'
@@ -238,7 +718,7 @@ async def Summary(
     start_chapter = 0,
     max_chapters = 10,
     gather_chapters = 2,
-    summary_time_per_chapter = 20,
+    summary_time_per_chapter = None,
     big_summary_interval = 50,
     quota_per_minute = 15,
     name = "Cẩu Tại Sơ Thánh Ma Môn Làm Nhân Tài",
@@ -247,6 +727,16 @@ async def Summary(
     short_summary_list = [],
     long_summary_list = [],
     characters = "",
+    context_cache = False,
+    lookahead = 0,
+    bounded_memory = False,
+    stream = False,
+    routing = False,
+    batch_backend: BatchBackend = None,
+    dedup = False,
+    output_budget = False,
+    importance = False,
+    keep_ratio = None,
 ):
     if saved:
         os.makedirs(saved_path, exist_ok=True)
@@ -257,6 +747,43 @@ async def Summary(
     ]
     story_paths.sort()
     story_paths = story_paths[start_chapter:]
+    if batch_backend is not None:
+        # Offline mode: every batch goes into one batch job, no chaining and no workflow timeout
+        result = await BatchSummary(
+            story_paths,
+            batch_backend,
+            gather_chapters=gather_chapters,
+            big_summary_interval=big_summary_interval,
+            max_chapters=max_chapters,
+            name=name,
+            quota_per_minute=quota_per_minute,
+            pyramid=SummaryPyramid(saved_path, name) if saved else None,
+            chapter_offset=start_chapter,
+        ).run()
+        if saved:
+            with open(os.path.join(saved_path, name + "_summary.txt"), "w", encoding="utf-8") as f:
+                f.write(result.strip())
+        return result
+    chapter_spans = None
+    if dedup:
+        story_paths, report = dedup_chapters(story_paths)
+        print(format_report(report))
+        chapter_spans = report["spans"]
+    batches = None
+    if importance:
+        # Filler chapters count half towards a batch, so they are merged into fewer calls
+        batches, report = importance_batches(story_paths[:max_chapters], gather_chapters, big_summary_interval, characters)
+        print(format_importance_report(report))
+    if summary_time_per_chapter is None:
+        # Size the workflow timeout from a dry run of the chain against the quotas
+        plan = RunPlanner(story_paths, quota_per_minute=quota_per_minute).plan(gather_chapters, big_summary_interval, max_chapters, batches)
+        print("Plan: " + format_plan(plan))
+        timeout = plan["timeout"]
+    else:
+        timeout = (len(batches) if batches else max_chapters // gather_chapters) * summary_time_per_chapter
+    # Every batch, roll-up, character snapshot and the final summary are kept in the
+    # pyramid so later chapter-range lookups never need a new LLM run
+    pyramid = SummaryPyramid(saved_path, name) if saved else None
     w = BookSummary(
         story_paths, 
         big_summary_interval=big_summary_interval, 
@@ -266,8 +793,20 @@ async def Summary(
         initial_short_summaries=short_summary_list,
         initial_long_summaries=long_summary_list,
         initial_characters=characters,
-        timeout=max_chapters // gather_chapters * summary_time_per_chapter,
+        pyramid=pyramid,
+        chapter_offset=start_chapter,
+        lookahead=lookahead,
+        bounded_memory=bounded_memory,
+        stream=stream,
+        router=default_router() if routing else None,
+        chapter_spans=chapter_spans,
+        batches=batches,
+        compressor=ExtractiveCompressor(keep_ratio) if keep_ratio else None,
+        budget=OutputBudget() if output_budget else None,
+        timeout=timeout,
     )
+    if context_cache:
+        w.prefix_cache = GeminiPrefixCache(w.llm, w.system_prompt)
     
     handler = w.run()
     with open(os.path.join(saved_path, name + "_summary.txt"), "w", encoding="utf-8") as f:
@@ -278,7 +817,18 @@ async def Summary(
                 print(ev.msg)
                 print("-"*40)
 
-    result = await handler
+    try:
+        result = await handler
+    except QuotaExhausted as e:
+        # Save where the run stopped; jobs.py can continue it from this file after the reset
+        os.makedirs(saved_path, exist_ok=True)
+        checkpoint_path = os.path.join(saved_path, name + "_checkpoint.json")
+        with open(checkpoint_path, "w", encoding="utf-8") as f:
+            json.dump({**w.checkpoint(), "reset_at": e.reset_at}, f, ensure_ascii=False)
+        print(f"Daily quota used up, checkpoint saved to {checkpoint_path}")
+        raise
+    if w.prefix_cache:
+        print(f"Context cache: {w.prefix_cache.stats()}")
     
     if saved:
         with open(os.path.join(saved_path, name + "_summary.txt"), "w", encoding="utf-8") as f:
@@ -290,7 +840,7 @@ if __name__ == "__main__":
     gather_chapters = 10
     big_summary_interval = 100
     quota_per_minute = 15  # Adjust based on your API tier
-    summary_time_per_chapter = 20
+    summary_time_per_chapter = None  # None: timeout from the planner
     name = "Khủng Bố Sống Lại [C]"
     
 
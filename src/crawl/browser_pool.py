@@ -0,0 +1,199 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+
+from crawling import bns_crawler, new_driver
+
+def account_id(user_name: str, pass_word: str) -> str:
+    """
+    Id of a login. Drivers and saved cookies are keyed on the password too, so a
+    session that only knows a username cannot get that account's logged-in browser.
+    """
+    return hashlib.sha256(f"{user_name}\0{pass_word}".encode("utf-8")).hexdigest()[:16]
+
+class _Slot:
+    """A warm driver and the account (account_id) its cookies belong to"""
+    def __init__(self, driver, account: Optional[str]):
+        self.driver = driver
+        self.account = account
+        self.last_used = time.time()
+        self.cookies_loaded = False
+
+class BrowserPool:
+    """
+    Long-lived pool of warm Chrome drivers shared by crawl jobs.
+
+    `lease(url, user_name, pass_word)` hands out a bns_crawler bound to an idle driver,
+    preferring one already used by the same login, so a repeated crawl skips the
+    chromedriver install, the browser launch and usually the login. Cookies are
+    written, readable by the owner only, to `session_dir/<account_id>.json` when a
+    lease ends and are restored
+    into fresh drivers, so sessions survive app restarts. The session itself is
+    revalidated for free on the story page the crawler loads anyway (see
+    bns_crawler.logged_in); a driver that raised during a job is quit, not reused.
+    At most `size` drivers are alive; further leases wait for one to be released.
+    """
+    def __init__(self, size: int = 2, headless: bool = True, wait_s: int = 12,
+                 session_dir: str = "sessions", max_idle: float = 900):
+        self.size = size
+        self.headless = headless
+        self.wait_s = wait_s
+        self.session_dir = session_dir
+        self.max_idle = max_idle
+        self.idle: List[_Slot] = []
+        self.busy = 0
+        self.cond = threading.Condition()
+        self.stats = {"leases": 0, "warm": 0, "launched": 0, "cookie_restores": 0, "discarded": 0}
+        os.makedirs(session_dir, mode=0o700, exist_ok=True)
+
+    def _session_path(self, account: str) -> str:
+        return os.path.join(self.session_dir, f"{account}.json")
+
+    def _alive(self, driver) -> bool:
+        try:
+            driver.current_url
+            return True
+        except Exception:
+            return False
+
+    def _quit(self, slot: _Slot):
+        self.stats["discarded"] += 1
+        try:
+            slot.driver.quit()
+        except Exception:
+            pass
+
+    def _acquire(self, account: str) -> _Slot:
+        with self.cond:
+            while True:
+                now = time.time()
+                for slot in [s for s in self.idle if now - s.last_used > self.max_idle]:
+                    self.idle.remove(slot)
+                    self._quit(slot)
+                # same account first, then any idle driver, then a new one if there is room
+                slot = next((s for s in self.idle if s.account == account), None)
+                if slot is None and self.idle and len(self.idle) + self.busy >= self.size:
+                    slot = self.idle[0]
+                if slot is not None:
+                    self.idle.remove(slot)
+                    self.busy += 1
+                    break
+                if len(self.idle) + self.busy < self.size:
+                    self.busy += 1
+                    slot = None
+                    break
+                self.cond.wait()
+        if slot is not None and self._alive(slot.driver):
+            self.stats["warm"] += 1
+            if slot.account != account:
+                slot.driver.delete_all_cookies()
+                slot.account = account
+                slot.cookies_loaded = False
+            return slot
+        if slot is not None:
+            self._quit(slot)
+        try:
+            driver = new_driver(self.headless)
+        except Exception:
+            with self.cond:
+                self.busy -= 1
+                self.cond.notify()
+            raise
+        self.stats["launched"] += 1
+        return _Slot(driver, account)
+
+    def _restore_cookies(self, slot: _Slot, url: str):
+        path = self._session_path(slot.account)
+        if slot.cookies_loaded or not os.path.exists(path):
+            return
+        with open(path, "r", encoding="utf-8") as f:
+            cookies: List[Dict] = json.load(f)
+        # cookies can only be set for the domain of the current page
+        origin = "{0.scheme}://{0.netloc}/".format(urlparse(url))
+        slot.driver.get(origin)
+        now = time.time()
+        for cookie in cookies:
+            if cookie.get("expiry") and cookie["expiry"] < now:
+                continue
+            cookie.pop("sameSite", None)
+            try:
+                slot.driver.add_cookie(cookie)
+            except Exception:
+                pass
+        slot.cookies_loaded = True
+        self.stats["cookie_restores"] += 1
+
+    def _save_cookies(self, slot: _Slot):
+        path = self._session_path(slot.account)
+        tmp = path + ".tmp"
+        # Session cookies log in as the account: owner-only, from creation on
+        with open(os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w", encoding="utf-8") as f:
+            json.dump(slot.driver.get_cookies(), f)
+        os.replace(tmp, path)
+        slot.cookies_loaded = True
+
+    def _release(self, slot: _Slot, healthy: bool):
+        if healthy:
+            try:
+                self._save_cookies(slot)
+            except Exception:
+                healthy = False
+        with self.cond:
+            self.busy -= 1
+            if healthy:
+                slot.last_used = time.time()
+                self.idle.append(slot)
+            else:
+                self._quit(slot)
+            self.cond.notify()
+
+    @contextmanager
+    def lease(self, url: str, user_name: str, pass_word: str, out_dir: str, **crawler_kwargs):
+        """Yield a bns_crawler for `url` running on a warm driver logged in with these credentials"""
+        slot = self._acquire(account_id(user_name, pass_word))
+        self.stats["leases"] += 1
+        healthy = False
+        try:
+            self._restore_cookies(slot, url)
+            yield bns_crawler(url, out_dir, headless=self.headless, wait_s=self.wait_s,
+                              driver=slot.driver, **crawler_kwargs)
+            healthy = True
+        finally:
+            self._release(slot, healthy)
+
+    def warm_up(self, n: Optional[int] = None):
+        """Launch drivers ahead of the first crawl"""
+        for _ in range(min(n or self.size, self.size - len(self.idle) - self.busy)):
+            self.stats["launched"] += 1
+            with self.cond:
+                self.idle.append(_Slot(new_driver(self.headless), None))
+                self.cond.notify()
+
+    def close(self):
+        with self.cond:
+            slots, self.idle = self.idle, []
+        for slot in slots:
+            self._quit(slot)
+
+#Example
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+    user_name = os.getenv("user_name")
+    pass_word = os.getenv("pass_word")
+    url = 'https://bnsach.com/reader/cau-tai-so-thanh-ma-mon-lam-nhan-tai-convert'
+    pool = BrowserPool(size=1)
+    try:
+        for run in range(2):
+            start = time.perf_counter()
+            with pool.lease(url, user_name, pass_word, "story", n_chapters=5) as crawler:
+                chapters = crawler.extract_chapter_list(user_name, pass_word)
+            print(f"Run {run + 1}: {len(chapters)} chapters listed in {time.perf_counter() - start:.1f}s")
+        print(pool.stats)
+    finally:
+        pool.close()
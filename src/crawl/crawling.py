@@ -3,17 +3,92 @@ import re
 import sys
 import time
 from pathlib import Path
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 
 from selenium import webdriver
 from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from webdriver_manager.chrome import ChromeDriverManager
 from selenium.webdriver.common.action_chains import ActionChains
-from urllib.parse import urljoin
-import random
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from politeness import PolitenessController
+from profiling import span
+
+# Collects (index, title, href) for every TOC link in one round trip instead of several
+# WebDriver calls per chapter. arguments[0]/[1] are the 1-based start/end chapter (end may be null).
+# Also returns the total number of chapters in the TOC.
+TOC_SCRIPT = """
+const start = arguments[0], end = arguments[1];
+const links = document.querySelectorAll("#mucluc-list a.chuong-link");
+const last = end === null ? links.length : Math.min(end, links.length);
+const out = [];
+for (let i = Math.max(start, 1); i <= last; i++) {
+    const a = links[i - 1];
+    const nameEl = a.querySelector(".chuong-name");
+    const title = ((nameEl || a).innerText || (nameEl || a).textContent || "").trim();
+    let href = a.getAttribute("href") || a.getAttribute("data-href") || "";
+    if (href && href !== "about:blank") {
+        href = new URL(href, document.baseURI).href;
+    }
+    out.push([i, title, href]);
+}
+return {total: links.length, chapters: out};
+"""
+
+LOGIN_BUTTON_SELECTOR = "a.bg-blue-600"
+
+# What the browser knows about the chapter response, in one round trip: the HTTP status of the
+# last navigation (0 when Chrome does not report it), whether the page finished loading,
+# whether it is the login page (a visible password field or a login path) and whether
+# #noi-dung has any text.
+RESPONSE_SCRIPT = """
+const nav = performance.getEntriesByType("navigation")[0];
+const content = document.getElementById("noi-dung");
+const password = document.querySelector("input[name='password']");
+return {
+    status: nav && nav.responseStatus ? nav.responseStatus : 0,
+    ready: document.readyState === "complete",
+    login: !!(password && password.offsetParent) || /\\/(login|dang-nhap)\\b/i.test(location.pathname),
+    content: !!(content && content.textContent.trim()),
+};
+"""
+
+# Statuses the site answers with when it throttles or refuses a session
+BLOCK_STATUSES = {401, 403, 429, 503}
+
+def chrome_options(headless: bool = True) -> webdriver.ChromeOptions:
+    opts = webdriver.ChromeOptions()
+
+    # Check for Docker/container environment Chrome options
+    chrome_options = os.getenv('CHROME_OPTIONS', '')
+    if chrome_options:
+        for option in chrome_options.split():
+            opts.add_argument(option)
+    else:
+        # Default options
+        if headless:
+            opts.add_argument("--headless=new")
+        opts.add_argument("--no-sandbox")
+        opts.add_argument("--disable-dev-shm-usage")
+        opts.add_argument("--disable-gpu")
+        opts.add_argument("--window-size=1280,1800")
+        opts.add_argument("--disable-extensions")
+        opts.add_argument("--disable-plugins")
+        opts.add_argument("--disable-images")  # Speed up crawling
+    return opts
+
+_driver_path = None
+
+def new_driver(headless: bool = True) -> webdriver.Chrome:
+    """Launch Chrome. The chromedriver lookup/download only runs once per process."""
+    global _driver_path
+    if _driver_path is None:
+        from webdriver_manager.chrome import ChromeDriverManager
+        _driver_path = ChromeDriverManager().install()
+    return webdriver.Chrome(service=Service(_driver_path), options=chrome_options(headless))
 
 class bns_crawler:
     def __init__(
@@ -23,36 +98,34 @@ class bns_crawler:
             n_chapters: int=100,
             headless: bool=True,
             wait_s: int=12,
+            start_chapter: int=1,
+            end_chapter: Optional[int]=None,
+            driver: Optional[webdriver.Chrome]=None,
+            politeness: Optional[PolitenessController]=None,
+            max_attempts: int=3,
     ) -> None:
+        """
+        Chapters start_chapter..end_chapter (1-based, inclusive) are crawled. Without
+        end_chapter the range is n_chapters long. A warm `driver` (e.g. leased from
+        browser_pool.BrowserPool) skips the browser launch and, if its session is
+        still logged in, the login. Chapter requests are paced by `politeness`
+        (an AIMD PolitenessController by default) and retried up to `max_attempts` times.
+        """
         self.url = url
         self.out_dir = out_dir
         self.n_chapter = n_chapters
+        self.start_chapter = max(1, start_chapter)
+        self.end_chapter = end_chapter if end_chapter is not None else self.start_chapter + n_chapters - 1
+        if self.end_chapter < self.start_chapter:
+            raise ValueError(f"end_chapter ({self.end_chapter}) is before start_chapter ({self.start_chapter})")
         self.headless = headless
         self.wait_s = wait_s
 
-        opts = webdriver.ChromeOptions()
-        
-        # Check for Docker/container environment Chrome options
-        chrome_options = os.getenv('CHROME_OPTIONS', '')
-        if chrome_options:
-            for option in chrome_options.split():
-                opts.add_argument(option)
-        else:
-            # Default options
-            if headless:
-                opts.add_argument("--headless=new")
-            opts.add_argument("--no-sandbox")
-            opts.add_argument("--disable-dev-shm-usage")
-            opts.add_argument("--disable-gpu")
-            opts.add_argument("--window-size=1280,1800")
-            opts.add_argument("--disable-extensions")
-            opts.add_argument("--disable-plugins")
-            opts.add_argument("--disable-images")  # Speed up crawling
-
-        self.driver = webdriver.Chrome(
-            service=Service(ChromeDriverManager().install()), options=opts
-        )
+        self.driver = driver if driver is not None else new_driver(headless)
         self.wait = WebDriverWait(self.driver, wait_s)
+        self.politeness = politeness or PolitenessController()
+        self.max_attempts = max_attempts
+        self.total_chapters = None
 
     def _ready(self):
         self.wait.until(lambda d: d.execute_script("return document.readyState") == "complete")
@@ -60,12 +133,16 @@ class bns_crawler:
     def _visible(self, by, sel):
         return self.wait.until(EC.visibility_of_element_located((by, sel)))
 
-    def extract_chapter_list(self, user_name, pass_word):
-        #Login
-        self.driver.get(self.url)
-        self._ready()
+    def logged_in(self) -> bool:
+        """Cheap session check on the current page: the login button only shows when logged out"""
+        return not self.driver.execute_script(f"return !!document.querySelector('{LOGIN_BUTTON_SELECTOR}');")
+
+    def login(self, user_name, pass_word):
+        with span("crawl.login"):
+            self._login(user_name, pass_word)
 
-        login_bt = self.driver.find_element(By.CSS_SELECTOR, "a.bg-blue-600")
+    def _login(self, user_name, pass_word):
+        login_bt = self.driver.find_element(By.CSS_SELECTOR, LOGIN_BUTTON_SELECTOR)
         login_bt.click()
 
         username_input = self.wait.until(EC.presence_of_element_located((By.NAME, "login")))
@@ -82,6 +159,39 @@ class bns_crawler:
         #login_btn_1 = self.driver.find_element(By.XPATH, "//span[@class='button-text' and text()='Đăng nhập']")
         #login_btn_1.click()
 
+    def _blocked(self) -> bool:
+        """
+        Whether the last chapter response is a block: a throttling status, the login page
+        or a loaded page without `#noi-dung` text. Other redirects (a canonical URL, a new
+        slug) are not blocks as long as the chapter text is there.
+        """
+        try:
+            response = self.driver.execute_script(RESPONSE_SCRIPT)
+        except Exception:
+            return False
+        if response["status"] in BLOCK_STATUSES:
+            return True
+        if not response["ready"]:
+            return False  # still loading: a slow response, not a block
+        return response["login"] or not response["content"]
+
+    def _relogin(self, user_name, pass_word):
+        self.politeness.wait()
+        try:
+            self.driver.get(self.url)
+            self._ready()
+            if not self.logged_in():
+                self.login(user_name, pass_word)
+        except Exception as e:
+            print(f"Đăng nhập lại thất bại: {e}")
+
+    def extract_chapter_list(self, user_name, pass_word):
+        #Login
+        self.driver.get(self.url)
+        self._ready()
+        if not self.logged_in():
+            self.login(user_name, pass_word)
+
         #Muc luc day du
         full_chapters = self.wait.until(EC.presence_of_element_located((By.ID, "chuong-list-more")))
         self.driver.execute_script("arguments[0].scrollIntoView({block: 'center'});", full_chapters)
@@ -94,64 +204,70 @@ class bns_crawler:
         all_button.click()
 
         #Trich xuat duong dan cac chuong
-        chap_elems = self.wait.until(EC.presence_of_all_elements_located((By.CSS_SELECTOR, "#mucluc-list a.chuong-link")))
-
-        chapters = []
-        for i, a in enumerate(chap_elems, start=1):
-            try:
-                title = a.find_element(By.CSS_SELECTOR, ".chuong-name").text.strip()
-            except Exception:
-                title = a.text.strip()
-
-            href = a.get_attribute("href") or a.get_attribute("data-href") or ""
-            if href and href != "about:blank":
-                href = urljoin(self.driver.current_url, href)
-
-            chapters.append((i, title, href))
-
-        if len(chapters) > self.n_chapter:    
-            chapters = chapters[:self.n_chapter]
+        self.wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, "#mucluc-list a.chuong-link")))
+        toc = self.driver.execute_script(TOC_SCRIPT, self.start_chapter, self.end_chapter)
+        self.total_chapters = int(toc["total"])
+        chapters = [(int(i), title, href) for i, title, href in toc["chapters"]]
 
         return chapters
     
     def extract_content(self, user_name, pass_word):
-        chapters = self.extract_chapter_list(user_name, pass_word)
+        with span("crawl.toc"):
+            chapters = self.extract_chapter_list(user_name, pass_word)
         self.driver.get(self.url)
         name = self.driver.find_element(By.ID, "truyen-title").text
         out_dir = os.path.join(self.out_dir, name)
         Path(out_dir).mkdir(parents=True, exist_ok=True)
 
         for i, title, link in chapters:
-            time.sleep(random.uniform(0.8,1.6))
-
-            if i % 200 == 0:
-                time.sleep(random.randint(10, 30))
-    
             print(f"Đang tải chương {i}: {title} - {link}")
-            try:
-                self.driver.get(link)
-                self._ready()
+            for attempt in range(self.max_attempts):
+                with span("crawl.politeness_wait"):
+                    self.politeness.wait()
+                start = time.monotonic()
+                try:
+                    with span("crawl.navigate", chapter=i):
+                        self.driver.get(link)
+                    with span("crawl.ready", chapter=i):
+                        self._ready()
 
-                html = self.driver.execute_script("return document.documentElement.outerHTML;")
+                    with span("crawl.extract", chapter=i):
+                        content_elem = self.wait.until(
+                            EC.presence_of_element_located((By.ID, "noi-dung"))
+                        )
+                        chap_text = content_elem.text.strip()
+                except Exception as e:
+                    blocked = self._blocked()
+                    self.politeness.record(time.monotonic() - start, ok=False, blocked=blocked)
+                    print(f"Lỗi ở chương {i} ({link}): {e}")
+                    if blocked:
+                        self._relogin(user_name, pass_word)
+                    continue
+                latency = time.monotonic() - start
 
-                content_elem = self.wait.until(
-                    EC.presence_of_element_located((By.ID, "noi-dung"))
-                )
-                chap_text = content_elem.text.strip()
+                # bị đẩy về trang đăng nhập hoặc nội dung trống: server đang chặn
+                if not chap_text or self._blocked():
+                    self.politeness.record(latency, blocked=True)
+                    print(f"Chương {i} bị chặn, chờ {self.politeness.block_cooldown:.0f}s rồi thử lại")
+                    self._relogin(user_name, pass_word)
+                    continue
+                self.politeness.record(latency)
 
                 # lưu ra file txt
                 safe_title = re.sub(r"[\\/:*?\"<>|]+", " ", title)[:80]
                 fname = f"{i:03d}_{safe_title}.txt"
                 fpath = Path(out_dir) / fname
 
-                with open(fpath, "w", encoding="utf-8") as f:
+                with span("crawl.write", chapter=i), open(fpath, "w", encoding="utf-8") as f:
                     f.write(title + "\n\n")
                     f.write(chap_text + "\n")
 
                 print(f"Saved {fpath.name}")
-            except Exception as e:
-                print(f"Lỗi ở chương {i} ({link}): {e}") 
-        
+                break
+            else:
+                print(f"Bỏ qua chương {i} sau {self.max_attempts} lần thử")
+
+        print(f"Politeness: {self.politeness.stats}, delay {self.politeness.delay:.2f}s")
         return name
 
 #Example
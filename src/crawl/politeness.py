@@ -0,0 +1,271 @@
+import sys
+import time
+import random
+import argparse
+from collections import deque
+from typing import Callable, Optional
+
+class PolitenessController:
+    """
+    AIMD pacing for chapter requests.
+
+    Each `wait()` sleeps so that consecutive requests are at least `delay` seconds apart,
+    with ±`jitter` randomization. `record()` adapts the delay to what the last request saw:
+    - fast success: the request rate 1/delay grows by `step` requests per second, or by
+      `probe_step` while the delay is within 20% of the one that last caused a backoff or
+      the latency EWMA is above `warn_factor` x baseline
+    - slow pages (latency EWMA above `slow_factor` x baseline for `patience` requests in a
+      row): delay *= `slow_backoff`
+    - errors: delay *= `error_backoff` once the error rate over the last `window` requests is
+      above `max_error_rate`; a lone error at the site's usual rate changes nothing
+    - block (login redirect, empty content): delay *= `block_backoff` and a `block_cooldown` pause
+    The baseline is the mean latency of the first requests, then a slow average
+    (`baseline_smoothing`) of the latency while the site keeps up. Backoffs happen at most
+    once per `hold` seconds, since the server needs time to feel the lower rate, and the
+    delay then stays at least `margin` above the one that caused it for `floor_ttl` seconds.
+    A backoff restarts the latency average, so latencies from the old rate cannot cause
+    another one.
+    The delay stays within [min_delay, max_delay] and does not shrink while the error rate
+    is above `max_error_rate`.
+    `clock` and `sleep` can be replaced for simulation.
+    """
+    def __init__(
+        self,
+        min_delay: float = 0.3,
+        max_delay: float = 60.0,
+        initial_delay: float = 1.5,
+        step: float = 0.008,
+        slow_factor: float = 1.15,
+        slow_backoff: float = 2.5,
+        warn_factor: float = 1.05,
+        error_backoff: float = 2.0,
+        block_backoff: float = 4.0,
+        block_cooldown: float = 60.0,
+        hold: float = 15.0,
+        probe_step: float = 0.001,
+        margin: float = 0.3,
+        floor_ttl: float = 900.0,
+        smoothing: float = 0.2,
+        baseline_smoothing: float = 0.02,
+        patience: int = 2,
+        max_error_rate: float = 0.02,
+        window: int = 50,
+        jitter: float = 0.2,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+        rng: Optional[random.Random] = None,
+    ):
+        if not 0 < min_delay <= max_delay:
+            raise ValueError("Need 0 < min_delay <= max_delay")
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.delay = min(max(initial_delay, min_delay), max_delay)
+        self.step = step
+        self.slow_factor = slow_factor
+        self.slow_backoff = slow_backoff
+        self.warn_factor = warn_factor
+        self.error_backoff = error_backoff
+        self.block_backoff = block_backoff
+        self.block_cooldown = block_cooldown
+        self.hold = hold
+        self.last_backoff = None
+        self.congestion_delay = None
+        self.probe_step = probe_step
+        self.margin = margin
+        self.floor_ttl = floor_ttl
+        self.floor = None
+        self.floor_until = 0.0
+        self.smoothing = smoothing
+        self.baseline_smoothing = baseline_smoothing
+        self.patience = patience
+        self.slow_streak = 0
+        self.samples = 0
+        self.max_error_rate = max_error_rate
+        self.outcomes = deque(maxlen=window)
+        self.jitter = jitter
+        self.clock = clock
+        self.sleep = sleep
+        self.rng = rng or random.Random()
+        self.latency_ewma = None
+        self.baseline = None
+        self.last_request = None
+        self.pause_until = 0.0
+        self.stats = {"requests": 0, "errors": 0, "blocks": 0, "slept": 0.0}
+
+    def wait(self):
+        """Sleep until the next request is allowed"""
+        now = self.clock()
+        ready = self.pause_until
+        if self.last_request is not None:
+            ready = max(ready, self.last_request + self.delay * (1 + self.rng.uniform(-self.jitter, self.jitter)))
+        if ready > now:
+            self.sleep(ready - now)
+            self.stats["slept"] += ready - now
+        self.last_request = self.clock()
+
+    def error_rate(self) -> float:
+        return sum(self.outcomes) / len(self.outcomes) if self.outcomes else 0.0
+
+    def _grow(self, factor: float, force: bool = False):
+        now = self.clock()
+        if not force and self.last_backoff is not None and now - self.last_backoff < self.hold:
+            return
+        self.congestion_delay = self.delay
+        # The server struggled at this delay: stay `margin` above it for `floor_ttl` seconds.
+        # Signals while a floor holds come from above it, often from noise, so they do not move it.
+        if now >= self.floor_until:
+            self.floor = min(self.max_delay, self.delay * (1 + self.margin))
+            self.floor_until = now + self.floor_ttl
+        self.delay = min(self.max_delay, self.delay * factor)
+        self.last_backoff = now
+        # Latencies seen at the old rate must not count towards the next backoff
+        self.latency_ewma = None
+        self.slow_streak = 0
+
+    def record(self, latency: float, ok: bool = True, blocked: bool = False):
+        """Feed back the outcome of the request made after the last wait()"""
+        self.stats["requests"] += 1
+        self.outcomes.append(0 if ok and not blocked else 1)
+        if blocked:
+            self.stats["blocks"] += 1
+            self._grow(self.block_backoff, force=True)
+            self.pause_until = self.clock() + self.block_cooldown
+            return
+        if not ok:
+            self.stats["errors"] += 1
+            # A lone error is often just noise; only a raised error rate marks congestion
+            if self.error_rate() > self.max_error_rate:
+                self._grow(self.error_backoff)
+            return
+
+        self.latency_ewma = latency if self.latency_ewma is None else (1 - self.smoothing) * self.latency_ewma + self.smoothing * latency
+        self.samples += 1
+        if self.baseline is None:
+            self.baseline = latency
+        above = self.latency_ewma > self.slow_factor * self.baseline
+        self.slow_streak = self.slow_streak + 1 if above else 0
+        if not above:
+            # baseline is a much slower average of the latency while the server keeps up
+            self.baseline += max(self.baseline_smoothing, 1 / self.samples) * (latency - self.baseline)
+        if self.slow_streak >= self.patience:
+            self._grow(self.slow_backoff)
+        elif self.error_rate() <= self.max_error_rate:
+            # close to the rate that last caused trouble, probe upwards slowly
+            near_congestion = (self.congestion_delay is not None and self.delay < 1.2 * self.congestion_delay) \
+                or self.latency_ewma > self.warn_factor * self.baseline
+            step = self.probe_step if near_congestion else self.step
+            floor = self.floor if self.floor is not None and self.clock() < self.floor_until else self.min_delay
+            self.delay = max(floor, 1 / (1 / self.delay + step))
+
+class SimulatedServer:
+    """
+    Site with a sustainable request rate of `capacity` per second. Above it, latency and
+    error probability grow with the overload; a rate above `block_ratio` x capacity over
+    the last `block_window` seconds gets the client blocked for `block_for` seconds.
+    """
+    def __init__(self, capacity: float, base_latency: float = 0.4, block_ratio: float = 1.5,
+                 block_window: float = 30.0, block_for: float = 120.0, seed: int = 0):
+        self.capacity = capacity
+        self.base_latency = base_latency
+        self.block_ratio = block_ratio
+        self.block_window = block_window
+        self.block_for = block_for
+        self.rng = random.Random(seed)
+        self.history = deque()
+        self.blocked_until = 0.0
+
+    def request(self, now: float):
+        """Returns (latency, ok, blocked)"""
+        self.history.append(now)
+        while self.history and self.history[0] < now - self.block_window:
+            self.history.popleft()
+        rate = len(self.history) / self.block_window
+        if now < self.blocked_until:
+            return 0.2, True, True
+        if rate > self.block_ratio * self.capacity:
+            self.blocked_until = now + self.block_for
+            return 0.2, True, True
+        overload = max(0.0, rate / self.capacity - 1)
+        latency = self.base_latency * (1 + 4 * overload) * self.rng.uniform(0.8, 1.25)
+        ok = self.rng.random() >= 0.005 + 0.3 * overload
+        return latency, ok, False
+
+def simulate(server: SimulatedServer, pages: int, controller: Optional[PolitenessController] = None,
+             seed: int = 0, max_attempts: int = 4):
+    """
+    Crawl `pages` chapters against the simulated server on a virtual clock. Without a
+    controller the fixed schedule of bns_crawler.extract_content before this module is used.
+    """
+    clock = [0.0]
+    rng = random.Random(seed)
+
+    def sleep(s):
+        clock[0] += s
+
+    if controller is not None:
+        controller.clock = lambda: clock[0]
+        controller.sleep = sleep
+        controller.rng = rng
+    requests = failures = fetched = 0
+    for i in range(1, pages + 1):
+        if controller is None:
+            sleep(rng.uniform(0.8, 1.6))
+            if i % 200 == 0:
+                sleep(rng.randint(10, 30))
+        for _ in range(max_attempts):
+            if controller is not None:
+                controller.wait()
+            latency, ok, blocked = server.request(clock[0])
+            clock[0] += latency
+            requests += 1
+            if controller is not None:
+                controller.record(latency, ok=ok, blocked=blocked)
+            if ok and not blocked:
+                fetched += 1
+                break
+            failures += 1
+            if controller is None:
+                break  # the fixed schedule logs the error and moves on
+    return {
+        "seconds": clock[0],
+        "fetched": fetched,
+        "requests": requests,
+        "error_rate": failures / requests if requests else 0.0,
+    }
+
+# Site profiles of the simulation: (name, sustainable requests per second, AIMD time bound in minutes)
+PROFILES = [("healthy", 3.0, 9.0), ("normal", 0.8, 18.0), ("slow", 0.4, 45.0)]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fixed sleeps versus AIMD pacing on a simulated site; exits with 1 on a regression")
+    parser.add_argument("--pages", type=int, default=600)
+    parser.add_argument("--runs", type=int, default=8, help="seeds averaged per row")
+    parser.add_argument("--max-lost", type=float, default=0.5, help="pages AIMD may lose per run, on average")
+    args = parser.parse_args()
+
+    print(f"{'server':<8} {'schedule':<8} {'minutes':>8} {'lost':>6} {'error rate':>11}")
+    checks = []
+    for name, capacity, max_minutes in PROFILES:
+        rows = {}
+        for schedule in ("fixed", "aimd"):
+            minutes = lost = failed = requests = 0
+            for seed in range(args.runs):
+                controller = PolitenessController() if schedule == "aimd" else None
+                result = simulate(SimulatedServer(capacity, seed=seed), args.pages, controller, seed=seed)
+                minutes += result["seconds"] / 60 / args.runs
+                lost += (args.pages - result["fetched"]) / args.runs
+                failed += result["requests"] * result["error_rate"]
+                requests += result["requests"]
+            rows[schedule] = (minutes, lost, failed / requests)
+            print(f"{name:<8} {schedule:<8} {minutes:>8.1f} {lost:>6.1f} {failed / requests:>11.2%}")
+        minutes, lost, error_rate = rows["aimd"]
+        # Time bounds are for the default 600 pages
+        bound = max_minutes * args.pages / 600
+        checks += [
+            (f"{name}: aimd loses at most {args.max_lost} pages", lost <= args.max_lost),
+            (f"{name}: aimd within {bound:.0f} minutes", minutes <= bound),
+            (f"{name}: aimd error rate within max_error_rate", error_rate <= PolitenessController().max_error_rate),
+        ]
+    for label, ok in checks:
+        print(f"{'ok  ' if ok else 'FAIL'} {label}")
+    sys.exit(0 if all(ok for _, ok in checks) else 1)
@@ -0,0 +1,279 @@
+import os
+import re
+import json
+import time
+import shutil
+import hashlib
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+from urllib.parse import urlparse
+
+try:
+    import fcntl
+except ImportError:  # Windows: only threads of this process are serialized
+    fcntl = None
+
+CHAPTER_FILE_RE = re.compile(r"^(\d+)_(.*)\.txt$")
+
+def normalize_url(url: str) -> str:
+    """Scheme and host lowercased, "www." dropped, query/fragment and trailing slash removed"""
+    parsed = urlparse(url.strip())
+    host = parsed.netloc.lower()
+    if host.startswith("www."):
+        host = host[4:]
+    path = re.sub(r"/+", "/", parsed.path).rstrip("/")
+    return f"{(parsed.scheme or 'https').lower()}://{host}{path}"
+
+def story_key(url: str) -> str:
+    return hashlib.sha256(normalize_url(url).encode("utf-8")).hexdigest()[:16]
+
+def pid_alive(pid: int) -> bool:
+    if os.name == "nt":  # os.kill would terminate the process; rely on the heartbeat alone
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+class StoryCache:
+    """
+    Host-wide cache of crawled stories shared by every Streamlit session.
+
+    Layout under `root`:
+        index.json                  story key -> url, name, total, chapters {index: {hash, file, size}}, refs, last_used
+        objects/ab/<sha256>.txt     chapter files, stored once per distinct content
+        stories/<key>/00001_x.txt   per-story view, hard links to the objects (copies where links fail)
+
+    Stories are keyed by normalized URL. `acquire`/`release` count the sessions using a
+    story, and `lookup` can take the reference under the same lock as the lookup; `evict`
+    removes the least recently used unreferenced stories until the objects fit in
+    `max_bytes`. A reference records the holder's pid and a heartbeat time: `acquire`
+    refreshes it every `ref_ttl`/3 seconds until `release` or until `alive()` is False.
+    References whose process is gone or whose heartbeat is older than `ref_ttl` seconds
+    are treated as leaked by a crashed session. Index updates take an exclusive fcntl
+    lock on `root/.lock`, so several app processes can share the cache.
+    """
+    def __init__(self, root: Optional[str] = None, max_bytes: int = 2 * 1024 ** 3, ref_ttl: float = 600):
+        self.root = root or os.getenv("STORY_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "summary-story"))
+        self.max_bytes = max_bytes
+        self.ref_ttl = ref_ttl
+        self.index_path = os.path.join(self.root, "index.json")
+        self.lock_path = os.path.join(self.root, ".lock")
+        self._thread_lock = threading.Lock()
+        self._heartbeats: Dict[tuple, threading.Event] = {}
+        os.makedirs(os.path.join(self.root, "objects"), exist_ok=True)
+        os.makedirs(os.path.join(self.root, "stories"), exist_ok=True)
+
+    @contextmanager
+    def _locked(self):
+        with self._thread_lock:
+            with open(self.lock_path, "a") as lock_file:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _load(self) -> Dict:
+        if not os.path.exists(self.index_path):
+            return {}
+        with open(self.index_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _save(self, index: Dict):
+        tmp = self.index_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(index, f, ensure_ascii=False)
+        os.replace(tmp, self.index_path)
+
+    def _object_path(self, digest: str) -> str:
+        return os.path.join(self.root, "objects", digest[:2], f"{digest}.txt")
+
+    def story_dir(self, url: str) -> str:
+        return os.path.join(self.root, "stories", story_key(url))
+
+    @staticmethod
+    def _ref() -> Dict:
+        return {"pid": os.getpid(), "beat": time.time()}
+
+    def _live_refs(self, entry: Dict) -> Dict[str, Dict]:
+        now = time.time()
+        live = {}
+        for holder, ref in entry.get("refs", {}).items():
+            if not isinstance(ref, dict):  # written before refs carried a pid
+                continue
+            if now - ref["beat"] < self.ref_ttl and pid_alive(ref["pid"]):
+                live[holder] = ref
+        return live
+
+    def _take_ref(self, entry: Dict, holder: str):
+        entry["refs"] = self._live_refs(entry)
+        entry["refs"][holder] = self._ref()
+
+    def _clip(self, entry: Optional[Dict], end: int) -> int:
+        """Chapters past the end of the story's table of contents can never be cached"""
+        if entry and entry.get("total"):
+            return min(end, entry["total"])
+        return end
+
+    def missing(self, url: str, start: int, end: int) -> List[int]:
+        """Chapter indexes in start..end (inclusive) that are not cached"""
+        with self._locked():
+            entry = self._load().get(story_key(url))
+        chapters = entry["chapters"] if entry else {}
+        return [i for i in range(start, self._clip(entry, end) + 1) if str(i) not in chapters]
+
+    def lookup(self, url: str, start: int, end: int, partial: bool = False, holder: Optional[str] = None):
+        """
+        (story name, chapter paths in order) if start..end are all cached, else None.
+        With partial=True the cached subset is returned instead. With a `holder` the story
+        is referenced before the lock is released, so it cannot be evicted in between.
+        """
+        key = story_key(url)
+        with self._locked():
+            index = self._load()
+            entry = index.get(key)
+            if entry is None:
+                return None
+            paths = []
+            for i in range(start, self._clip(entry, end) + 1):
+                chapter = entry["chapters"].get(str(i))
+                path = os.path.join(self.story_dir(url), chapter["file"]) if chapter else None
+                if path is None or not os.path.exists(path):
+                    if partial:
+                        continue
+                    return None
+                paths.append(path)
+            if not paths:
+                return None
+            entry["last_used"] = time.time()
+            if holder is not None:
+                self._take_ref(entry, holder)
+            self._save(index)
+        return entry["name"], paths
+
+    def ingest(self, url: str, name: str, src_dir: str, total: Optional[int] = None) -> int:
+        """
+        Move the chapter files written by bns_crawler ("<index>_<title>.txt") from src_dir
+        into the cache. `total` is the chapter count of the story's TOC, if known.
+        Returns the number of chapters added or changed.
+        """
+        key = story_key(url)
+        dst_dir = self.story_dir(url)
+        os.makedirs(dst_dir, exist_ok=True)
+        changed = 0
+        with self._locked():
+            index = self._load()
+            entry = index.setdefault(key, {"url": normalize_url(url), "name": name, "chapters": {}, "refs": {}})
+            entry["name"] = name
+            if total:
+                entry["total"] = total
+            for fname in sorted(os.listdir(src_dir)):
+                match = CHAPTER_FILE_RE.match(fname)
+                if not match:
+                    continue
+                i = int(match.group(1))
+                with open(os.path.join(src_dir, fname), "rb") as f:
+                    data = f.read()
+                digest = hashlib.sha256(data).hexdigest()
+                old = entry["chapters"].get(str(i))
+                if old is not None and old["hash"] == digest:
+                    continue
+                obj = self._object_path(digest)
+                if not os.path.exists(obj):
+                    os.makedirs(os.path.dirname(obj), exist_ok=True)
+                    with open(obj + ".tmp", "wb") as f:
+                        f.write(data)
+                    os.replace(obj + ".tmp", obj)
+                # zero-padded so that sorting the directory keeps chapter order past 999
+                target = f"{i:05d}_{match.group(2)}.txt"
+                if old is not None and os.path.exists(os.path.join(dst_dir, old["file"])):
+                    os.remove(os.path.join(dst_dir, old["file"]))
+                try:
+                    os.link(obj, os.path.join(dst_dir, target))
+                except OSError:
+                    shutil.copyfile(obj, os.path.join(dst_dir, target))
+                entry["chapters"][str(i)] = {"hash": digest, "file": target, "size": len(data)}
+                changed += 1
+            entry["last_used"] = time.time()
+            self._save(index)
+        shutil.rmtree(src_dir, ignore_errors=True)
+        return changed
+
+    def acquire(self, url: str, holder: str, alive: Optional[Callable[[], bool]] = None):
+        """Reference the story and keep the reference fresh until release() or until alive() is False"""
+        key = story_key(url)
+        with self._locked():
+            index = self._load()
+            entry = index.get(key)
+            if entry is None:
+                return
+            self._take_ref(entry, holder)
+            self._save(index)
+        self._stop_heartbeat(key, holder)
+        stop = threading.Event()
+        self._heartbeats[(key, holder)] = stop
+        threading.Thread(target=self._heartbeat, args=(key, holder, stop, alive), daemon=True).start()
+
+    def _heartbeat(self, key: str, holder: str, stop: threading.Event, alive: Optional[Callable[[], bool]]):
+        while not stop.wait(self.ref_ttl / 3):
+            if alive is not None and not alive():
+                return
+            with self._locked():
+                index = self._load()
+                entry = index.get(key)
+                if entry is None or holder not in entry.get("refs", {}):
+                    return
+                entry["refs"][holder] = self._ref()
+                self._save(index)
+
+    def _stop_heartbeat(self, key: str, holder: str):
+        stop = self._heartbeats.pop((key, holder), None)
+        if stop is not None:
+            stop.set()
+
+    def release(self, url: str, holder: str):
+        self._stop_heartbeat(story_key(url), holder)
+        with self._locked():
+            index = self._load()
+            entry = index.get(story_key(url))
+            if entry is not None and holder in entry.get("refs", {}):
+                del entry["refs"][holder]
+                self._save(index)
+        self.evict()
+
+    def size(self, index: Optional[Dict] = None) -> int:
+        if index is None:
+            with self._locked():
+                index = self._load()
+        objects = {c["hash"]: c["size"] for entry in index.values() for c in entry["chapters"].values()}
+        return sum(objects.values())
+
+    def evict(self) -> List[str]:
+        """Drop least recently used, unreferenced stories until the cache fits max_bytes"""
+        evicted = []
+        with self._locked():
+            index = self._load()
+            candidates = sorted(
+                (key for key, entry in index.items() if not self._live_refs(entry)),
+                key=lambda key: index[key].get("last_used", 0),
+            )
+            while candidates and self.size(index) > self.max_bytes:
+                key = candidates.pop(0)
+                entry = index.pop(key)
+                shutil.rmtree(os.path.join(self.root, "stories", key), ignore_errors=True)
+                evicted.append(entry["url"])
+            if evicted:
+                live = {c["hash"] for entry in index.values() for c in entry["chapters"].values()}
+                for dirpath, _, files in os.walk(os.path.join(self.root, "objects")):
+                    for fname in files:
+                        if fname[:-4] not in live:
+                            os.remove(os.path.join(dirpath, fname))
+                self._save(index)
+        return evicted
@@ -0,0 +1,163 @@
+"""
+Opt-in timing spans from crawl to summary.
+
+Set AUTOSUMMARY_PROFILE=1 (or to a file path) to record nested spans for each stage.
+At exit the spans are written as a Chrome trace (open it in chrome://tracing or
+https://ui.perfetto.dev) and a table of the stages with the most self time is printed.
+When profiling is off `span()` returns a shared no-op context manager, so the
+instrumentation costs one global lookup per call.
+
+    from profiling import span
+    with span("crawl.navigate", chapter=i):
+        driver.get(link)
+"""
+import os
+import sys
+import json
+import time
+import atexit
+import asyncio
+import threading
+import contextvars
+from collections import defaultdict
+from contextlib import nullcontext
+from typing import Dict, List, Optional
+
+DEFAULT_TRACE_PATH = "profile_trace.json"
+
+_enabled = False
+_trace_path = None
+_records: List[Dict] = []
+_records_lock = threading.Lock()
+_current = contextvars.ContextVar("autosummary_span", default=None)
+_lanes: Dict = {}
+_origin = time.perf_counter()
+_NOOP = nullcontext()
+
+class _Span:
+    __slots__ = ("name", "args", "parent", "start", "child_time", "token")
+
+    def __init__(self, name: str, args: Dict):
+        self.name = name
+        self.args = args
+        self.child_time = 0.0
+
+    def __enter__(self):
+        self.parent = _current.get()
+        self.token = _current.set(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter()
+        duration = end - self.start
+        _current.reset(self.token)
+        if self.parent is not None:
+            self.parent.child_time += duration
+        if exc_type is not None:
+            self.args = {**self.args, "error": exc_type.__name__}
+        record = {
+            "name": self.name,
+            "start": self.start - _origin,
+            "duration": duration,
+            "self": max(0.0, duration - self.child_time),
+            "lane": _lane(),
+            "args": self.args,
+        }
+        with _records_lock:
+            _records.append(record)
+        return False
+
+def _lane() -> int:
+    """Trace viewer row: one per asyncio task, or per thread outside an event loop"""
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        task = None
+    key = id(task) if task is not None else ("thread", threading.get_ident())
+    if key not in _lanes:
+        _lanes[key] = len(_lanes) + 1
+    return _lanes[key]
+
+def enabled() -> bool:
+    return _enabled
+
+def enable(trace_path: Optional[str] = DEFAULT_TRACE_PATH, report_at_exit: bool = True):
+    """Start recording spans. With report_at_exit the trace and table are written when the process ends."""
+    global _enabled, _trace_path
+    if report_at_exit and _trace_path is None and trace_path:
+        atexit.register(_report_at_exit)
+    _enabled = True
+    _trace_path = trace_path
+
+def disable():
+    global _enabled
+    _enabled = False
+
+def reset():
+    with _records_lock:
+        _records.clear()
+    _lanes.clear()
+
+def span(name: str, **args):
+    """Context manager timing one stage; nests under the enclosing span of the same task"""
+    if not _enabled:
+        return _NOOP
+    return _Span(name, args)
+
+def records() -> List[Dict]:
+    with _records_lock:
+        return list(_records)
+
+def export_chrome_trace(path: str = DEFAULT_TRACE_PATH) -> str:
+    """Write the spans in the Chrome trace event format ("X" complete events, microseconds)"""
+    events = [
+        {
+            "name": r["name"],
+            "cat": r["name"].split(".", 1)[0],
+            "ph": "X",
+            "ts": round(r["start"] * 1e6, 1),
+            "dur": round(r["duration"] * 1e6, 1),
+            "pid": os.getpid(),
+            "tid": r["lane"],
+            "args": {k: v if isinstance(v, (int, float, bool, str)) or v is None else str(v) for k, v in r["args"].items()},
+        }
+        for r in records()
+    ]
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+    return path
+
+def summary(top: int = 15) -> List[Dict]:
+    """Per stage: calls, total, self (total minus nested spans), mean and max seconds, by self time"""
+    stages = defaultdict(lambda: {"calls": 0, "total": 0.0, "self": 0.0, "max": 0.0})
+    for r in records():
+        stage = stages[r["name"]]
+        stage["calls"] += 1
+        stage["total"] += r["duration"]
+        stage["self"] += r["self"]
+        stage["max"] = max(stage["max"], r["duration"])
+    rows = [{"name": name, **stage, "mean": stage["total"] / stage["calls"]} for name, stage in stages.items()]
+    return sorted(rows, key=lambda row: -row["self"])[:top]
+
+def format_summary(top: int = 15) -> str:
+    rows = summary(top)
+    wall = sum(row["self"] for row in summary(top=10**6)) or 1.0
+    lines = [f"{'stage':<28} {'calls':>7} {'total s':>9} {'self s':>9} {'self %':>7} {'mean ms':>9} {'max ms':>9}"]
+    for row in rows:
+        lines.append(
+            f"{row['name']:<28} {row['calls']:>7} {row['total']:>9.2f} {row['self']:>9.2f} "
+            f"{row['self'] / wall:>7.1%} {row['mean'] * 1e3:>9.1f} {row['max'] * 1e3:>9.1f}"
+        )
+    return "\n".join(lines)
+
+def _report_at_exit():
+    if not _records:
+        return
+    path = export_chrome_trace(_trace_path or DEFAULT_TRACE_PATH)
+    print(f"\nProfile: {len(_records)} spans written to {path}", file=sys.stderr)
+    print(format_summary(), file=sys.stderr)
+
+_env = os.getenv("AUTOSUMMARY_PROFILE", "").strip()
+if _env and _env.lower() not in ("0", "false", "no", "off"):
+    enable(DEFAULT_TRACE_PATH if _env.lower() in ("1", "true", "yes", "on") else _env)